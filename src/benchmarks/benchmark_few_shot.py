@@ -0,0 +1,157 @@
+"""Validity rate against prompt tokens saved by dynamic few-shot selection.
+
+Runs create_dataset.py on CVs held out of the few-shot pool once per
+configuration: the two hand-written examples, then 0-2 retrieved examples
+under optional token budgets. Each run's records are validated (parse, schema
+and grounding in the CV), and the table reports the prompt tokens per request,
+the share saved against the first run, the validity rate and the cost per
+valid record. Without --base_url the runs go to a fresh mock server; with it,
+to the real endpoint, which is what makes the validity column meaningful.
+
+    python src/benchmarks/benchmark_few_shot.py --pool_path data/few_shot_pool.jsonl --num_records 200
+    python src/benchmarks/benchmark_few_shot.py --pool_path data/few_shot_pool.jsonl --base_url https://openrouter.ai/api/v1
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+PROJECT_ROOT = os.getenv("PROJECT_ROOT")
+
+import sys
+sys.path.append(os.path.join(PROJECT_ROOT, "src"))
+sys.path.append(os.path.join(PROJECT_ROOT, "src", "benchmarks"))
+
+import argparse
+import collections
+import json
+import shlex
+import subprocess
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from utils.dataset_creation_prompts import json_schema
+from utils.few_shot import FewShotRetriever
+from utils.record_validation import validate_extraction
+from utils.result_store import JsonlResultStore
+from load_test import CREATE_DATASET_SCRIPT, start_server
+
+DEFAULT_RUNS = [
+    "static=",
+    "top2=--few_shot_pool {pool} --few_shot_examples 2",
+    "top2-2k=--few_shot_pool {pool} --few_shot_examples 2 --few_shot_token_budget 2000",
+    "top1=--few_shot_pool {pool} --few_shot_examples 1",
+    "none=--few_shot_pool {pool} --few_shot_examples 0",
+]
+
+
+def run(name: str, run_args: str, input_path: str, work_dir: str, args: argparse.Namespace) -> Dict[str, Any]:
+    run_dir = os.path.join(work_dir, name)
+    os.makedirs(run_dir, exist_ok=True)
+    server = None if args.base_url else start_server(args.port, args.server_args)
+    try:
+        command = [
+            sys.executable, CREATE_DATASET_SCRIPT,
+            "--base_url", args.base_url or f"http://127.0.0.1:{args.port}/v1",
+            "--model_index", str(args.model_index),
+            "--input_path", input_path,
+            "--store_path", os.path.join(run_dir, "store.jsonl"),
+            "--ledger_path", os.path.join(run_dir, "ledger.jsonl"),
+            "--no_cache",
+            "--skip_export",
+            *shlex.split(run_args.format(pool=args.pool_path)),
+        ]
+        env = {**os.environ, "OPENROUTER_API_KEY": os.getenv("OPENROUTER_API_KEY") or "mock"}
+        start = time.perf_counter()
+        with open(os.path.join(run_dir, "create_dataset.log"), "w") as log:
+            returncode = subprocess.run(command, env=env, stdout=log, stderr=subprocess.STDOUT).returncode
+        wall = time.perf_counter() - start
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    reasons: collections.Counter = collections.Counter()
+    examples = 0
+    records = list(JsonlResultStore(os.path.join(run_dir, "store.jsonl")).iter_records())
+    for record in records:
+        reasons[validate_extraction(record.get("json"), record["Text"], json_schema, args.min_grounding, record.get("repairs", ()))] += 1
+        # Records without "few_shot" had the two hand-written examples
+        examples += len(record["few_shot"]) if "few_shot" in record else 2
+    with open(os.path.join(run_dir, "ledger.jsonl")) as f:
+        ledger = [json.loads(line) for line in f if line.strip()][-1]
+    totals = next(iter(ledger["models"].values()))
+    return {
+        "name": name, "returncode": returncode, "wall": wall, "records": len(records),
+        "valid": reasons.pop(None, 0), "reasons": dict(reasons), "examples": examples,
+        "requests": totals["requests"], "prompt_tokens": totals["prompt_tokens"], "cost": ledger["cost"],
+    }
+
+
+def report(results: List[Dict[str, Any]]) -> None:
+    baseline = results[0]["prompt_tokens"] / max(results[0]["requests"], 1)
+    print(
+        f"\n{'run':<10} {'records':>8} {'ex/req':>7} {'prompt/req':>11} {'saved':>7} {'valid':>7} "
+        f"{'$/1k valid':>11} {'wall s':>7}  invalid by reason"
+    )
+    for r in results:
+        prompt_per_request = r["prompt_tokens"] / max(r["requests"], 1)
+        print(
+            f"{r['name']:<10} {r['records']:>8} {r['examples'] / max(r['records'], 1):>7.2f} {prompt_per_request:>11.0f} "
+            f"{1 - prompt_per_request / baseline:>7.1%} {r['valid'] / max(r['records'], 1):>7.1%} "
+            f"{r['cost'] / max(r['valid'], 1) * 1000:>11.3f} {r['wall']:>7.1f}  {r['reasons'] or ''}"
+            + (f"  (exit code {r['returncode']})" if r["returncode"] else "")
+        )
+    print(
+        f"\nsaved = prompt tokens per request saved against {results[0]['name']}; valid = records that parse, "
+        f"conform to the schema and are grounded in the CV."
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dynamic few-shot selection: validity against tokens saved.")
+    parser.add_argument("--pool_path", type=str, default="data/few_shot_pool.jsonl", help="Pool from build_few_shot_pool.py, relative to PROJECT_ROOT.")
+    parser.add_argument("--input_path", type=str, default="data/preprocessed_dataset.json", help="Dataset whose CVs outside the pool are labelled, relative to PROJECT_ROOT.")
+    parser.add_argument("--num_records", type=int, default=200, help="Held-out CVs per run.")
+    parser.add_argument("--runs", type=str, nargs="+", default=DEFAULT_RUNS, help="Runs as NAME=CREATE_DATASET_ARGS; {pool} stands for --pool_path. The first run is the baseline.")
+    parser.add_argument("--base_url", type=str, default=None, help="Real endpoint to benchmark; the mock server by default.")
+    parser.add_argument("--server_args", type=str, default="--latency 0.2 --tokens_per_sec 0", help="Arguments of mock_openai_server.py.")
+    parser.add_argument("--model_index", type=int, default=3)
+    parser.add_argument("--min_grounding", type=float, default=0.8, help="Share of the JSON values that must appear in the CV.")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--output_dir", type=str, default=None, help="Directory of the run logs and results; a temporary one by default.")
+    args = parser.parse_args()
+
+    pool = list(JsonlResultStore(os.path.join(PROJECT_ROOT, args.pool_path)).iter_records())
+    pool_ids = {example["ID"] for example in pool}
+    with open(os.path.join(PROJECT_ROOT, args.input_path), "rb") as f:
+        dataset = [row for row in json.load(f) if row["ID"] not in pool_ids][:args.num_records]
+
+    # Local cost of the retrieval, which every request pays
+    start = time.perf_counter()
+    retriever = FewShotRetriever(pool)
+    fit_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for row in dataset:
+        retriever.select(row["Text"], 2)
+    select_ms = (time.perf_counter() - start) / max(len(dataset), 1) * 1000
+    print(f"Pool of {len(pool)} examples indexed in {fit_seconds:.2f}s; {select_ms:.2f} ms per selection")
+
+    work_dir = args.output_dir or tempfile.mkdtemp(prefix="few_shot_")
+    os.makedirs(work_dir, exist_ok=True)
+    input_path = os.path.join(work_dir, "input.json")
+    with open(input_path, "w") as f:
+        json.dump(dataset, f)
+    print(f"Writing run logs to {work_dir}")
+
+    results = []
+    for run_spec in args.runs:
+        name, _, run_args = run_spec.partition("=")
+        print(f"Running {name}: {run_args}")
+        results.append(run(name, run_args, input_path, work_dir, args))
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
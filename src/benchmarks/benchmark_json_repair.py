@@ -0,0 +1,154 @@
+"""Share of failed teacher responses that the local JSON repair saves from another request.
+
+Runs on a corpus of responses recorded by `create_dataset.py --failed_responses_path`,
+or on a synthetic corpus of schema-shaped responses corrupted in the ways seen
+from teacher models. For each response it checks the strict parse of
+`extract_json_from_response` before the repair engine, then `repair_json`, and
+reports the repaired share, the repairs applied and the time per response. On
+the synthetic corpus it also reports how often the repair restored exactly the
+JSON the corrupted response was meant to be.
+
+    python src/benchmarks/benchmark_json_repair.py --corpus data/failed_responses.jsonl
+    python src/benchmarks/benchmark_json_repair.py --synthetic 2000
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+PROJECT_ROOT = os.getenv("PROJECT_ROOT")
+
+import sys
+sys.path.append(os.path.join(PROJECT_ROOT, "src"))
+sys.path.append(os.path.join(PROJECT_ROOT, "src", "benchmarks"))
+
+import argparse
+import collections
+import json
+import random
+import re
+import time
+from typing import Any, Dict, List
+
+from utils.json_repair import repair_json, reconcile_with_schema
+from utils.provider_router import percentile
+from mock_openai_server import MALFORMED_KINDS, build_canned_response, malform
+
+with open(os.path.join(PROJECT_ROOT, "resume_json_schema.json"), "r") as f:
+    json_schema = json.load(f)
+
+CORRUPTIONS = MALFORMED_KINDS + ("unescaped_quote", "missing_comma", "python_literal", "fence", "raw_newline")
+
+
+def corrupt(content: str, kind: str, rng: random.Random) -> tuple:
+    """Returns the corrupted response and the valid JSON text it was meant to be, or None if it has none."""
+    if kind == "truncated":
+        return malform(content, kind), None
+    if kind in MALFORMED_KINDS:
+        return malform(content, kind), content
+    if kind == "unescaped_quote":
+        pattern = r'": "(\w+) '
+        return (
+            re.sub(pattern, lambda m: f'": "{m.group(1)} "quoted" ', content, count=1),
+            re.sub(pattern, lambda m: f'": "{m.group(1)} \\"quoted\\" ', content, count=1)
+        )
+    if kind == "missing_comma":
+        separators = [m.start() for m in re.finditer(r'", "', content)]
+        if not separators:
+            return content, content
+        i = rng.choice(separators)
+        return content[:i + 1] + content[i + 2:], content
+    if kind == "python_literal":
+        return content.replace('""', "None", 1), content.replace('""', "null", 1)
+    if kind == "fence":
+        return f"```json\n{content}\n```", content
+    return content.replace('": "', '": "line\n', 1), content.replace('": "', '": "line\\n', 1)
+
+
+def strict_parse(response: str) -> Any:
+    """The parse of `extract_json_from_response` before the repair engine."""
+    try:
+        if "```json" in response:
+            response = response.replace("```json", "").replace("```", "").strip()
+        return json.loads(response.strip())
+    except json.JSONDecodeError:
+        return None
+
+
+def make_synthetic_corpus(size: int, seed: int) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    words = "python engineer led team university bachelor 2019 sales data cloud manager athens".split()
+    corpus = []
+    for i in range(size):
+        cv_text = " ".join(rng.choice(words) for _ in range(200))
+        kind = CORRUPTIONS[i % len(CORRUPTIONS)]
+        content, intended = corrupt(json.dumps(build_canned_response(json_schema, cv_text, rng), ensure_ascii=False), kind, rng)
+        corpus.append({
+            "ID": i, "content": content, "kind": kind, "intended": json.loads(intended) if intended else None
+        })
+    return corpus
+
+
+def load_corpus(filepath: str) -> List[Dict[str, Any]]:
+    with open(filepath) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local JSON repair on failed responses.")
+    parser.add_argument("--corpus", type=str, default="data/failed_responses.jsonl", help="Recorded failed responses, relative to PROJECT_ROOT.")
+    parser.add_argument("--synthetic", type=int, default=0, help="Benchmark this many synthetic corrupted responses instead of --corpus.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        corpus = make_synthetic_corpus(args.synthetic, args.seed)
+        print(f"Synthetic corpus of {len(corpus)} responses")
+    else:
+        corpus = load_corpus(os.path.join(PROJECT_ROOT, args.corpus))
+        print(f"Corpus of {len(corpus)} responses from {args.corpus}")
+
+    repair_counts: collections.Counter = collections.Counter()
+    by_kind: Dict[str, collections.Counter] = collections.defaultdict(collections.Counter)
+    timings = []
+    strict_ok = repaired = 0
+    for item in corpus:
+        stats = by_kind[item.get("kind", "recorded")]
+        stats["responses"] += 1
+        if strict_parse(item["content"]) is not None:
+            strict_ok += 1
+            stats["strict"] += 1
+            continue
+        start = time.perf_counter()
+        response_json, repairs = repair_json(item["content"], json_schema)
+        timings.append(time.perf_counter() - start)
+        if response_json is None:
+            continue
+        repaired += 1
+        stats["repaired"] += 1
+        repair_counts.update(repairs)
+        if item.get("intended") is not None:
+            stats["comparable"] += 1
+            stats["exact"] += response_json == reconcile_with_schema(json_schema, item["intended"])[0]
+
+    failed = len(corpus) - strict_ok
+    print(f"\nParsed by the strict parser: {strict_ok}")
+    print(f"Failed the strict parser:    {failed}")
+    print(f"Repaired locally:            {repaired} ({repaired / failed if failed else 0:.1%} of the failed responses, "
+          f"i.e. requests saved)")
+    if timings:
+        print(f"Repair time:                 mean {sum(timings) / len(timings) * 1000:.2f} ms, "
+              f"p95 {percentile(timings, 95) * 1000:.2f} ms per response")
+
+    print(f"\n{'repair':<18} {'responses':>10}")
+    for repair, count in repair_counts.most_common():
+        print(f"{repair:<18} {count:>10}")
+
+    print(f"\n{'kind':<18} {'responses':>10} {'strict':>8} {'repaired':>9} {'exact':>7}")
+    for kind, stats in sorted(by_kind.items()):
+        exact = f"{stats['exact']:>7}" if stats["comparable"] else f"{'-':>7}"
+        print(f"{kind:<18} {stats['responses']:>10} {stats['strict']:>8} {stats['repaired']:>9} {exact}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Throughput of the placeholder substitution of preprocess_dataset.py on synthetic CVs.
+
+Generates --num_cvs CVs of --cv_words words, a share of them with [job title],
+[language] and [skill] placeholders in mixed casings, and languages mentioned
+in passing. The substitution engine of dataset_utils.py runs once per worker
+count; the per-row implementation it replaced runs on --legacy_sample CVs and
+is extrapolated. The table reports the CVs per second, the CVs whose text
+actually changed in the DataFrame, and the placeholders left behind.
+
+    python src/benchmarks/benchmark_placeholders.py --num_cvs 1000000 --workers 1 8
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+PROJECT_ROOT = os.getenv("PROJECT_ROOT")
+
+import sys
+sys.path.append(os.path.join(PROJECT_ROOT, "src"))
+
+import argparse
+import random
+import re
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from utils.dataset_utils import LANGUAGES, load_job_titles, substitute_placeholders
+
+WORDS = (
+    "experienced managed developed led team project client budget sales data analysis report customer growth "
+    "training research python sql excel cloud university bachelor master senior junior intern 2015 2018 2021 present"
+).split()
+PLACEHOLDER_VARIANTS = {
+    "job title": ["[job title]", "[Job Title]", "[Job title]", "[JOB TITLE]"],
+    "language": ["[language]", "[Language]", "[LANGUAGE]"],
+    "skill": ["[Skill]", "[skill]", "[SKILL]"],
+}
+# Substituted placeholders, in any casing
+LEFT_PATTERN = re.compile(r"\[(?:job title|language)\]", re.IGNORECASE)
+
+
+def make_cvs(num_cvs: int, cv_words: int, placeholder_rate: float, skill_rate: float, seed: int) -> pd.DataFrame:
+    rng = random.Random(seed)
+    categories = list(load_job_titles())
+    texts, cv_categories = [], []
+    for _ in range(num_cvs):
+        words = rng.choices(WORDS, k=cv_words)
+        if rng.random() < 0.2:
+            words[rng.randrange(cv_words)] = rng.choice(LANGUAGES)
+        if rng.random() < placeholder_rate:
+            for _ in range(rng.randint(1, 3)):
+                words[rng.randrange(cv_words)] = rng.choice(PLACEHOLDER_VARIANTS["job title"])
+            for _ in range(rng.randint(0, 3)):
+                words[rng.randrange(cv_words)] = rng.choice(PLACEHOLDER_VARIANTS["language"])
+            if rng.random() < skill_rate:
+                words[rng.randrange(cv_words)] = rng.choice(PLACEHOLDER_VARIANTS["skill"])
+        texts.append(" ".join(words))
+        cv_categories.append(rng.choice(categories))
+    return pd.DataFrame({"ID": range(1, num_cvs + 1), "Category": cv_categories, "Text": texts})
+
+
+def legacy_substitution(df: pd.DataFrame) -> pd.DataFrame:
+    """replace_job_title, replace_language and remove_skill as they were before the engine."""
+    category_to_job_titles_dict = load_job_titles()
+    job_title_comb = ['[job title]', '[Job Title]', '[Job title]', '[job Title]', '[JOB TITLE]']
+    for _, row in df.iterrows():
+        if not any([jb_title_cb in row['Text'] for jb_title_cb in job_title_comb]):
+            continue
+        for jb_title_cb in job_title_comb:
+            if jb_title_cb in row['Text']:
+                random_job_title = random.choice(category_to_job_titles_dict[row['Category']])
+                row['Text'] = row['Text'].replace(jb_title_cb, random_job_title)
+
+    language_comb = ['[language]', '[Language]', '[LANGUAGE]']
+    for _, row in df.iterrows():
+        if not any([lang_cb in row['Text'] for lang_cb in language_comb]):
+            continue
+        for lang_cb in language_comb:
+            if lang_cb in row['Text']:
+                occurrences = row['Text'].count(lang_cb)
+                idx_languages_found = []
+                for idx, language in enumerate(LANGUAGES):
+                    if language.lower() in row['Text'].lower():
+                        idx_languages_found.append(idx)
+                curr_languages = [v for i, v in enumerate(LANGUAGES) if i not in idx_languages_found]
+                random_languages = np.random.choice(curr_languages, replace=False, size=occurrences)
+                for occurrence in range(occurrences):
+                    row['Text'] = row['Text'].replace(lang_cb, random_languages[occurrence])
+
+    skills_comb = ['[Skill]', '[skill]', '[SKILL]']
+    not_found_skill = [not any([sk_cb in row['Text'] for sk_cb in skills_comb]) for _, row in df.iterrows()]
+    return df[not_found_skill]
+
+
+def measure(name: str, df: pd.DataFrame, run) -> Dict[str, Any]:
+    original = df["Text"].copy()
+    start = time.perf_counter()
+    kept = run(df)
+    seconds = time.perf_counter() - start
+    return {
+        "name": name,
+        "cvs": len(df),
+        "seconds": seconds,
+        "changed": int((df["Text"] != original).sum()),
+        "kept": len(kept),
+        "left": int(kept["Text"].str.contains(LEFT_PATTERN).sum()),
+    }
+
+
+def report(results: List[Dict[str, Any]]) -> None:
+    print(f"\n{'implementation':<20} {'CVs':>9} {'seconds':>9} {'CVs/s':>10} {'s per 1M':>9} {'changed':>9} {'kept':>9} {'left':>7}")
+    for r in results:
+        print(
+            f"{r['name']:<20} {r['cvs']:>9} {r['seconds']:>9.2f} {r['cvs'] / r['seconds']:>10.0f} "
+            f"{r['seconds'] / r['cvs'] * 1e6:>9.1f} {r['changed']:>9} {r['kept']:>9} {r['left']:>7}"
+        )
+    print(
+        "\nchanged = CVs whose text changed in the DataFrame; kept = CVs without a [skill] placeholder; "
+        "left = kept CVs still holding a [job title] or [language] placeholder."
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the placeholder substitution of the preprocessing.")
+    parser.add_argument("--num_cvs", type=int, default=1_000_000)
+    parser.add_argument("--cv_words", type=int, default=100)
+    parser.add_argument("--placeholder_rate", type=float, default=0.3, help="Share of the CVs with placeholders.")
+    parser.add_argument("--skill_rate", type=float, default=0.1, help="Share of the CVs with placeholders that also have a [skill].")
+    parser.add_argument("--legacy_sample", type=int, default=20000, help="CVs run through the per-row implementation.")
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, os.cpu_count()}))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df = make_cvs(args.num_cvs, args.cv_words, args.placeholder_rate, args.skill_rate, args.seed)
+    print(f"Generated {len(df)} CVs in {time.perf_counter() - start:.1f}s")
+
+    results = [measure("per-row (before)", df.iloc[:args.legacy_sample].copy(), legacy_substitution)]
+    for workers in args.workers:
+        results.append(measure(
+            f"engine, {workers} workers",
+            df.copy(),
+            lambda frame: frame[~substitute_placeholders(frame, workers=workers, seed=args.seed)]
+        ))
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Microbenchmark of lock contention in the rate limiters used by create_dataset.py.
+
+Compares the previous sliding-window limiter, which slept while holding its lock,
+with `TokenBucketRateLimiter` at 16, 64 and 256 worker threads. For each run it
+reports the achieved acquisition rate, the latency of a limiter call and the time
+workers spent blocked on the limiter lock.
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+PROJECT_ROOT = os.getenv("PROJECT_ROOT")
+
+import sys
+sys.path.append(os.path.join(PROJECT_ROOT, "src"))
+
+import argparse
+import statistics
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+from utils.rate_limiting import TokenBucketRateLimiter
+
+
+class TimedLock:
+    """threading.Lock that records how long each acquisition waited."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.waits: List[float] = []
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self._lock.acquire()
+        self.waits.append(time.perf_counter() - start)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._lock.release()
+
+
+class LegacyRateLimiter:
+    """The sliding-window limiter previously defined in create_dataset.py, kept as the baseline."""
+
+    def __init__(self):
+        self._locks: Dict[str, TimedLock] = defaultdict(TimedLock)
+        self._request_times: Dict[str, list] = defaultdict(list)
+        self._last_request_time: Dict[str, float] = defaultdict(float)
+
+    def wait_if_needed(self, model_name: str, rpm_limit: int, min_interval: float = 1.0) -> None:
+        with self._locks[model_name]:
+            now = time.time()
+            self._request_times[model_name] = [
+                req_time for req_time in self._request_times[model_name]
+                if now - req_time < 60
+            ]
+            if len(self._request_times[model_name]) >= rpm_limit:
+                oldest_request = self._request_times[model_name][0]
+                wait_time = 60 - (now - oldest_request) + 0.1
+                if wait_time > 0:
+                    time.sleep(wait_time)
+                    now = time.time()
+            last_request = self._last_request_time[model_name]
+            if last_request > 0:
+                time_since_last = now - last_request
+                if time_since_last < min_interval:
+                    time.sleep(min_interval - time_since_last)
+                    now = time.time()
+            self._request_times[model_name].append(now)
+            self._last_request_time[model_name] = now
+
+
+def run_workers(num_workers: int, duration: float, acquire: Callable[[], None]) -> tuple:
+    """Calls `acquire` from `num_workers` threads for `duration` seconds.
+
+    Returns the call latencies and the elapsed time, which includes the calls still sleeping at the deadline.
+    """
+    latencies: List[float] = []
+    start_time = time.perf_counter()
+    deadline = start_time + duration
+    start_barrier = threading.Barrier(num_workers)
+
+    def worker():
+        start_barrier.wait()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            acquire()
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker) for _ in range(num_workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - start_time
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def report(name: str, num_workers: int, duration: float, latencies: List[float], lock_waits: List[float]) -> None:
+    print(
+        f"{name:<14} {num_workers:>7} {len(latencies) / duration:>10.0f} "
+        f"{statistics.mean(latencies) * 1e3:>10.2f} {percentile(latencies, 0.99) * 1e3:>10.2f} "
+        f"{percentile(lock_waits, 0.99) * 1e3:>12.3f} {sum(lock_waits) / (num_workers * duration) * 100:>10.1f}%"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rate limiter lock contention.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--duration", type=float, default=2.0, help="Seconds per run.")
+    parser.add_argument("--rpm", type=int, default=6000, help="RPM limit of the paced scenario.")
+    args = parser.parse_args()
+
+    header = (
+        f"{'limiter':<14} {'workers':>7} {'acq/s':>10} {'mean ms':>10} {'p99 ms':>10} "
+        f"{'p99 lock ms':>12} {'lock-blocked':>11}"
+    )
+
+    scenarios = [
+        ("unbounded", 10 ** 9, 0.0),
+        # The paced scenario emulates create_dataset.py: the legacy limiter enforces the
+        # rate through min_interval, the token bucket through its RPM bucket
+        ("paced", args.rpm, 60.0 / args.rpm),
+    ]
+    for scenario, rpm, min_interval in scenarios:
+        print(f"\n=== {scenario}: rpm={rpm} ===")
+        print(header)
+        for num_workers in args.workers:
+            legacy = LegacyRateLimiter()
+            latencies, elapsed = run_workers(
+                num_workers, args.duration,
+                lambda: legacy.wait_if_needed("model", rpm, min_interval)
+            )
+            report("legacy", num_workers, elapsed, latencies, legacy._locks["model"].waits)
+
+            limiter = TokenBucketRateLimiter()
+            limiter.backend._lock = TimedLock()
+            limiter.configure("model", rpm=rpm, burst_seconds=1.0)
+            latencies, elapsed = run_workers(
+                num_workers, args.duration,
+                lambda: limiter.acquire("model", input_tokens=1000, output_tokens=500)
+            )
+            report("token-bucket", num_workers, elapsed, latencies, limiter.backend._lock.waits)
+
+
+if __name__ == "__main__":
+    main()
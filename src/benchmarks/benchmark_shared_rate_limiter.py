@@ -0,0 +1,129 @@
+"""Benchmark of the rate limit backends shared by several create_dataset.py runs.
+
+Overhead: processes x threads call `reserve` + `settle` under a limit too high to
+wait on, and the table reports the acquisitions per second and the latency of
+a call for the in-memory backend (each process on its own) and the SQLite one.
+
+Fairness: runs with different concurrency acquire under one RPM limit for a
+while. With in-memory limiters every run spends the full limit; with the shared
+backend the runs split it and the total stays at the limit.
+
+    python src/benchmarks/benchmark_shared_rate_limiter.py --processes 1 2 4 --threads 4 --rpm 6000
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+PROJECT_ROOT = os.getenv("PROJECT_ROOT")
+
+import sys
+sys.path.append(os.path.join(PROJECT_ROOT, "src"))
+
+import argparse
+import multiprocessing
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+from utils.rate_limiting import TokenBucketRateLimiter, create_rate_limit_backend
+from utils.provider_router import percentile
+
+KEY = "model"
+
+
+def run_process(
+    backend: str, filepath: str, run_id: str, num_threads: int, duration: float, rpm: int, wait: bool,
+    start_at: float, results: multiprocessing.Queue
+) -> None:
+    """Calls the limiter from `num_threads` threads until `duration` seconds after `start_at`.
+
+    Reports the latency of each call and the number of requests granted before the deadline.
+    """
+    limiter = TokenBucketRateLimiter(create_rate_limit_backend(backend, filepath, run_id))
+    limiter.configure(KEY, rpm=rpm, input_tpm=rpm * 1000, burst_seconds=1.0)
+    latencies: List[float] = []
+    granted = []
+    deadline = start_at + duration
+
+    def worker():
+        while time.time() < deadline:
+            start = time.perf_counter()
+            reservation = limiter.reserve(KEY, input_tokens=1000, output_tokens=500)
+            latencies.append(time.perf_counter() - start)
+            if wait and reservation.delay > 0:
+                time.sleep(reservation.delay)
+            # Reservations made before the deadline may only be due after it
+            if time.time() <= deadline:
+                granted.append(1)
+            limiter.settle(reservation)
+
+    time.sleep(max(0.0, start_at - time.time()))
+    threads = [threading.Thread(target=worker) for _ in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    limiter.backend.close()
+    results.put((run_id, (latencies, len(granted))))
+
+
+def run_processes(
+    backend: str, thread_counts: List[int], duration: float, rpm: int, wait: bool
+) -> Dict[str, tuple]:
+    """Runs one process per thread count; returns the call latencies and granted requests of each."""
+    filepath = os.path.join(tempfile.mkdtemp(prefix="rate_limits_"), "rate_limits.sqlite")
+    # Configured once up front, so the runs do not race to create the database
+    create_rate_limit_backend(backend, filepath, "setup").close()
+    results: multiprocessing.Queue = multiprocessing.Queue()
+    start_at = time.time() + 1.0
+    processes = [
+        multiprocessing.Process(
+            target=run_process,
+            args=(backend, filepath, f"run{i}-x{num_threads}", num_threads, duration, rpm, wait, start_at, results)
+        )
+        for i, num_threads in enumerate(thread_counts)
+    ]
+    for process in processes:
+        process.start()
+    runs = dict(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    return dict(sorted(runs.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the shared rate limit backends.")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4], help="Numbers of processes of the overhead runs.")
+    parser.add_argument("--threads", type=int, default=4, help="Threads per process of the overhead runs.")
+    parser.add_argument("--fair_threads", type=int, nargs="+", default=[4, 32], help="Threads of each run of the fairness run.")
+    parser.add_argument("--duration", type=float, default=3.0, help="Seconds per overhead run.")
+    parser.add_argument("--fair_duration", type=float, default=20.0, help="Seconds of the fairness runs.")
+    parser.add_argument("--rpm", type=int, default=6000, help="RPM limit of the fairness run.")
+    args = parser.parse_args()
+
+    print("=== Overhead: reserve + settle without waiting ===")
+    print(f"{'backend':<8} {'procs':>6} {'threads':>8} {'acq/s':>10} {'mean us':>9} {'p50 us':>8} {'p99 us':>8}")
+    for backend in ("memory", "sqlite"):
+        for num_processes in args.processes:
+            runs = run_processes(backend, [args.threads] * num_processes, args.duration, 10 ** 9, wait=False)
+            values = [latency for latencies, _ in runs.values() for latency in latencies]
+            print(
+                f"{backend:<8} {num_processes:>6} {args.threads:>8} {len(values) / args.duration:>10.0f} "
+                f"{sum(values) / len(values) * 1e6:>9.1f} {percentile(values, 50) * 1e6:>8.1f} "
+                f"{percentile(values, 99) * 1e6:>8.1f}"
+            )
+
+    print(f"\n=== Fairness: runs with {args.fair_threads} threads under one limit of {args.rpm} RPM ===")
+    print(f"{'backend':<8} {'run':<12} {'RPM':>8} {'share':>7}")
+    for backend in ("memory", "sqlite"):
+        runs = run_processes(backend, args.fair_threads, args.fair_duration, args.rpm, wait=True)
+        total = sum(granted for _, granted in runs.values())
+        for run_id, (_, granted) in runs.items():
+            print(f"{backend:<8} {run_id:<12} {granted / args.fair_duration * 60:>8.0f} {granted / total:>7.1%}")
+        print(f"{backend:<8} {'total':<12} {total / args.fair_duration * 60:>8.0f} (limit {args.rpm}, plus the bursts)")
+
+
+if __name__ == "__main__":
+    main()
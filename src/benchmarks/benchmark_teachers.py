@@ -0,0 +1,220 @@
+"""Benchmark of the teacher models and providers, to choose the one large runs go to.
+
+Sends a fixed sample of CVs, stratified by Category, through every model of
+MODELS and every provider of its config (or OpenRouter's routing for models
+without pinned providers), with the sampling parameters of create_dataset.py.
+For each model/provider it measures the p50/p95 latency, the output tokens per
+second, the JSON validity rate (parse, schema and grounding), the schema
+completeness and the cost per valid record. The report ranks the candidates
+by valid records per dollar, which is throughput per dollar. Ties, e.g. free
+models, are broken by valid records per second. Candidates below --min_validity
+rank last.
+
+    python src/benchmarks/benchmark_teachers.py --per_category 5
+    python src/benchmarks/mock_openai_server.py --port 8800 --provider_latency chutes=2 &
+    python src/benchmarks/benchmark_teachers.py --base_url http://localhost:8800/v1
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+PROJECT_ROOT = os.getenv("PROJECT_ROOT")
+
+import sys
+sys.path.append(os.path.join(PROJECT_ROOT, "src"))
+sys.path.append(os.path.join(PROJECT_ROOT, "src", "scripts"))
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import logging
+import random
+import time
+from typing import Any, Dict, List
+
+from openai import OpenAI
+
+from utils.api_errors import classify_error
+from utils.http_transport import TransportSettings, create_http_client
+from utils.model_catalog import compute_cost
+from utils.provider_router import percentile
+from utils.record_validation import schema_completeness, validate_extraction
+from utils.dataset_creation_prompts import json_schema
+from create_dataset import (
+    MODELS,
+    get_model_config,
+    build_request_kwargs,
+    create_conversation,
+    parse_json_response,
+    route_request,
+)
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+
+def stratified_sample(dataset: List[Dict[str, Any]], per_category: int, seed: int) -> List[Dict[str, Any]]:
+    """Takes `per_category` CVs of each Category; the same seed gives the same sample."""
+    by_category = collections.defaultdict(list)
+    for row in dataset:
+        by_category[row.get("Category")].append(row)
+    rng = random.Random(seed)
+    sample = []
+    for category in sorted(by_category, key=str):
+        rows = sorted(by_category[category], key=lambda row: row["ID"])
+        sample.extend(rng.sample(rows, min(per_category, len(rows))))
+    return sample
+
+
+def list_candidates(model_indices: List[int]) -> List[tuple]:
+    """Returns the (model, provider) pairs to benchmark; provider None leaves the routing to OpenRouter."""
+    candidates = []
+    for model_index in model_indices:
+        model_name = MODELS[model_index]
+        for provider in get_model_config(model_name).get("providers") or [None]:
+            candidates.append((model_name, provider))
+    return candidates
+
+
+def run_candidate(
+    model_name: str, provider: str | None, sample: List[Dict[str, Any]], args: argparse.Namespace
+) -> List[Dict[str, Any]]:
+    """Sends every CV of the sample once, without retries, and returns the outcome of each request."""
+    config = get_model_config(model_name)
+    client = OpenAI(
+        api_key=config["api_key"],
+        base_url=args.base_url or config["base_url"],
+        max_retries=0,
+        timeout=TransportSettings().timeout(),
+        http_client=create_http_client(TransportSettings(), args.concurrency),
+    )
+
+    def send(row: Dict[str, Any]) -> Dict[str, Any]:
+        request_kwargs = route_request(build_request_kwargs(model_name, config, create_conversation(row["Text"])), provider)
+        outcome = {"ID": row["ID"], "Category": row.get("Category")}
+        start = time.monotonic()
+        try:
+            response = client.chat.completions.create(**request_kwargs)
+        except Exception as e:
+            outcome["error"] = classify_error(e)
+            return outcome
+        outcome["latency"] = time.monotonic() - start
+        outcome["completion_tokens"] = (response.usage.completion_tokens or 0) if response.usage else 0
+        outcome["cost"] = compute_cost(model_name, response.usage)
+        data, repairs = parse_json_response(response.choices[0].message.content or "")
+        outcome["repaired"] = bool(repairs) and data is not None
+        outcome["invalid"] = validate_extraction(data, row["Text"], json_schema, args.min_grounding, repairs)
+        outcome["completeness"] = schema_completeness(json_schema, data) if data is not None else 0.0
+        return outcome
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        outcomes = list(executor.map(send, sample))
+    client.close()
+    return outcomes
+
+
+def summarize(model_name: str, provider: str | None, outcomes: List[Dict[str, Any]], wall: float) -> Dict[str, Any]:
+    answered = [outcome for outcome in outcomes if "error" not in outcome]
+    valid = [outcome for outcome in answered if outcome["invalid"] is None]
+    latencies = [outcome["latency"] for outcome in answered]
+    speeds = [outcome["completion_tokens"] / outcome["latency"] for outcome in answered if outcome["latency"] > 0]
+    cost = sum(outcome["cost"] for outcome in answered)
+    by_category = collections.defaultdict(lambda: [0, 0])
+    for outcome in outcomes:
+        by_category[str(outcome["Category"])][0] += outcome.get("invalid", "error") is None
+        by_category[str(outcome["Category"])][1] += 1
+    return {
+        "model": model_name,
+        "provider": provider or "auto",
+        "requests": len(outcomes),
+        "errors": dict(collections.Counter(outcome["error"] for outcome in outcomes if "error" in outcome)),
+        "p50_latency": percentile(latencies, 50) if latencies else None,
+        "p95_latency": percentile(latencies, 95) if latencies else None,
+        "output_tokens_per_sec": percentile(speeds, 50) if speeds else None,
+        "validity": len(valid) / len(outcomes),
+        "invalid": dict(collections.Counter(outcome["invalid"] for outcome in answered if outcome["invalid"])),
+        "repaired": sum(outcome["repaired"] for outcome in answered),
+        "schema_completeness": sum(outcome["completeness"] for outcome in answered) / len(answered) if answered else 0.0,
+        "cost": cost,
+        "cost_per_valid": cost / len(valid) if valid else None,
+        "valid_per_dollar": len(valid) / cost if cost else None,
+        "valid_per_sec": len(valid) / wall,
+        "validity_by_category": {category: valid / total for category, (valid, total) in sorted(by_category.items())},
+    }
+
+
+def rank(summaries: List[Dict[str, Any]], min_validity: float) -> List[Dict[str, Any]]:
+    """Orders by valid records per dollar (free candidates first), then valid records per second."""
+    def key(summary: Dict[str, Any]) -> tuple:
+        if not summary["cost_per_valid"] and summary["validity"] > 0:
+            per_dollar = float("inf")
+        else:
+            per_dollar = summary["valid_per_dollar"] or 0.0
+        return summary["validity"] < min_validity, -per_dollar, -summary["valid_per_sec"]
+    return sorted(summaries, key=key)
+
+
+def report(ranked: List[Dict[str, Any]], min_validity: float) -> None:
+    print(
+        f"\n{'#':>2} {'model':<40} {'provider':<16} {'p50 s':>6} {'p95 s':>6} {'tok/s':>6} {'valid':>6} "
+        f"{'compl.':>6} {'$/1k valid':>11} {'valid/$':>8} {'valid/s':>8}  errors / invalid"
+    )
+    for position, s in enumerate(ranked, 1):
+        def number(value, spec):
+            return format(value, spec) if value is not None else "-"
+        print(
+            f"{position:>2} {s['model']:<40} {s['provider']:<16} {number(s['p50_latency'], '6.2f'):>6} "
+            f"{number(s['p95_latency'], '6.2f'):>6} {number(s['output_tokens_per_sec'], '6.0f'):>6} "
+            f"{s['validity']:>6.1%} {s['schema_completeness']:>6.1%} "
+            f"{number(s['cost_per_valid'] and s['cost_per_valid'] * 1000, '11.3f'):>11} "
+            f"{number(s['valid_per_dollar'], '8.0f'):>8} {s['valid_per_sec']:>8.2f}  "
+            f"{s['errors'] or ''} {s['invalid'] or ''}"
+        )
+    print(
+        f"\nRanked by valid records per dollar, then per second; validity below {min_validity:.0%} ranks last. "
+        f"tok/s = median output tokens per second of a request; compl. = schema completeness of the parsed JSON."
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the teacher models and providers on a stratified sample of CVs.")
+    parser.add_argument("--input_path", type=str, default="data/preprocessed_dataset.json", help="Dataset to sample, relative to PROJECT_ROOT.")
+    parser.add_argument("--per_category", type=int, default=3, help="CVs per Category in the sample.")
+    parser.add_argument("--models", type=int, nargs="+", default=list(range(len(MODELS))), help="Indices in MODELS to benchmark.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight per candidate.")
+    parser.add_argument("--min_grounding", type=float, default=0.8, help="Share of the JSON values that must appear in the CV.")
+    parser.add_argument("--min_validity", type=float, default=0.9, help="Validity rate below which a candidate ranks last.")
+    parser.add_argument("--base_url", type=str, default=None, help="OpenAI-compatible endpoint overriding the model configs, e.g. the mock server.")
+    parser.add_argument("--report_path", type=str, default="data/teacher_benchmark.json", help="Ranked report, relative to PROJECT_ROOT.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with open(os.path.join(PROJECT_ROOT, args.input_path), "rb") as f:
+        sample = stratified_sample(json.load(f), args.per_category, args.seed)
+    candidates = list_candidates(args.models)
+    print(f"{len(sample)} CVs ({args.per_category} per category) through {len(candidates)} models/providers")
+
+    summaries = []
+    for model_name, provider in candidates:
+        print(f"Running {model_name} via {provider or 'auto'}")
+        start = time.monotonic()
+        outcomes = run_candidate(model_name, provider, sample, args)
+        summaries.append(summarize(model_name, provider, outcomes, time.monotonic() - start))
+    ranked = rank(summaries, args.min_validity)
+    report(ranked, args.min_validity)
+
+    report_filepath = os.path.join(PROJECT_ROOT, args.report_path)
+    os.makedirs(os.path.dirname(report_filepath), exist_ok=True)
+    with open(report_filepath, "w") as f:
+        json.dump({
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "sample": {"per_category": args.per_category, "seed": args.seed, "ids": [row["ID"] for row in sample]},
+            "ranking": ranked,
+        }, f, indent=2)
+    print(f"Wrote the report to {report_filepath}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Load test of create_dataset.py against the local mock server.
+
+Each run starts a fresh mock server, runs create_dataset.py on the same input
+with its own arguments, and reports throughput, per-CV tail latency (from the
+first request for a CV to its last successful response) and retry
+amplification (requests per CV), the makespan and peak RSS of the client, and
+the cost per parsed and per valid CV.
+
+    python src/benchmarks/load_test.py --server_args "--latency 1 --rate_429 0.05" \\
+        --runs "threads=--engine threads --max_workers 32" "async=--engine async --max_in_flight 128"
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+PROJECT_ROOT = os.getenv("PROJECT_ROOT")
+
+import sys
+sys.path.append(os.path.join(PROJECT_ROOT, "src"))
+
+import argparse
+import json
+import random
+import shlex
+import subprocess
+import tempfile
+import time
+import urllib.request
+from typing import Any, Dict, List
+
+from utils.dataset_creation_prompts import json_schema
+from utils.record_validation import validate_extraction
+
+SERVER_SCRIPT = os.path.join(PROJECT_ROOT, "src", "benchmarks", "mock_openai_server.py")
+CREATE_DATASET_SCRIPT = os.path.join(PROJECT_ROOT, "src", "scripts", "create_dataset.py")
+CATEGORIES = ["ENGINEERING", "HR", "FINANCE", "HEALTHCARE", "SALES", "DESIGNER"]
+WORDS = (
+    "managed developed designed led team project python sql excel customer sales growth analysis "
+    "university bachelor master engineer manager senior junior intern 2015 2018 2021 present "
+    "communication leadership budget report training client marketing research data cloud"
+).split()
+
+
+def make_synthetic_dataset(num_records: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """CVs of random words with a lognormal length distribution similar to preprocessed_dataset.json."""
+    rng = random.Random(seed)
+    dataset = []
+    for i in range(num_records):
+        num_words = int(min(3000, max(50, rng.lognormvariate(6.0, 0.5))))
+        dataset.append({
+            "ID": i,
+            "Category": rng.choice(CATEGORIES),
+            "Text": " ".join(rng.choice(WORDS) for _ in range(num_words)),
+        })
+    return dataset
+
+
+def get_json(url: str, data: bytes | None = None) -> Dict[str, Any]:
+    with urllib.request.urlopen(urllib.request.Request(url, data=data), timeout=10) as response:
+        return json.loads(response.read())
+
+
+def start_server(port: int, server_args: str) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, SERVER_SCRIPT, "--port", str(port), *shlex.split(server_args)],
+        stdout=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            get_json(f"http://127.0.0.1:{port}/stats")
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"The mock server did not start on port {port}")
+
+
+def run(name: str, run_args: str, input_path: str, work_dir: str, args: argparse.Namespace) -> Dict[str, Any]:
+    run_dir = os.path.join(work_dir, name)
+    os.makedirs(run_dir, exist_ok=True)
+    server = start_server(args.port, args.server_args)
+    try:
+        command = [
+            sys.executable, CREATE_DATASET_SCRIPT,
+            "--base_url", f"http://127.0.0.1:{args.port}/v1",
+            "--model_index", str(args.model_index),
+            "--input_path", input_path,
+            "--store_path", os.path.join(run_dir, "store.jsonl"),
+            "--output_path", os.path.join(run_dir, "output.json"),
+            "--ledger_path", os.path.join(run_dir, "ledger.jsonl"),
+            "--no_cache",
+            "--skip_export",
+            *shlex.split(run_args),
+        ]
+        env = {**os.environ, "OPENROUTER_API_KEY": os.getenv("OPENROUTER_API_KEY") or "mock"}
+        start = time.perf_counter()
+        with open(os.path.join(run_dir, "create_dataset.log"), "w") as log:
+            process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+            # wait4 returns the resource usage of this child alone; ru_maxrss is in kilobytes on Linux
+            _, status, rusage = os.wait4(process.pid, 0)
+            process.returncode = returncode = os.waitstatus_to_exitcode(status)
+        wall = time.perf_counter() - start
+        stats = get_json(f"http://127.0.0.1:{args.port}/stats")
+    finally:
+        server.terminate()
+        server.wait()
+
+    parsed = valid = 0
+    store_path = os.path.join(run_dir, "store.jsonl")
+    if os.path.exists(store_path):
+        with open(store_path) as f:
+            for line in f:
+                record = json.loads(line)
+                parsed += bool(record.get("json"))
+                valid += validate_extraction(record.get("json"), record.get("Text", ""), json_schema, repairs=record.get("repairs", ())) is None
+    cost = 0.0
+    ledger_path = os.path.join(run_dir, "ledger.jsonl")
+    if os.path.exists(ledger_path):
+        with open(ledger_path) as f:
+            cost = sum(json.loads(line)["cost"] for line in f if line.strip())
+    return {
+        "name": name, "returncode": returncode, "wall": wall, "parsed": parsed, "valid": valid, "cost": cost,
+        "peak_rss_mb": rusage.ru_maxrss / 1024, **stats
+    }
+
+
+def report(results: List[Dict[str, Any]], num_records: int) -> None:
+    print(
+        f"\n{'run':<16} {'wall s':>8} {'CV/s':>7} {'parsed':>7} {'requests':>9} {'ampl.':>6} "
+        f"{'429':>6} {'5xx/404':>8} {'peak':>5} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'resp p99':>9} {'RSS MB':>7} "
+        f"{'tok/CV':>7} {'$/1k CV':>8} {'valid':>6} {'$/1k valid':>11}"
+    )
+    for r in results:
+        statuses = r["statuses"]
+        errors = sum(count for status, count in statuses.items() if status not in ("200", "429"))
+        parsed = max(r["parsed"], 1)
+        print(
+            f"{r['name']:<16} {r['wall']:>8.1f} {r['parsed'] / r['wall']:>7.1f} {r['parsed']:>7} "
+            f"{r['requests']:>9} {r['retry_amplification']:>6.2f} {statuses.get('429', 0):>6} {errors:>8} "
+            f"{r['peak_in_flight']:>5} {r['record_latency']['50']:>7.2f} {r['record_latency']['95']:>7.2f} "
+            f"{r['record_latency']['99']:>7.2f} {r['response_latency']['99']:>9.2f} {r['peak_rss_mb']:>7.0f} "
+            f"{(r['prompt_tokens'] + r['completion_tokens']) / parsed:>7.0f} {r['cost'] / parsed * 1000:>8.3f} "
+            f"{r['valid'] / parsed:>6.1%} {r['cost'] / max(r['valid'], 1) * 1000:>11.3f}"
+            + (f"  (exit code {r['returncode']})" if r["returncode"] else "")
+        )
+    print(
+        f"\n{num_records} CVs per run. ampl. = requests per CV (per request with packing); p50/p95/p99 = per-CV "
+        f"latency including retries; RSS MB = peak resident memory of create_dataset.py; tok/CV and $/1k CV = "
+        f"prompt + completion tokens and cost (from the run's ledger) per parsed CV; valid = share of the parsed "
+        f"CVs that conform to the schema and are grounded in the CV."
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test create_dataset.py against the mock server.")
+    parser.add_argument("--runs", type=str, nargs="+", default=[
+        "threads=--engine threads",
+        "async=--engine async --max_in_flight 64",
+    ], help="Runs as NAME=CREATE_DATASET_ARGS.")
+    parser.add_argument("--server_args", type=str, default="--latency 0.5 --rate_429 0.02 --rate_502 0.01 --rate_503 0.01",
+                        help="Arguments of mock_openai_server.py.")
+    parser.add_argument("--num_records", type=int, default=500, help="Number of synthetic CVs.")
+    parser.add_argument("--input_path", type=str, default=None, help="Use the first --num_records of this dataset instead of synthetic CVs.")
+    parser.add_argument("--model_index", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--output_dir", type=str, default=None, help="Directory of the run logs and results; a temporary one by default.")
+    args = parser.parse_args()
+
+    if args.input_path:
+        with open(os.path.join(PROJECT_ROOT, args.input_path), "rb") as f:
+            dataset = json.load(f)[:args.num_records]
+    else:
+        dataset = make_synthetic_dataset(args.num_records)
+
+    work_dir = args.output_dir or tempfile.mkdtemp(prefix="load_test_")
+    os.makedirs(work_dir, exist_ok=True)
+    input_path = os.path.join(work_dir, "input.json")
+    with open(input_path, "w") as f:
+        json.dump(dataset, f)
+    print(f"Writing run logs to {work_dir}")
+
+    results = []
+    for run_spec in args.runs:
+        name, _, run_args = run_spec.partition("=")
+        print(f"Running {name}: {run_args}")
+        results.append(run(name, run_args, input_path, work_dir, args))
+    report(results, len(dataset))
+
+
+if __name__ == "__main__":
+    main()
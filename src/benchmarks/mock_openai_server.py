@@ -0,0 +1,449 @@
+"""Local OpenAI-compatible server for benchmarking the dataset generation without API credits.
+
+Serves `/v1/chat/completions` (plain and streaming) with schema-shaped JSON built
+from words of the CV, plus the `/v1/files` and `/v1/batches` endpoints used by
+create_dataset_batch.py. Latency, throttling, server errors and malformed
+outputs are configurable, and `/stats` reports what the clients experienced.
+
+    python src/benchmarks/mock_openai_server.py --port 8800 --latency 1.5 --rate_429 0.05
+    python src/scripts/create_dataset.py --base_url http://localhost:8800/v1 ...
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+PROJECT_ROOT = os.getenv("PROJECT_ROOT")
+
+import sys
+sys.path.append(os.path.join(PROJECT_ROOT, "src"))
+
+import argparse
+import asyncio
+import collections
+import hashlib
+import json
+import math
+import random
+import time
+import uuid
+from typing import Any, Dict, List
+
+from aiohttp import web
+
+from utils.cv_packing import PACKED_CV
+from utils.model_catalog import compute_cost
+from utils.provider_router import percentile
+from utils.rate_limiting import estimate_tokens
+
+MALFORMED_KINDS = ("prose", "truncated", "runaway", "trailing_comma")
+# Source of the values of ungrounded responses: words that no CV of the dataset is made of
+HALLUCINATED_TEXT = "Quentin Zephyrine Xylophonics Vortexia Plc Summa Magna Laude 1899 Zzyzx Wyoming"
+
+
+def build_canned_response(schema: Any, cv_text: str, rng: random.Random) -> Any:
+    """Fills the schema with short runs of words taken from the CV, so the values are grounded in it."""
+    words = cv_text.split() or ["n/a"]
+
+    def fill(node: Any) -> Any:
+        if isinstance(node, dict):
+            return {key: fill(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [fill(node[0]) for _ in range(rng.randint(0, 3))]
+        if rng.random() < 0.2:
+            return ""
+        start = rng.randrange(len(words))
+        return " ".join(words[start:start + rng.randint(1, 4)])
+
+    return fill(schema)
+
+
+def malform(content: str, kind: str) -> str:
+    """Turns a valid JSON response into one of the bad generations seen from teacher models."""
+    if kind == "prose":
+        return f"Sure! Here is the extracted information:\n{content}\nLet me know if you need anything else."
+    if kind == "truncated":
+        return content[:len(content) // 2]
+    if kind == "runaway":
+        return content[:-1] + ', "skills": {"hard_skills": [' + ", ".join(['"Python"'] * 500) + "]}}"
+    return content[:-1] + ",}"
+
+
+class MockServer:
+    """State and handlers of the mock server; see `main` for the meaning of the options."""
+
+    def __init__(self, args: argparse.Namespace, schema: Dict[str, Any]):
+        self.args = args
+        self.schema = schema
+        self.provider_latency = dict(
+            (name, float(factor)) for name, factor in (item.split("=") for item in args.provider_latency)
+        )
+        self.ungrounded_rate = dict(
+            (name, float(rate)) for name, rate in (item.rsplit("=", 1) for item in args.ungrounded_rate)
+        )
+        self.seen_prefixes: set = set()
+        self.request_times: collections.deque = collections.deque()
+        self.files: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        self.started = time.monotonic()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.statuses: collections.Counter = collections.Counter()
+        self.malformed: collections.Counter = collections.Counter()
+        self.streams = 0
+        self.disconnects = 0
+        self.latencies: List[float] = []
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # Per CV: arrival of its first request, end of its last successful response, number of requests
+        self.records: Dict[str, List[float]] = {}
+
+    # ----- request model -----
+
+    def sample_latency(self, provider: str | None, completion_tokens: int, prefill_tokens: int = 0) -> tuple:
+        """Returns (time to first token, time to stream the completion)."""
+        args = self.args
+        ttft = args.latency * math.exp(random.gauss(0, args.latency_sigma))
+        if args.prefill_tokens_per_sec:
+            ttft += prefill_tokens / args.prefill_tokens_per_sec
+        if random.random() < args.tail_prob:
+            ttft *= args.tail_factor
+        factor = self.provider_latency.get(provider, 1.0)
+        generation = completion_tokens / args.tokens_per_sec if args.tokens_per_sec else 0.0
+        return ttft * factor, generation * factor
+
+    def sample_error(self) -> int | None:
+        args = self.args
+        if args.max_concurrency and self.in_flight >= args.max_concurrency:
+            return 429
+        if args.rpm:
+            now = time.monotonic()
+            while self.request_times and now - self.request_times[0] > 60:
+                self.request_times.popleft()
+            if len(self.request_times) >= args.rpm:
+                return 429
+            self.request_times.append(now)
+        draw = random.random()
+        for status, rate in ((429, args.rate_429), (502, args.rate_502), (503, args.rate_503), (404, args.rate_404)):
+            if draw < rate:
+                return status
+            draw -= rate
+        return None
+
+    def retry_after(self) -> float:
+        if self.args.rpm and self.request_times:
+            return max(0.0, 60 - (time.monotonic() - self.request_times[0]))
+        return self.args.retry_after
+
+    def make_content(self, body: Dict[str, Any]) -> str:
+        cv_text = body["messages"][-1]["content"]
+        if not isinstance(cv_text, str):
+            cv_text = " ".join(part.get("text", "") for part in cv_text)
+        rng = random.Random(hashlib.sha1(cv_text.encode()).hexdigest() + str(random.random()))
+        ungrounded_rate = self.ungrounded_rate.get(body["model"], 0.0)
+
+        def extract(text: str) -> Any:
+            if random.random() < ungrounded_rate:
+                self.malformed["ungrounded"] += 1
+                text = HALLUCINATED_TEXT
+            return build_canned_response(self.schema, text, rng)
+
+        packed = PACKED_CV.findall(cv_text)
+        if packed:
+            # One extraction per CV of a packed request, keyed by its id; some are left out with --pack_drop_rate
+            content = json.dumps({
+                cv_id: extract(text)
+                for cv_id, text in packed
+                if random.random() >= self.args.pack_drop_rate
+            }, ensure_ascii=False)
+        else:
+            content = json.dumps(extract(cv_text), ensure_ascii=False)
+        if random.random() < self.args.malformed_rate:
+            kind = random.choice(MALFORMED_KINDS)
+            self.malformed[kind] += 1
+            content = malform(content, kind)
+        return content
+
+    def make_usage(self, model: str, messages: List[Dict[str, Any]], content: str) -> Dict[str, Any]:
+        prompt_tokens = estimate_tokens(messages)
+        cached_tokens = 0
+        if self.args.prompt_cache and len(messages) > 1:
+            prefix = hashlib.sha1(json.dumps(messages[:-1], sort_keys=True).encode()).hexdigest()
+            if prefix in self.seen_prefixes:
+                cached_tokens = estimate_tokens(messages[:-1])
+            self.seen_prefixes.add(prefix)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": prompt_tokens + len(content) // 4,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        if self.args.report_cost:
+            usage["cost"] = compute_cost(model, usage)
+        return usage
+
+    @staticmethod
+    def error_response(status: int, retry_after: float | None = None) -> web.Response:
+        messages = {
+            429: "Rate limit exceeded",
+            502: "Bad gateway: upstream provider error",
+            503: "Service unavailable: provider overloaded",
+            404: "No endpoints found matching your data policy and provider constraints",
+        }
+        headers = {"Retry-After": str(math.ceil(retry_after))} if retry_after is not None else None
+        return web.json_response(
+            {"error": {"message": messages[status], "code": status}}, status=status, headers=headers
+        )
+
+    # ----- handlers -----
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        arrival = time.monotonic()
+        record_key = hashlib.sha1(json.dumps(body["messages"][-1], sort_keys=True).encode()).hexdigest()
+        record = self.records.setdefault(record_key, [arrival, 0.0, 0])
+        record[2] += 1
+        provider = ((body.get("provider") or {}).get("only") or [None])[0]
+
+        status = self.sample_error()
+        if status is not None:
+            self.statuses[status] += 1
+            if status != 429:
+                await asyncio.sleep(self.sample_latency(provider, 0)[0] * 0.1)
+            return self.error_response(status, self.retry_after() if status == 429 else None)
+
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            content = self.make_content(body)
+            usage = self.make_usage(body["model"], body["messages"], content)
+            ttft, generation = self.sample_latency(
+                provider, usage["completion_tokens"],
+                usage["prompt_tokens"] - usage["prompt_tokens_details"]["cached_tokens"]
+            )
+            if body.get("stream"):
+                response = await self.stream(request, body, content, usage, ttft, generation)
+            else:
+                await asyncio.sleep(ttft + generation)
+                response = web.json_response(self.completion(body, content, usage))
+        except asyncio.CancelledError:
+            self.disconnects += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        if response is None:
+            # The client closed the stream early, e.g. after aborting a bad generation
+            self.disconnects += 1
+            return web.Response()
+
+        self.statuses[200] += 1
+        self.latencies.append(time.monotonic() - arrival)
+        self.prompt_tokens += usage["prompt_tokens"]
+        self.completion_tokens += usage["completion_tokens"]
+        record[1] = time.monotonic()
+        return response
+
+    @staticmethod
+    def completion(body: Dict[str, Any], content: str, usage: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        }
+
+    async def stream(
+        self, request: web.Request, body: Dict[str, Any], content: str, usage: Dict[str, Any], ttft: float, generation: float
+    ) -> web.StreamResponse | None:
+        """Sends the content as server-sent events; returns None if the client disconnects."""
+        self.streams += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+        def event(delta: Dict[str, Any], finish_reason: str | None = None, chunk_usage: Dict[str, Any] | None = None) -> bytes:
+            chunk = {
+                "id": chunk_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if chunk_usage is None else [],
+            }
+            if chunk_usage is not None:
+                chunk["usage"] = chunk_usage
+            return f"data: {json.dumps(chunk)}\n\n".encode()
+
+        try:
+            await asyncio.sleep(ttft)
+            pieces = [content[i:i + self.args.chunk_chars] for i in range(0, len(content), self.args.chunk_chars)]
+            interval = generation / max(len(pieces), 1)
+            if random.random() < self.args.trickle_prob:
+                # A stuck generation that keeps the connection alive, which no read timeout catches
+                interval = self.args.trickle_interval
+            for piece in pieces:
+                await response.write(event({"content": piece}))
+                await asyncio.sleep(interval)
+            await response.write(event({}, "stop"))
+            if (body.get("stream_options") or {}).get("include_usage") or body.get("usage"):
+                await response.write(event({}, chunk_usage=usage))
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+        except ConnectionResetError:
+            return None
+        return response
+
+    async def upload_file(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        file_id = f"file-{uuid.uuid4().hex[:12]}"
+        self.files[file_id] = data["file"].file.read()
+        return web.json_response({
+            "id": file_id, "object": "file", "bytes": len(self.files[file_id]), "created_at": int(time.time()),
+            "filename": data["file"].filename, "purpose": data.get("purpose", "batch"), "status": "processed",
+        })
+
+    async def file_content(self, request: web.Request) -> web.Response:
+        file_id = request.match_info["file_id"]
+        if file_id not in self.files:
+            return self.error_response(404)
+        return web.Response(body=self.files[file_id], content_type="application/jsonl")
+
+    def batch_object(self, batch: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": batch["id"], "object": "batch", "endpoint": "/v1/chat/completions",
+            "input_file_id": batch["input_file_id"], "completion_window": "24h",
+            "status": batch["status"], "created_at": int(batch["created_at"]),
+            "output_file_id": batch.get("output_file_id"), "error_file_id": batch.get("error_file_id"),
+            "request_counts": batch["request_counts"], "metadata": batch.get("metadata"),
+        }
+
+    async def create_batch(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if body.get("input_file_id") not in self.files:
+            return self.error_response(404)
+        lines = [json.loads(line) for line in self.files[body["input_file_id"]].splitlines() if line.strip()]
+        batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+        self.batches[batch_id] = {
+            "id": batch_id, "input_file_id": body["input_file_id"], "status": "in_progress",
+            "created_at": time.time(), "metadata": body.get("metadata"), "lines": lines,
+            "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+        }
+        return web.json_response(self.batch_object(self.batches[batch_id]))
+
+    def complete_batch(self, batch: Dict[str, Any]) -> None:
+        outputs, errors = [], []
+        for line in batch.pop("lines"):
+            status = self.sample_error()
+            if status is not None:
+                errors.append({
+                    "id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": line["custom_id"], "response": None,
+                    "error": {"code": str(status), "message": f"HTTP {status}"},
+                })
+                continue
+            content = self.make_content(line["body"])
+            usage = self.make_usage(line["body"]["model"], line["body"]["messages"], content)
+            outputs.append({
+                "id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": line["custom_id"],
+                "response": {"status_code": 200, "body": self.completion(line["body"], content, usage)},
+                "error": None,
+            })
+        for key, results in (("output_file_id", outputs), ("error_file_id", errors)):
+            if results:
+                file_id = f"file-{uuid.uuid4().hex[:12]}"
+                self.files[file_id] = "".join(json.dumps(result) + "\n" for result in results).encode()
+                batch[key] = file_id
+        batch["request_counts"] = {"total": len(outputs) + len(errors), "completed": len(outputs), "failed": len(errors)}
+        batch["status"] = "completed"
+
+    async def retrieve_batch(self, request: web.Request) -> web.Response:
+        batch = self.batches.get(request.match_info["batch_id"])
+        if batch is None:
+            return self.error_response(404)
+        if batch["status"] == "in_progress" and time.time() - batch["created_at"] >= self.args.batch_delay:
+            self.complete_batch(batch)
+        return web.json_response(self.batch_object(batch))
+
+    async def stats(self, request: web.Request) -> web.Response:
+        record_latencies = [end - start for start, end, _ in self.records.values() if end]
+        requests = sum(self.statuses.values())
+        return web.json_response({
+            "elapsed_sec": time.monotonic() - self.started,
+            "requests": requests,
+            "statuses": {str(status): count for status, count in self.statuses.items()},
+            "malformed": dict(self.malformed),
+            "streams": self.streams,
+            "disconnects": self.disconnects,
+            "peak_in_flight": self.peak_in_flight,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "response_latency": {q: percentile(self.latencies, q) for q in (50, 95, 99)},
+            "records": len(self.records),
+            "completed_records": len(record_latencies),
+            "record_latency": {q: percentile(record_latencies, q) for q in (50, 95, 99)},
+            "retry_amplification": requests / len(self.records) if self.records else 0.0,
+        })
+
+    async def handle_reset(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({"reset": True})
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=256 * 1024 ** 2)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_post("/v1/files", self.upload_file)
+        app.router.add_get("/v1/files/{file_id}/content", self.file_content)
+        app.router.add_post("/v1/batches", self.create_batch)
+        app.router.add_get("/v1/batches/{batch_id}", self.retrieve_batch)
+        app.router.add_get("/stats", self.stats)
+        app.router.add_post("/reset", self.handle_reset)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible mock server.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency", type=float, default=1.0, help="Median time to first token in seconds.")
+    parser.add_argument("--latency_sigma", type=float, default=0.3, help="Sigma of the lognormal time to first token.")
+    parser.add_argument("--tail_prob", type=float, default=0.0, help="Probability of a straggler response.")
+    parser.add_argument("--tail_factor", type=float, default=10.0, help="Latency multiplier of a straggler.")
+    parser.add_argument("--trickle_prob", type=float, default=0.0, help="Probability of a streamed response sending a chunk every --trickle_interval seconds.")
+    parser.add_argument("--trickle_interval", type=float, default=5.0)
+    parser.add_argument("--prefill_tokens_per_sec", type=float, default=0.0, help="Prompt processing speed adding uncached prompt tokens to the time to first token; 0 to disable.")
+    parser.add_argument("--tokens_per_sec", type=float, default=200.0, help="Generation speed; 0 returns the completion at once.")
+    parser.add_argument("--provider_latency", type=str, nargs="*", default=[], help="Per-provider latency multipliers, e.g. crusoe/int8=3.")
+    parser.add_argument("--rate_429", type=float, default=0.0)
+    parser.add_argument("--rate_502", type=float, default=0.0)
+    parser.add_argument("--rate_503", type=float, default=0.0)
+    parser.add_argument("--rate_404", type=float, default=0.0)
+    parser.add_argument("--max_concurrency", type=int, default=0, help="Requests in flight above which 429 is returned; 0 for unlimited.")
+    parser.add_argument("--rpm", type=int, default=0, help="Accepted requests per minute above which 429 is returned; 0 for unlimited.")
+    parser.add_argument("--retry_after", type=float, default=1.0, help="Retry-After of injected 429s in seconds.")
+    parser.add_argument("--malformed_rate", type=float, default=0.0, help=f"Share of responses turned into one of {MALFORMED_KINDS}.")
+    parser.add_argument("--ungrounded_rate", type=str, nargs="*", default=[], help="Per-model share of responses whose values are not from the CV, e.g. google/gemini-2.5-flash-lite=0.2.")
+    parser.add_argument("--pack_drop_rate", type=float, default=0.0, help="Share of the CVs of packed requests left out of the response.")
+    parser.add_argument("--prompt_cache", action="store_true", help="Report repeated prompt prefixes as cached tokens.")
+    parser.add_argument("--report_cost", action="store_true", help="Report `usage.cost` like OpenRouter, from the price table.")
+    parser.add_argument("--chunk_chars", type=int, default=16, help="Characters per streamed chunk.")
+    parser.add_argument("--batch_delay", type=float, default=2.0, help="Seconds before a batch completes.")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    with open(os.path.join(PROJECT_ROOT, "resume_json_schema.json"), "r") as f:
+        schema = json.load(f)
+    server = MockServer(args, schema)
+    print(f"Mock OpenAI server on http://{args.host}:{args.port}/v1")
+    web.run_app(server.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,8 +8,6 @@ python ./src/scripts/download_dataset.py
 
 python ./src/scripts/preprocess_dataset.py
 
-python ./src/scripts/create_dataset.py
-
-python ./src/scripts/postprocess_created_dataset.py
+python ./src/scripts/create_dataset.py --training_ready
 
 python ./src/scripts/split_dataset.py
\ No newline at end of file
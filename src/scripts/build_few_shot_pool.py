@@ -0,0 +1,80 @@
+"""Script to build the pool of few-shot examples that create_dataset.py --few_shot_pool retrieves from.
+
+Takes the labelled records of a result store whose JSON needed no repair,
+conforms to the schema and is grounded in the CV, keeps at most --max_examples
+of them spread evenly over the categories, and writes them with the two
+hand-written examples of dataset_creation_prompts.py to a JSONL pool.
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+PROJECT_ROOT = os.getenv("PROJECT_ROOT")
+
+import sys
+sys.path.append(os.path.join(PROJECT_ROOT, "src"))
+
+import argparse
+import collections
+import logging
+import random
+
+from utils.dataset_creation_prompts import json_schema, EXAMPLE_1, RESPONSE_1, EXAMPLE_2, RESPONSE_2
+from utils.few_shot import make_example, select_pool_examples
+from utils.result_store import JsonlResultStore
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+
+def spread_over_categories(examples: list, max_examples: int, seed: int) -> list:
+    """Takes examples from each category in turn, in random order, until `max_examples` are taken."""
+    rng = random.Random(seed)
+    by_category = collections.defaultdict(list)
+    for example in examples:
+        by_category[example.get("Category")].append(example)
+    for category_examples in by_category.values():
+        rng.shuffle(category_examples)
+    queues = [collections.deque(by_category[category]) for category in sorted(by_category, key=str)]
+    selected = []
+    while queues and len(selected) < max_examples:
+        for category_queue in queues:
+            if category_queue and len(selected) < max_examples:
+                selected.append(category_queue.popleft())
+        queues = [category_queue for category_queue in queues if category_queue]
+    return selected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the pool of few-shot examples from labelled records.")
+    parser.add_argument("--store_path", type=str, default="data/orig_structured_dataset.jsonl", help="Result store of labelled records, relative to PROJECT_ROOT.")
+    parser.add_argument("--output_path", type=str, default="data/few_shot_pool.jsonl", help="Pool file, relative to PROJECT_ROOT.")
+    parser.add_argument("--max_examples", type=int, default=2000, help="Largest pool size, spread evenly over the categories.")
+    parser.add_argument("--max_example_tokens", type=int, default=4000, help="Longest example, in estimated tokens of CV plus JSON.")
+    parser.add_argument("--min_grounding", type=float, default=0.8, help="Share of the JSON values that must appear in the CV.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    store = JsonlResultStore(os.path.join(PROJECT_ROOT, args.store_path))
+    # Streamed: the store may hold far more records than the pool
+    examples = select_pool_examples(store.iter_records(), json_schema, args.min_grounding, args.max_example_tokens)
+    logger.info(f"{len(examples)} labelled records of {store.filepath} qualify as examples")
+    examples = spread_over_categories(examples, args.max_examples, args.seed)
+
+    pool = [
+        make_example("example_1", EXAMPLE_1, RESPONSE_1),
+        make_example("example_2", EXAMPLE_2, RESPONSE_2),
+        *examples,
+    ]
+    output_filepath = os.path.join(PROJECT_ROOT, args.output_path)
+    if os.path.exists(output_filepath):
+        os.remove(output_filepath)
+    with JsonlResultStore(output_filepath) as pool_store:
+        pool_store.append(pool)
+    categories = collections.Counter(example.get("Category") for example in examples)
+    logger.info(f"Wrote {len(pool)} examples to {output_filepath}: {dict(categories)}")
+
+
+if __name__ == "__main__":
+    main()
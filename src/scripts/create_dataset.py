@@ -10,23 +10,52 @@ import sys
 sys.path.append(os.path.join(PROJECT_ROOT, "src"))
 
 import argparse
+import asyncio
+import bisect
+import glob
 import logging
+import queue
+import re
+import resource
+import socket
 import time
 import json
 import concurrent.futures
-from typing import List, Dict, Any, Iterator
+from dataclasses import dataclass
+from typing import List, Dict, Any, Iterable, Iterator
+import numpy as np
 import pendulum
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 
 import threading
-from collections import defaultdict
 
 
 from utils.dataset_creation_prompts import (
+    json_schema,
     SYSTEM_PROMPT,
     EXAMPLE_1, RESPONSE_1,
     EXAMPLE_2, RESPONSE_2
 )
+from utils.generation_metrics import ThroughputMeter
+from utils.result_store import JsonlResultStore, default_dataset_paths, export_json_array
+from utils.rate_limiting import TokenBucketRateLimiter, create_rate_limit_backend, estimate_tokens
+from utils.api_errors import classify_error, TIMEOUT
+from utils.concurrency import AIMDController
+from utils.response_cache import ResponseCache
+from utils.provider_router import ProviderRouter
+from utils.cost_ledger import CostLedger, new_record_usage
+from utils.streaming_json import CANCELLED, SchemaStreamValidator, StreamAborted, collect_stream, collect_stream_async
+from utils.retry_scheduler import RetryScheduler, RetryLater, get_retry_delay
+from utils.work_leases import LeaseBackend, LeaseKeeper, create_lease_backend, plan_shards
+from utils.json_repair import repair_json
+from utils.http_transport import TransportSettings, create_http_client, create_async_http_client
+from utils.dataset_index import DatasetIndex
+from utils.cv_packing import CvPacker, pack_message, parse_packed_response, split_usage
+from utils.model_catalog import get_model_limits
+from utils.few_shot import FewShotRetriever
+from utils.record_pipeline import RecordPipeline, to_training_records
+from utils.record_validation import validate_extraction
+from utils.run_planner import TokenCounter, count_cv_tokens, format_plan, pack_requests, plan_run
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -74,78 +103,43 @@ CONFIG = {
     },
 }
 
+MODELS = [
+    "google/gemma-3-27b-it:free",
+    "meta-llama/llama-3.3-70b-instruct:free",
+    "meta-llama/llama-3.3-70b-instruct",
+    "google/gemini-2.5-flash-lite",
+    "qwen/qwen3-235b-a22b-2507",
+]
 
-class RateLimiter:
-    """Rate limiter that prevents rate limit violations."""
-    
-    def __init__(self):
-        self._locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
-        self._request_times: Dict[str, list] = defaultdict(list)
-        self._last_request_time: Dict[str, float] = defaultdict(float)
-    
-    def wait_if_needed(self, model_name: str, rpm_limit: int, min_interval: float = 1.0) -> None:
-        """
-        Wait if necessary to respect rate limits.
-        
-        Args:
-            model_name: The model identifier
-            rpm_limit: Requests per minute limit
-            min_interval: Minimum seconds between requests (default 1.0)
-        """
-        with self._locks[model_name]:
-            now = time.time()
-            
-            # Clean old requests (older than 1 minute)
-            self._request_times[model_name] = [
-                req_time for req_time in self._request_times[model_name]
-                if now - req_time < 60
-            ]
-            
-            # Check if we need to wait based on RPM limit
-            if len(self._request_times[model_name]) >= rpm_limit:
-                # Wait until the oldest request is more than 60 seconds old
-                oldest_request = self._request_times[model_name][0]
-                wait_time = 60 - (now - oldest_request) + 0.1
-                if wait_time > 0:
-                    time.sleep(wait_time)
-                    now = time.time()
-            
-            # Check minimum interval between requests
-            last_request = self._last_request_time[model_name]
-            if last_request > 0:
-                time_since_last = now - last_request
-                if time_since_last < min_interval:
-                    wait_time = min_interval - time_since_last
-                    time.sleep(wait_time)
-                    now = time.time()
-            
-            # Record this request
-            self._request_times[model_name].append(now)
-            self._last_request_time[model_name] = now
-    
-    def reset(self, model_name: str | None = None) -> None:
-        """Reset rate limiting data for a model or all models."""
-        if model_name:
-            with self._locks[model_name]:
-                self._request_times[model_name].clear()
-                self._last_request_time[model_name] = 0
-        else:
-            for model in list(self._locks.keys()):
-                self.reset(model)
 
-rate_limiter = RateLimiter()
+rate_limiter = TokenBucketRateLimiter()
 
 
-def extract_json_from_response(response: str) -> dict | None:
-    """Extracts a JSON object from a model's string response."""
+def parse_json_response(response: str) -> tuple:
+    """Returns the JSON object of a model's string response and the local repairs it needed.
+
+    Near-valid responses are repaired and reconciled with the schema instead of
+    being retried, unless the repair holds no value (None is returned and the
+    request is retried); the repairs list is empty for a response that parsed as is.
+    """
     try:
         # Remove ```json. ...``` tags
-        if "```json" in response:
-            response = response.replace("```json", "").replace("```", "").strip()
-        return json.loads(response.strip())
+        stripped = response
+        if "```json" in stripped:
+            stripped = stripped.replace("```json", "").replace("```", "").strip()
+        return json.loads(stripped.strip()), []
     except json.JSONDecodeError as e:
-        logger.error(f"Error decoding JSON from response: {e}\nResponse was: {response}")
-        return None
+        error = e
+    response_json, repairs = repair_json(response, json_schema)
+    if response_json is None:
+        logger.error(f"Error decoding JSON from response: {error}\nResponse was: {response}")
+    else:
+        logger.info(f"Repaired JSON response locally: {', '.join(repairs)}")
+    return response_json, repairs
+
+def extract_json_from_response(response: str) -> dict | None:
+    """Extracts a JSON object from a model's string response."""
+    return parse_json_response(response)[0]
         
 # def are_all_values_extracted_from_text(response_json: dict, text: str, _id: str) -> bool:
 #     """Returns True if all values are extracted from the text, False otherwise.
@@ -177,11 +171,20 @@ def extract_json_from_response(response: str) -> dict | None:
 #             return False
 #     return True
 
-def create_conversation(cv_text: str) -> List[Dict[str, Any]]:
-    few_shot_examples = [
-        (EXAMPLE_1, RESPONSE_1),
-        (EXAMPLE_2, RESPONSE_2)
-    ]
+def build_conversation_prefix(prompt_cache: bool = False, few_shot_examples: List[tuple] | None = None) -> tuple:
+    """Builds the system prompt and few-shot pairs shared by every request.
+
+    With `prompt_cache` the last message of the prefix carries a `cache_control`
+    breakpoint, so providers with explicit prompt caching cache the whole prefix.
+    `few_shot_examples` replaces the hand-written (CV, JSON) pairs; as those
+    change from request to request, the breakpoint then goes on the system prompt.
+    """
+    dynamic = few_shot_examples is not None
+    if not dynamic:
+        few_shot_examples = [
+            (EXAMPLE_1, RESPONSE_1),
+            (EXAMPLE_2, RESPONSE_2)
+        ]
     conversation_base = [{"role": "system", "content": SYSTEM_PROMPT}]
     for item in few_shot_examples:
         conversation_base.extend([
@@ -189,219 +192,1463 @@ def create_conversation(cv_text: str) -> List[Dict[str, Any]]:
             {"role": "assistant", "content": json.dumps(item[1], ensure_ascii=False)}
         ])
 
-    return conversation_base + [{
+    if prompt_cache:
+        cached = 0 if dynamic else -1
+        message = conversation_base[cached]
+        conversation_base[cached] = {
+            "role": message["role"],
+            "content": [{
+                "type": "text",
+                "text": message["content"],
+                "cache_control": {"type": "ephemeral"}
+            }]
+        }
+    return tuple(conversation_base)
+
+# Built once; the messages are shared by all conversations and must not be mutated
+CONVERSATION_PREFIX = build_conversation_prefix()
+CACHED_CONVERSATION_PREFIX = build_conversation_prefix(prompt_cache=True)
+
+def create_conversation(cv_text: str, prompt_cache: bool = False) -> List[Dict[str, Any]]:
+    prefix = CACHED_CONVERSATION_PREFIX if prompt_cache else CONVERSATION_PREFIX
+    return [*prefix, {
         "role": "user",
         "content": cv_text
     }]
 
+@dataclass
+class GenerationSettings:
+    """Runtime options of the generation engines. The defaults reproduce the original threaded run."""
+    max_workers: int = 16
+    max_in_flight: int = 256
+    input_tpm_limit: int | None = None
+    output_tpm_limit: int | None = None
+    burst_seconds: float = 1.0
+    adaptive_concurrency: bool = False
+    min_concurrency: int = 1
+    max_concurrency: int = 256
+    response_cache: ResponseCache | None = None
+    prompt_cache: bool = False
+    route_providers: bool = False
+    hedge: bool = False
+    hedge_percentile: float = 95.0
+    max_hedge_ratio: float = 0.1
+    stream: bool = False
+    stream_budget_ratio: float = 3.0
+    ledger: CostLedger | None = None
+    max_retries: int = 4
+    base_retry_delay: float = 5.0
+    failed_responses: JsonlResultStore | None = None
+    transport: TransportSettings = TransportSettings()
+    submission_window: int | None = None
+    pack_size: int = 1
+    max_pack_size: int = 16
+    few_shot: FewShotRetriever | None = None
+    few_shot_examples: int = 2
+    few_shot_token_budget: int | None = None
+    record_pipeline: RecordPipeline | None = None
+
+
+def create_record_conversation(ret_dict: dict, settings: GenerationSettings) -> List[Dict[str, Any]]:
+    """Conversation of one entry: the hand-written examples, or the most similar pool examples with `settings.few_shot`."""
+    if settings.few_shot is None:
+        return create_conversation(ret_dict["Text"], settings.prompt_cache)
+    examples = settings.few_shot.select(
+        ret_dict["Text"], settings.few_shot_examples, settings.few_shot_token_budget, exclude_id=ret_dict["ID"]
+    )
+    ret_dict["few_shot"] = [example["ID"] for example in examples]
+    prefix = build_conversation_prefix(
+        settings.prompt_cache, [(example["Text"], example["json"]) for example in examples]
+    )
+    return [*prefix, {"role": "user", "content": ret_dict["Text"]}]
+
+def get_model_config(model_name: str) -> dict:
+    model_key = next((key for key in CONFIG if key in model_name), "llama")
+    return CONFIG[model_key]
+
+def create_concurrency_controller(model_name: str, config: dict, initial: int, settings: GenerationSettings) -> AIMDController:
+    """Returns the in-flight limit of a run, fixed at `initial` unless adaptive concurrency is enabled."""
+    name = f"{model_name}@{','.join(config.get('providers', [])) or 'auto'}"
+    if settings.adaptive_concurrency:
+        return AIMDController(
+            name, initial=initial, minimum=settings.min_concurrency, maximum=settings.max_concurrency
+        )
+    return AIMDController(name, initial=initial, minimum=initial, maximum=initial)
+
+def build_request_kwargs(model_name: str, config: dict, conversation: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Returns the keyword arguments for `client.chat.completions.create`."""
+    return {
+        "model": model_name,
+        "messages": conversation,
+        "extra_body": {
+            "usage": {"include": True},
+            **({
+                "provider": {
+                    "only": config["providers"]
+                }
+            } if "providers" in config else {})
+        }
+    }
+
+def create_provider_router(config: dict, settings: GenerationSettings) -> ProviderRouter | None:
+    """Returns the router over the providers of a model if routing or hedging is enabled."""
+    if not (settings.route_providers or settings.hedge):
+        return None
+    return ProviderRouter(
+        config.get("providers") or [None],
+        hedge_percentile=settings.hedge_percentile,
+        max_hedge_ratio=settings.max_hedge_ratio
+    )
+
+def route_request(request_kwargs: Dict[str, Any], provider: str | None) -> Dict[str, Any]:
+    """Pins a request to one provider; `None` keeps the providers of the model config."""
+    if provider is None:
+        return request_kwargs
+    return {
+        **request_kwargs,
+        "extra_body": {**request_kwargs["extra_body"], "provider": {"only": [provider]}}
+    }
+
+def reserve_hedge(controller: AIMDController, router: ProviderRouter, model_name: str, input_tokens: int, output_tokens: int):
+    """Takes a concurrency slot and rate limit budget for a hedged request without waiting.
+
+    Returns None when either is exhausted, or when the recent requests already
+    hold their share of hedges: hedging must not queue behind the requests it
+    is meant to speed up, nor double the traffic of a slow provider.
+    """
+    if not controller.try_acquire():
+        return None
+    reservation = rate_limiter.reserve(model_name, input_tokens, output_tokens)
+    if reservation.delay > 0 or not router.try_hedge():
+        rate_limiter.cancel(reservation)
+        controller.release()
+        return None
+    return reservation
+
+class HedgeLeg:
+    """One of the two requests of a hedge in the threads engine.
+
+    The sync client cannot abort a request in flight, so when the other leg
+    wins, `cancel` releases this leg's concurrency slot right away and flags it:
+    a leg not sent yet is dropped, and a streamed one stops at its next chunk.
+    A non-streamed loser still runs to completion and is billed.
+    """
+
+    def __init__(self, controller: AIMDController):
+        self.controller = controller
+        self.lost = threading.Event()
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self) -> None:
+        """Gives the concurrency slot back, once."""
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.controller.release()
+
+    def cancel(self) -> None:
+        self.lost.set()
+        self.release()
+
+# Characters every streamed response may use on top of `stream_budget_ratio` times the CV length
+STREAM_BASE_BUDGET = 4000
+
+def stream_request(request_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    return {**request_kwargs, "stream": True, "stream_options": {"include_usage": True}}
+
+def create_stream_validator(request_kwargs: Dict[str, Any], settings: GenerationSettings) -> SchemaStreamValidator:
+    """Validates a streamed response against the resume schema, with a size budget relative to the CV."""
+    cv_chars = len(request_kwargs["messages"][-1]["content"])
+    return SchemaStreamValidator(
+        json_schema, max_chars=STREAM_BASE_BUDGET + int(settings.stream_budget_ratio * cv_chars)
+    )
+
+def get_aborted_usage(error: StreamAborted, reservation) -> Any:
+    """Usage of an aborted stream: the generated tokens so far and the estimated prompt."""
+    return error.usage.model_copy(update={"prompt_tokens": int(reservation.amounts["input_tokens"])})
+
+def get_cached_json(cache: ResponseCache | None, cache_key: str | None) -> dict | None:
+    """Returns the parsed JSON of a cached response to the same request, if any."""
+    if cache is None:
+        return None
+    cached = cache.get(cache_key)
+    if cached is None:
+        return None
+    return extract_json_from_response(cached["content"])
+
+def cache_response(cache: ResponseCache | None, cache_key: str | None, model_name: str, response: Any) -> None:
+    if cache is None:
+        return
+    usage = response.usage.model_dump() if response.usage else None
+    cache.put(cache_key, model_name, response.choices[0].message.content, usage)
+
+_failed_responses_lock = threading.Lock()
+
+def parse_teacher_response(
+    response: Any, ret_dict: dict, model_name: str, meter: ThroughputMeter, settings: GenerationSettings
+) -> dict | None:
+    """Parses the JSON of a response, repairing it locally, and notes the repairs on the record.
+
+    Responses that do not parse as is are also appended to `settings.failed_responses`,
+    the corpus of benchmark_json_repair.py.
+    """
+    content = response.choices[0].message.content or ""
+    response_json, repairs = parse_json_response(content)
+    if repairs or response_json is None:
+        if response_json is not None:
+            meter.record_repair()
+            ret_dict["repairs"] = repairs
+        if settings.failed_responses is not None:
+            with _failed_responses_lock:
+                settings.failed_responses.append([{
+                    "ID": ret_dict["ID"], "model": model_name, "content": content,
+                    "repairs": repairs, "repaired": response_json is not None
+                }])
+    return response_json
+
+def estimate_request_tokens(conversation: List[Dict[str, Any]]) -> tuple:
+    """Returns the estimated (prompt, completion) tokens of a request, used to reserve TPM budget."""
+    # The extracted JSON repeats most of the CV, so the completion is about as long as the last message
+    return estimate_tokens(conversation), estimate_tokens(conversation[-1:])
+
+# Shares of the model limits a pack may fill: the completion estimate is rough and a truncated pack loses its last CV
+PACK_CONTEXT_MARGIN = 0.9
+PACK_OUTPUT_MARGIN = 0.5
+
+def get_pack_limits(model_name: str, prefix_tokens: int) -> tuple:
+    """Returns the prompt tokens available to the CVs of a pack after the prefix, and the completion tokens of a pack."""
+    limits = get_model_limits(model_name)
+    return (
+        int(limits["context"] * PACK_CONTEXT_MARGIN) - prefix_tokens - limits["max_output"],
+        int(limits["max_output"] * PACK_OUTPUT_MARGIN)
+    )
+
+def create_packer(entries: Iterable[dict], model_name: str, settings: GenerationSettings) -> CvPacker:
+    """Packs `settings.pack_size` entries per request, or with `pack_size` 0 as many as the model's limits allow.
+
+    Either way a pack stays within the context window and the completion limit
+    of the model, and holds at most `settings.max_pack_size` entries.
+    """
+    def estimate_entry(entry: dict) -> tuple:
+        tokens = estimate_tokens([{"role": "user", "content": entry["Text"]}])
+        return tokens, tokens
+
+    max_input_tokens, max_output_tokens = get_pack_limits(model_name, estimate_tokens(list(CONVERSATION_PREFIX)))
+    return CvPacker(
+        entries,
+        max_pack_size=settings.pack_size or settings.max_pack_size,
+        estimate_tokens=estimate_entry,
+        max_input_tokens=max_input_tokens,
+        max_output_tokens=max_output_tokens
+    )
+
+def create_packed_conversation(pack: List[dict], prompt_cache: bool = False) -> List[Dict[str, Any]]:
+    return create_conversation(pack_message(pack), prompt_cache)
+
+def fill_packed_results(
+    response: Any, pack: List[dict], model_name: str, meter: ThroughputMeter, pack_usage: dict
+) -> tuple:
+    """Splits a packed response into its entries; returns the entries extracted and the ones missing from it."""
+    split_usage(pack_usage, pack)
+    content = response.choices[0].message.content or ""
+    found, repairs = parse_packed_response(content, [ret_dict["ID"] for ret_dict in pack], json_schema)
+    if repairs:
+        meter.record_repair()
+    timestamp = pendulum.now("Europe/Athens").strftime("%Y-%m-%d %H:%M:%S")
+    finished, missing = [], []
+    for ret_dict in pack:
+        if ret_dict["ID"] not in found:
+            missing.append(ret_dict)
+            continue
+        if repairs:
+            ret_dict["repairs"] = repairs
+        ret_dict["timestamp"] = timestamp
+        ret_dict["json"] = found[ret_dict["ID"]]
+        finished.append(ret_dict)
+    if missing:
+        logger.warning(f"{len(missing)} of {len(pack)} CVs missing from a packed response, sending them again alone")
+    return finished, missing
+
+def get_entry_cache_key(ret_dict: dict, model_name: str, config: dict, settings: GenerationSettings) -> str:
+    """Cache key of the single-CV request of an entry, shared by packed and unpacked runs."""
+    return ResponseCache.make_key(build_request_kwargs(model_name, config, create_record_conversation(ret_dict, settings)))
+
+def answer_from_cache(pack: List[dict], model_name: str, config: dict, meter: ThroughputMeter, settings: GenerationSettings) -> tuple:
+    """Fills the entries of a pack whose single-CV request is cached; returns them and the entries left to send."""
+    if settings.response_cache is None:
+        return [], pack
+    cached, remaining = [], []
+    for ret_dict in pack:
+        response_json = get_cached_json(settings.response_cache, get_entry_cache_key(ret_dict, model_name, config, settings))
+        if response_json:
+            meter.record_cache_hit()
+            ret_dict["timestamp"] = pendulum.now("Europe/Athens").strftime("%Y-%m-%d %H:%M:%S")
+            ret_dict["json"] = response_json
+            cached.append(ret_dict)
+        else:
+            remaining.append(ret_dict)
+    return cached, remaining
+
+def cache_packed_results(finished: List[dict], model_name: str, config: dict, settings: GenerationSettings) -> None:
+    """Caches the JSON of each entry of a packed response under its single-CV request; the usage stays with the pack.
+
+    Entries of a repaired response are not cached.
+    """
+    if settings.response_cache is None:
+        return
+    for ret_dict in finished:
+        if ret_dict.get("repairs"):
+            continue
+        settings.response_cache.put(
+            get_entry_cache_key(ret_dict, model_name, config, settings), model_name, json.dumps(ret_dict["json"])
+        )
+
+def until_exhausted(dataset_entries_list: Iterable[dict], ledger: CostLedger) -> Iterator[dict]:
+    """Yields the entries until the budget of `ledger` runs out, without reading the rest of the input."""
+    entries = iter(dataset_entries_list)
+    while not ledger.exhausted:
+        row_dict = next(entries, None)
+        if row_dict is None:
+            return
+        yield {**row_dict, "usage": new_record_usage()}
+
+def normalize_records(results: List[dict], settings: GenerationSettings) -> List[dict]:
+    """Applies `settings.record_pipeline` to the finished records of a request."""
+    if settings.record_pipeline is None:
+        return results
+    return [settings.record_pipeline(result) for result in results]
+
+
 def fill_dataset(
-    dataset_entries_list: List[dict],
+    dataset_entries_list: Iterable[dict],
     model_name: str,
     rpm_limit: int | None = None,
-    return_every: int = 50
+    return_every: int = 50,
+    settings: GenerationSettings | None = None
 ) -> Iterator[List[Dict[str, Any]]]:
     """Extracts metadata by sending requests in parallel with improved error handling."""
-    model_key = next((key for key in CONFIG if key in model_name), "llama")
-    config = CONFIG[model_key]
-    client = OpenAI(api_key=config["api_key"], base_url=config["base_url"])
+    settings = settings or GenerationSettings()
+    config = get_model_config(model_name)
+    meter = ThroughputMeter()
+    rate_limiter.configure(
+        model_name, rpm_limit, settings.input_tpm_limit, settings.output_tpm_limit, settings.burst_seconds
+    )
+    controller = create_concurrency_controller(model_name, config, settings.max_workers, settings)
+    # Retries are scheduled by `RetryScheduler`; the SDK would sleep in the worker between its own retries
+    client = OpenAI(
+        api_key=config["api_key"],
+        base_url=config["base_url"],
+        max_retries=0,
+        timeout=settings.transport.timeout(),
+        http_client=create_http_client(settings.transport, controller.maximum),
+    )
+    cache = settings.response_cache
+    ledger = settings.ledger or CostLedger()
+    router = create_provider_router(config, settings)
+    # Hedged requests run in their own pool so that the worker can wait for whichever answers first
+    hedge_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=2 * controller.maximum, thread_name_prefix="hedge"
+    ) if settings.hedge else None
 
-    def send_request(row_dict: dict) -> dict:
-        ret_dict = row_dict.copy()
+    def call_api(
+        request_kwargs: Dict[str, Any],
+        reservation,
+        provider: str | None,
+        record_usage: dict,
+        hedge: bool = False,
+        leg: HedgeLeg | None = None
+    ):
+        """Sends a request that holds a concurrency slot and a rate limit reservation, and releases both."""
+        release = leg.release if leg else controller.release
+        if leg and leg.lost.is_set():
+            # The other leg of the hedge answered before this one was sent
+            release()
+            rate_limiter.cancel(reservation)
+            raise StreamAborted(CANCELLED)
+        if router:
+            router.on_start(provider, hedge)
+        start = time.monotonic()
+        try:
+            if settings.stream:
+                response = collect_stream(
+                    client.chat.completions.create(**stream_request(route_request(request_kwargs, provider))),
+                    create_stream_validator(request_kwargs, settings),
+                    leg.lost if leg else None
+                )
+            else:
+                response = client.chat.completions.create(**route_request(request_kwargs, provider))
+        except StreamAborted as e:
+            # A bad generation or the loser of a hedge, not a provider failure
+            release()
+            usage = get_aborted_usage(e, reservation)
+            rate_limiter.settle(reservation, usage)
+            meter.record_request(usage, time.monotonic() - start)
+            if e.reason != CANCELLED:
+                meter.record_aborted_stream()
+            ledger.record(model_name, usage, record_usage)
+            if router:
+                router.on_cancel(provider)
+            raise
+        except Exception as e:
+            release()
+            rate_limiter.settle(reservation)
+            error_class = classify_error(e)
+            if error_class == TIMEOUT:
+                meter.record_timeout()
+            controller.on_failure(error_class, str(e)[:200])
+            if router:
+                router.on_failure(provider, error_class)
+            raise
+        release()
+        latency = time.monotonic() - start
+        controller.on_success(latency)
+        if router:
+            router.on_success(provider, latency)
+        rate_limiter.settle(reservation, response.usage)
+        meter.record_request(response.usage, latency)
+        ledger.record(model_name, response.usage, record_usage)
+        return response, provider
 
+    def send_routed(request_kwargs: Dict[str, Any], input_tokens: int, output_tokens: int, record_usage: dict):
+        """Sends a request to the chosen provider and hedges it on another one once it runs past the p95."""
+        provider = router.choose() if router else None
+        controller.acquire()
         # Apply rate limiting before making the request
-        if rpm_limit:
-            rate_limiter.wait_if_needed(model_name, rpm_limit, min_interval=0.05)
+        reservation = rate_limiter.acquire(model_name, input_tokens, output_tokens)
+        if not hedge_executor:
+            return call_api(request_kwargs, reservation, provider, record_usage)
+
+        primary_leg = HedgeLeg(controller)
+        primary = hedge_executor.submit(call_api, request_kwargs, reservation, provider, record_usage, False, primary_leg)
+        hedge_delay = router.hedge_delay(provider)
+        if hedge_delay is None:
+            return primary.result()
+        # Without a free slot, retry every `hedge_delay` so that the stragglers are hedged once the queue drains
+        hedge_reservation = None
+        while hedge_reservation is None:
+            if concurrent.futures.wait([primary], timeout=hedge_delay).done:
+                return primary.result()
+            hedge_reservation = reserve_hedge(controller, router, model_name, input_tokens, output_tokens)
+        hedge_provider = router.choose(exclude=[provider])
+        hedge_leg = HedgeLeg(controller)
+        hedge = hedge_executor.submit(
+            call_api, request_kwargs, hedge_reservation, hedge_provider, record_usage, True, hedge_leg
+        )
 
-        conversation = create_conversation(row_dict["Text"])
+        legs = {primary: hedge_leg, hedge: primary_leg}
+        pending = {primary, hedge}
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The loser gives its slot back now and stops as soon as it can
+                    legs[future].cancel()
+                    if future is hedge:
+                        router.on_hedge_won(hedge_provider)
+                    return future.result()
+        return primary.result()
+
+    def send_request(ret_dict: dict, first_attempt: int) -> dict | None:
+        """Tries an entry from `first_attempt` on; raises `RetryLater` instead of sleeping through a backoff."""
+        conversation = create_record_conversation(ret_dict, settings)
+        input_tokens, output_tokens = estimate_request_tokens(conversation)
+        request_kwargs = build_request_kwargs(model_name, config, conversation)
+
+        cache_key = ResponseCache.make_key(request_kwargs) if cache else None
+        response_json = get_cached_json(cache, cache_key) if first_attempt == 0 else None
+        if response_json:
+            meter.record_cache_hit()
+            ret_dict["timestamp"] = pendulum.now("Europe/Athens").strftime("%Y-%m-%d %H:%M:%S")
+            ret_dict["json"] = response_json
+            return ret_dict
         
-        max_retries = 2
-        base_delay = 5
-        for attempt in range(max_retries):
+        max_retries = settings.max_retries
+        for attempt in range(first_attempt, max_retries):
+            budget = ledger.reserve(model_name, input_tokens, output_tokens)
+            if budget is None:
+                # Left unprocessed, so that a later run picks the entry up
+                return None
             try:
-                response = client.chat.completions.create(
-                    model=model_name,
-                    messages=conversation,
-                    extra_body={
-                        "usage": {"include": True},
-                        **({
-                            "provider": {
-                                "only": config["providers"]
-                            }
-                        } if "providers" in config else {})
-                    }
+                response, _ = send_routed(request_kwargs, input_tokens, output_tokens, ret_dict["usage"])
+            except StreamAborted as e:
+                # Retry right away: the generation was bad, the provider is fine
+                logger.warning(f"Aborted the response for {ret_dict['ID']}: {e.reason} (attempt {attempt + 1}/{max_retries})")
+                continue
+            except Exception as e:
+                delay = get_retry_delay(e, classify_error(e), attempt, max_retries, settings.base_retry_delay, ret_dict["ID"])
+                if delay is None:
+                    break
+                raise RetryLater(delay, attempt + 1)
+            finally:
+                ledger.release(budget)
+
+            response_json = parse_teacher_response(response, ret_dict, model_name, meter, settings)
+            if not response_json:
+                continue
+            if not ret_dict.get("repairs"):
+                # A repaired response is a guess; a later run may get a valid one
+                cache_response(cache, cache_key, model_name, response)
+
+            # if not are_all_values_extracted_from_text(response_json, ret_dict["Text"], ret_dict["ID"]):
+            #     print(response_json)
+            #     print("****************************")
+            #     conversation += [{
+            #         "role": "user",
+            #         "content": (
+            #             "Some value-strings are not extracted from the CV. "
+            #             "Respond with a JSON where all non-empty strings are "
+            #             "*extracted* from the CV. Do not provide any "
+            #             "additional information."
+            #         )
+            #     }]
+            #     continue  
+
+            ret_dict["timestamp"] = pendulum.now("Europe/Athens").strftime("%Y-%m-%d %H:%M:%S")
+            
+            ret_dict["json"] = response_json
+            return ret_dict
+
+        ret_dict["json"] = None
+        return ret_dict
+
+    def send_pack(pack: List[dict], first_attempt: int) -> tuple:
+        """Sends several entries in one request; returns the entries extracted and the ones to send again alone."""
+        cached = []
+        if first_attempt == 0:
+            cached, pack = answer_from_cache(pack, model_name, config, meter, settings)
+            if not pack:
+                return cached, []
+        conversation = create_packed_conversation(pack, settings.prompt_cache)
+        input_tokens, output_tokens = estimate_request_tokens(conversation)
+        request_kwargs = build_request_kwargs(model_name, config, conversation)
+
+        max_retries = settings.max_retries
+        # Whatever the outcome, the usage of the pack is split once over its entries
+        pack_usage = new_record_usage()
+        for attempt in range(first_attempt, max_retries):
+            budget = ledger.reserve(model_name, input_tokens, output_tokens)
+            if budget is None:
+                split_usage(pack_usage, pack)
+                return cached, []
+            try:
+                response, _ = send_routed(request_kwargs, input_tokens, output_tokens, pack_usage)
+            except Exception as e:
+                delay = get_retry_delay(e, classify_error(e), attempt, max_retries, settings.base_retry_delay, pack[0]["ID"])
+                if delay is None:
+                    break
+                split_usage(pack_usage, pack)
+                # Entries answered from the cache are not sent again
+                if cached:
+                    return cached, pack
+                raise RetryLater(delay, attempt + 1)
+            finally:
+                ledger.release(budget)
+            finished, missing = fill_packed_results(response, pack, model_name, meter, pack_usage)
+            cache_packed_results(finished, model_name, config, settings)
+            return cached + finished, missing
+
+        # E.g. a pack over the provider's limits: each entry gets its own attempts
+        split_usage(pack_usage, pack)
+        return cached, pack
+
+    def send_work(pack: List[dict], first_attempt: int) -> tuple:
+        if len(pack) > 1:
+            finished, split_out = send_pack(pack, first_attempt)
+        else:
+            result = send_request(pack[0], first_attempt)
+            finished, split_out = [result] if result else [], []
+        # Normalized in the worker, so records reach the consumer ready to store
+        return normalize_records(finished, settings), split_out
+
+    results = []
+    try:
+        # With adaptive concurrency the pool is sized for the highest limit and the controller gates the requests
+        with concurrent.futures.ThreadPoolExecutor(max_workers=controller.maximum) as executor:
+            scheduler = RetryScheduler(executor, max_pending=controller.maximum)
+            entries = until_exhausted(dataset_entries_list, ledger)
+            packer = create_packer(entries, model_name, settings)
+            # Process results as they complete; backing-off entries wait in the scheduler, not in a worker
+            for pack, future in scheduler.run(send_work, packer):
+                try:
+                    finished, split_out = future.result()
+                    # Sent again before any new pack
+                    packer.requeue(split_out)
+                    for result in finished:
+                        results.append(result)
+                        meter.record_result(result["json"] is not None)
+                        ledger.record_result(model_name, result["json"] is not None)
+                        if not result["json"]:
+                            logger.warning(f"Failed: {result['ID']}")
+                except Exception as e:
+                    for ret_dict in pack:
+                        logger.error(f"Failed processing {ret_dict['ID']}: {e}")
+                        results.append({"ID": ret_dict["ID"], "json": None})
+                        meter.record_result(False)
+
+                if len(results) >= return_every:
+                    meter.log(logger, f"threads, concurrency {controller.limit}")
+                    yield results
+                    results = []
+    finally:
+        # Also when the consumer closes the generator early, e.g. on a lost lease
+        if hedge_executor:
+            hedge_executor.shutdown(wait=False)
+        client.close()
+    meter.log(logger, f"threads, concurrency {controller.limit}")
+    logger.info(f"Retries: {scheduler.summary()}")
+    if settings.pack_size != 1:
+        logger.info(f"Packing: {packer.summary()}")
+    if router:
+        logger.info(f"Providers: {router.summary()}")
+    if results:
+        yield [r for r in results if r["json"] is not None]
+
+
+async def _fill_dataset_async(
+    dataset_entries_list: Iterable[dict],
+    model_name: str,
+    rpm_limit: int | None,
+    return_every: int,
+    settings: GenerationSettings,
+    emit,
+) -> None:
+    """Sends all requests concurrently on the running event loop and passes result batches to `emit`."""
+    config = get_model_config(model_name)
+    controller = create_concurrency_controller(model_name, config, settings.max_in_flight, settings)
+    client = AsyncOpenAI(
+        api_key=config["api_key"],
+        base_url=config["base_url"],
+        max_retries=0,
+        timeout=settings.transport.timeout(),
+        # The httpx default of 100 connections would cap the in-flight requests
+        http_client=create_async_http_client(settings.transport, controller.maximum),
+    )
+    meter = ThroughputMeter()
+    rate_limiter.configure(
+        model_name, rpm_limit, settings.input_tpm_limit, settings.output_tpm_limit, settings.burst_seconds
+    )
+    cache = settings.response_cache
+    ledger = settings.ledger or CostLedger()
+    router = create_provider_router(config, settings)
+
+    async def call_api(
+        request_kwargs: Dict[str, Any], reservation, provider: str | None, record_usage: dict, hedge: bool = False
+    ):
+        """Sends a request that holds a concurrency slot and a rate limit reservation, and releases both."""
+        if router:
+            router.on_start(provider, hedge)
+        start = time.monotonic()
+        try:
+            if settings.stream:
+                response = await collect_stream_async(
+                    await client.chat.completions.create(**stream_request(route_request(request_kwargs, provider))),
+                    create_stream_validator(request_kwargs, settings)
                 )
-                response_json = extract_json_from_response(response.choices[0].message.content)
-                if not response_json:
-                    continue
-
-                # if not are_all_values_extracted_from_text(response_json, row_dict["Text"], row_dict["ID"]):
-                #     print(response_json)
-                #     print("****************************")
-                #     conversation += [{
-                #         "role": "user",
-                #         "content": (
-                #             "Some value-strings are not extracted from the CV. "
-                #             "Respond with a JSON where all non-empty strings are "
-                #             "*extracted* from the CV. Do not provide any "
-                #             "additional information."
-                #         )
-                #     }]
-                #     continue  
-
-                ret_dict["timestamp"] = pendulum.now("Europe/Athens").strftime("%Y-%m-%d %H:%M:%S")
-                
-                ret_dict["json"] = response_json
-                return ret_dict
-                
+            else:
+                response = await client.chat.completions.create(**route_request(request_kwargs, provider))
+        except StreamAborted as e:
+            # A bad generation, not a provider failure
+            controller.release()
+            usage = get_aborted_usage(e, reservation)
+            rate_limiter.settle(reservation, usage)
+            meter.record_request(usage, time.monotonic() - start)
+            meter.record_aborted_stream()
+            ledger.record(model_name, usage, record_usage)
+            if router:
+                router.on_cancel(provider)
+            raise
+        except asyncio.CancelledError:
+            # The loser of a hedge, or a run that is shutting down
+            controller.release()
+            rate_limiter.settle(reservation)
+            if router:
+                router.on_cancel(provider)
+            raise
+        except Exception as e:
+            controller.release()
+            rate_limiter.settle(reservation)
+            error_class = classify_error(e)
+            if error_class == TIMEOUT:
+                meter.record_timeout()
+            controller.on_failure(error_class, str(e)[:200])
+            if router:
+                router.on_failure(provider, error_class)
+            raise
+        controller.release()
+        latency = time.monotonic() - start
+        controller.on_success(latency)
+        if router:
+            router.on_success(provider, latency)
+        rate_limiter.settle(reservation, response.usage)
+        meter.record_request(response.usage, latency)
+        ledger.record(model_name, response.usage, record_usage)
+        return response, provider
+
+    async def send_routed(request_kwargs: Dict[str, Any], input_tokens: int, output_tokens: int, record_usage: dict):
+        """Sends a request to the chosen provider, hedges it on another one past the p95 and cancels the loser."""
+        provider = router.choose() if router else None
+        await controller.acquire_async()
+        try:
+            # Apply rate limiting before making the request
+            reservation = await rate_limiter.acquire_async(model_name, input_tokens, output_tokens)
+        except BaseException:
+            controller.release()
+            raise
+        if not settings.hedge:
+            return await call_api(request_kwargs, reservation, provider, record_usage)
+
+        primary = asyncio.create_task(call_api(request_kwargs, reservation, provider, record_usage))
+        tasks = [primary]
+        try:
+            hedge_delay = router.hedge_delay(provider)
+            if hedge_delay is not None:
+                # Without a free slot, retry every `hedge_delay` so that the stragglers are hedged once the queue drains
+                hedge_reservation = None
+                while hedge_reservation is None and not primary.done():
+                    await asyncio.wait(tasks, timeout=hedge_delay)
+                    if not primary.done():
+                        hedge_reservation = reserve_hedge(controller, router, model_name, input_tokens, output_tokens)
+                if hedge_reservation is not None:
+                    hedge_provider = router.choose(exclude=[provider])
+                    tasks.append(asyncio.create_task(
+                        call_api(request_kwargs, hedge_reservation, hedge_provider, record_usage, True)
+                    ))
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            router.on_hedge_won(hedge_provider)
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def send_request(row_dict: dict) -> dict | None:
+        # Keeps the usage share of a packed request the entry was split out of
+        ret_dict = row_dict.copy()
+        conversation = create_record_conversation(ret_dict, settings)
+        input_tokens, output_tokens = estimate_request_tokens(conversation)
+        request_kwargs = build_request_kwargs(model_name, config, conversation)
+
+        cache_key = ResponseCache.make_key(request_kwargs) if cache else None
+        response_json = get_cached_json(cache, cache_key)
+        if response_json:
+            meter.record_cache_hit()
+            ret_dict["timestamp"] = pendulum.now("Europe/Athens").strftime("%Y-%m-%d %H:%M:%S")
+            ret_dict["json"] = response_json
+            return ret_dict
+
+        max_retries = settings.max_retries
+        for attempt in range(max_retries):
+            budget = await ledger.reserve_async(model_name, input_tokens, output_tokens)
+            if budget is None:
+                # Left unprocessed, so that a later run picks the entry up
+                return None
+            try:
+                response, _ = await send_routed(request_kwargs, input_tokens, output_tokens, ret_dict["usage"])
+            except StreamAborted as e:
+                # Retry right away: the generation was bad, the provider is fine
+                logger.warning(f"Aborted the response for {ret_dict['ID']}: {e.reason} (attempt {attempt + 1}/{max_retries})")
+                continue
             except Exception as e:
-                error_str = str(e).lower()
-                
-                if "404" in error_str and attempt < max_retries - 1:
-                    delay = min(300, base_delay * (2 ** attempt))
-                    logger.warning(
-                        f"Provider unavailable (404) for {row_dict['ID']}, retrying in "
-                        f"{delay:.1f}s (attempt {attempt + 1}/{max_retries})"
-                    )
-                    time.sleep(delay)
-                    continue
-                    
-                elif ("429" in error_str or "rate" in error_str) and attempt < max_retries - 1:
-                    # Rate limiting - shorter delays
-                    delay = min(120, base_delay * (1.5 ** attempt))
-                    logger.warning(
-                        f"Rate limit hit for {ret_dict['ID']}, retrying in "
-                        f"{delay:.1f}s (attempt {attempt + 1}/{max_retries})"
-                    )
-                    time.sleep(delay)
-                    continue
-                    
-                elif ("503" in error_str or "502" in error_str) and attempt < max_retries - 1:
-                    # Server errors - medium delays
-                    delay = min(180, base_delay * (1.8 ** attempt))
-                    logger.warning(
-                        f"Server error for {ret_dict['ID']}, retrying in "
-                        f"{delay:.1f}s (attempt {attempt + 1}/{max_retries})"
-                    )
-                    time.sleep(delay)
-                    continue
-                else:
-                    logger.error(f"Error for {ret_dict['ID']}: {e}")
+                delay = get_retry_delay(e, classify_error(e), attempt, max_retries, settings.base_retry_delay, ret_dict["ID"])
+                if delay is None:
                     break
+                # The task holds no concurrency slot while it sleeps; the event loop timers are the delay queue
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                ledger.release(budget)
+
+            response_json = parse_teacher_response(response, ret_dict, model_name, meter, settings)
+            if not response_json:
+                continue
+            if not ret_dict.get("repairs"):
+                # A repaired response is a guess; a later run may get a valid one
+                cache_response(cache, cache_key, model_name, response)
+
+            ret_dict["timestamp"] = pendulum.now("Europe/Athens").strftime("%Y-%m-%d %H:%M:%S")
+            ret_dict["json"] = response_json
+            return ret_dict
 
         ret_dict["json"] = None
         return ret_dict
 
-    max_workers = 16
+    async def send_pack(pack: List[dict]) -> tuple:
+        """Sends several entries in one request; returns the entries extracted and the ones to send again alone."""
+        cached, pack = answer_from_cache(pack, model_name, config, meter, settings)
+        if not pack:
+            return cached, []
+        conversation = create_packed_conversation(pack, settings.prompt_cache)
+        input_tokens, output_tokens = estimate_request_tokens(conversation)
+        request_kwargs = build_request_kwargs(model_name, config, conversation)
+
+        max_retries = settings.max_retries
+        # Whatever the outcome, the usage of the pack is split once over its entries
+        pack_usage = new_record_usage()
+        for attempt in range(max_retries):
+            budget = await ledger.reserve_async(model_name, input_tokens, output_tokens)
+            if budget is None:
+                split_usage(pack_usage, pack)
+                return cached, []
+            try:
+                response, _ = await send_routed(request_kwargs, input_tokens, output_tokens, pack_usage)
+            except Exception as e:
+                delay = get_retry_delay(e, classify_error(e), attempt, max_retries, settings.base_retry_delay, pack[0]["ID"])
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                ledger.release(budget)
+            finished, missing = fill_packed_results(response, pack, model_name, meter, pack_usage)
+            cache_packed_results(finished, model_name, config, settings)
+            return cached + finished, missing
+
+        # E.g. a pack over the provider's limits: each entry gets its own attempts
+        split_usage(pack_usage, pack)
+        return cached, pack
+
+    async def send_work(pack: List[dict]) -> tuple:
+        if len(pack) > 1:
+            finished, split_out = await send_pack(pack)
+        else:
+            result = await send_request(pack[0])
+            finished, split_out = [result] if result else [], []
+        return normalize_records(finished, settings), split_out
+
+    # Finished tasks are pushed to a queue so that collecting them stays O(1) per task
+    done_queue: asyncio.Queue = asyncio.Queue()
+    task_to_cv = {}
+    entries = until_exhausted(dataset_entries_list, ledger)
+    packer = create_packer(entries, model_name, settings)
+    # Entries are read and turned into tasks only as earlier ones finish; tasks backing off keep their place
+    window = settings.submission_window or 2 * controller.maximum
+
+    def submit_next() -> None:
+        pack = next(packer, None)
+        if pack is not None:
+            task = asyncio.create_task(send_work(pack))
+            task.add_done_callback(done_queue.put_nowait)
+            task_to_cv[task] = pack
+
+    for _ in range(window):
+        submit_next()
 
     results = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_cv = {
-            executor.submit(send_request, row_dict): row_dict
-            for row_dict in dataset_entries_list
-        }
-        # Process results as they complete
-        for future in concurrent.futures.as_completed(future_to_cv):
+    try:
+        while task_to_cv:
+            task = await done_queue.get()
+            pack = task_to_cv.pop(task)
             try:
-                result = future.result(timeout=60)
-                if result:
-                    results.append(result)
-                    if not result["json"]:
-                        logger.warning(f"Failed: {result['ID']}")
-            except concurrent.futures.TimeoutError:
-                row_dict = future_to_cv[future]
-                logger.error(f"Timeout processing {row_dict['ID']}")
-                results.append({"ID": row_dict["ID"], "json": None})
+                finished, split_out = task.result()
             except Exception as e:
-                row_dict = future_to_cv[future]
-                logger.error(f"Failed processing {row_dict['ID']}: {e}")
-                results.append({"ID": row_dict["ID"], "json": None})
+                for row_dict in pack:
+                    logger.error(f"Failed processing {row_dict['ID']}: {e}")
+                finished, split_out = [{"ID": row_dict["ID"], "json": None} for row_dict in pack], []
+            # Sent again before any new pack
+            packer.requeue(split_out)
+            submit_next()
+            # Skipped entries (once the budget was exhausted) are not in `finished`
+            for result in finished:
+                results.append(result)
+                if not result["json"]:
+                    logger.warning(f"Failed: {result['ID']}")
+                meter.record_result(result["json"] is not None)
+                ledger.record_result(model_name, result["json"] is not None)
 
             if len(results) >= return_every:
-                yield results
+                meter.log(logger, f"async, concurrency {controller.limit}")
+                emit(results)
                 results = []
+    finally:
+        for task in task_to_cv:
+            task.cancel()
+        await client.close()
 
+    meter.log(logger, f"async, concurrency {controller.limit}")
+    if settings.pack_size != 1:
+        logger.info(f"Packing: {packer.summary()}")
+    if router:
+        logger.info(f"Providers: {router.summary()}")
     if results:
-        yield [r for r in results if r["json"] is not None]
+        emit([r for r in results if r["json"] is not None])
+
+
+_ASYNC_DONE = object()
+
+def fill_dataset_async(
+    dataset_entries_list: Iterable[dict],
+    model_name: str,
+    rpm_limit: int | None = None,
+    return_every: int = 50,
+    settings: GenerationSettings | None = None
+) -> Iterator[List[Dict[str, Any]]]:
+    """Asyncio counterpart of `fill_dataset` that keeps up to `settings.max_in_flight` requests open at once.
+
+    The event loop runs in a background thread so requests keep flowing while the
+    caller handles a yielded batch. Entries are consumed lazily, at most
+    `settings.submission_window` ahead of the finished ones.
+    """
+    batches: queue.Queue = queue.Queue()
+    loop = asyncio.new_event_loop()
+    main_task = loop.create_task(_fill_dataset_async(
+        dataset_entries_list, model_name, rpm_limit, return_every, settings or GenerationSettings(), batches.put
+    ))
+
+    def run_loop() -> None:
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(main_task)
+        except BaseException as e:
+            batches.put(e)
+        finally:
+            batches.put(_ASYNC_DONE)
+            loop.close()
+
+    thread = threading.Thread(target=run_loop, name="fill-dataset-async", daemon=True)
+    thread.start()
+    try:
+        while (batch := batches.get()) is not _ASYNC_DONE:
+            if isinstance(batch, BaseException):
+                raise batch
+            yield batch
+    finally:
+        # Cancel outstanding requests if the caller stopped consuming early
+        if thread.is_alive():
+            try:
+                loop.call_soon_threadsafe(main_task.cancel)
+            except RuntimeError:
+                pass
+        thread.join()
+
+
+def records_to_store(records: List[dict], args: argparse.Namespace) -> List[dict]:
+    """With --training_ready, stores the training fields of the valid records only.
+
+    Failed, invalid and empty outputs stay out of the store, so that the export
+    is training-ready and a later run retries them.
+    """
+    if not args.training_ready:
+        return records
+    return to_training_records(records)
+
+
+def get_shard_filepath(shard_dir: str, shard_id: int, worker_id: str) -> str:
+    return os.path.join(shard_dir, f"shard_{shard_id:05d}_{worker_id}.jsonl")
+
+def process_leases(
+    backend: LeaseBackend,
+    index: DatasetIndex,
+    processed: set,
+    model_name: str,
+    fill_function,
+    settings: GenerationSettings,
+    args: argparse.Namespace
+) -> None:
+    """Claims shards of the input until none is left and writes the results of each to its own file.
+
+    A shard is marked done only after all its entries were tried and none
+    failed. If the lease is lost or the budget runs out, the shard is left to
+    the next worker, which skips the entries already in the shard files. A
+    shard with failed entries stays leased until this worker runs out of
+    shards, so that it does not claim it again, and is then given back for
+    a later run to retry the failures. Each worker processes at most
+    `--number_limit` entries.
+    """
+    shard_dir = os.path.join(PROJECT_ROOT, args.shard_dir)
+    os.makedirs(shard_dir, exist_ok=True)
+    added = backend.add_shards(plan_shards(index.ids, args.shard_size))
+    if added:
+        logger.info(f"Planned {added} new shards of {args.shard_size} IDs")
+
+    positions = index.by_id(range(len(index)))
+    ids = [index.ids[position] for position in positions]
+    remaining = args.number_limit
+    unfinished = []
+    while not settings.ledger.exhausted and remaining > 0:
+        lease = backend.claim(args.worker_id, args.lease_ttl)
+        if lease is None:
+            break
+        # Results of earlier holders of the shard, e.g. a worker that crashed; their failures are retried
+        shard_processed = set(processed)
+        for filepath in glob.glob(os.path.join(shard_dir, f"shard_{lease.shard_id:05d}_*.jsonl")):
+            shard_processed.update(JsonlResultStore(filepath).succeeded_ids())
+        shard_positions = [
+            position
+            for position in positions[bisect.bisect_left(ids, lease.first_id):bisect.bisect_right(ids, lease.last_id)]
+            if index.ids[position] not in shard_processed
+        ]
+        limited = len(shard_positions) > remaining
+        shard_positions = shard_positions[:remaining]
+        remaining -= len(shard_positions)
+        if args.order == "longest":
+            shard_positions = index.longest_first(shard_positions)
+        logger.info(
+            f"Leased shard {lease.shard_id} (IDs {lease.first_id}-{lease.last_id}), "
+            f"{len(shard_positions)} entries to process"
+        )
+
+        store = JsonlResultStore(
+            get_shard_filepath(shard_dir, lease.shard_id, args.worker_id), fsync_every=args.fsync_every
+        )
+        failed = 0
+        with LeaseKeeper(backend, lease, args.lease_ttl) as keeper:
+            batches = fill_function(
+                dataset_entries_list=index.records(shard_positions),
+                model_name=model_name,
+                rpm_limit=args.rpm_limit,
+                return_every=50,
+                settings=settings
+            )
+            for new_filled_entries in batches:
+                failed += sum(entry["json"] is None for entry in new_filled_entries)
+                store.append(records_to_store(new_filled_entries, args))
+                # A worker that takes the shard over skips what is on disk
+                store.flush()
+                if keeper.lost.is_set():
+                    batches.close()
+                    break
+        store.close()
+
+        if keeper.lost.is_set():
+            continue
+        if settings.ledger.exhausted or limited:
+            backend.release(lease)
+        elif failed:
+            logger.warning(f"Shard {lease.shard_id} has {failed} failed entries, leaving it to a later run")
+            unfinished.append(lease)
+        elif backend.complete(lease):
+            logger.info(f"Finished shard {lease.shard_id}")
+        else:
+            logger.warning(f"Shard {lease.shard_id} was taken over before it was finished")
+
+    for lease in unfinished:
+        backend.release(lease)
+    logger.info(f"Shards: {backend.status()}")
+
+
+def plan_dry_run(index: DatasetIndex, positions: List[int], model_name: str, args: argparse.Namespace) -> None:
+    """Logs the projected tokens, cost and duration of the run and writes the plan to --plan_path; sends nothing."""
+    start = time.monotonic()
+    counter = TokenCounter(args.tokenizer)
+    cv_tokens = count_cv_tokens(index, positions, counter, workers=args.planner_workers)
+    if args.cascade:
+        # Every entry goes to the first tier; the escalated ones depend on the outputs
+        model_name = MODELS[args.cascade_models[0]]
+
+    system_tokens = counter.count_messages(CONVERSATION_PREFIX[:1])
+    if args.few_shot_pool:
+        # Retrieved examples vary per CV: plan with the median example of the pool
+        example_tokens = [
+            example["tokens"] for example in JsonlResultStore(os.path.join(PROJECT_ROOT, args.few_shot_pool)).iter_records()
+        ]
+        few_shot_tokens = int(np.median(example_tokens)) * args.few_shot_examples if example_tokens else 0
+        if args.few_shot_token_budget is not None:
+            few_shot_tokens = min(few_shot_tokens, args.few_shot_token_budget)
+        prefix_tokens, cached_prefix_tokens = system_tokens + few_shot_tokens, system_tokens
+    else:
+        prefix_tokens = cached_prefix_tokens = counter.count_messages(CONVERSATION_PREFIX)
+
+    pack_sizes = None
+    if args.pack_size != 1:
+        pack_sizes = pack_requests(
+            cv_tokens, args.pack_size or args.max_pack_size, *get_pack_limits(model_name, prefix_tokens)
+        )
+    if args.adaptive_concurrency:
+        concurrency = args.max_concurrency
+    else:
+        concurrency = args.max_in_flight if args.engine == "async" else args.max_workers
+
+    plan = plan_run(
+        [index.ids[position] for position in positions],
+        cv_tokens,
+        prefix_tokens,
+        model_name,
+        concurrency,
+        args.rpm_limit,
+        args.input_tpm_limit,
+        args.output_tpm_limit,
+        pack_sizes=pack_sizes,
+        prompt_cache=args.prompt_cache,
+        latency=args.plan_latency,
+        tokens_per_sec=args.plan_tokens_per_sec,
+        cached_prefix_tokens=cached_prefix_tokens,
+    )
+    plan["tokenizer"] = args.tokenizer
+    plan["planning_seconds"] = time.monotonic() - start
+    for line in format_plan(plan):
+        logger.info(line)
+    plan_filepath = os.path.join(PROJECT_ROOT, args.plan_path)
+    os.makedirs(os.path.dirname(plan_filepath), exist_ok=True)
+    with open(plan_filepath, "w") as f:
+        json.dump(plan, f, indent=2)
+    logger.info(f"Planned in {plan['planning_seconds']:.1f}s; wrote the plan to {plan_filepath}")
+
+
+def run_cascade(
+    index: DatasetIndex,
+    positions: List[int],
+    model_names: List[str],
+    fill_function,
+    settings: GenerationSettings,
+    store: JsonlResultStore,
+    args: argparse.Namespace,
+    record_pipeline: RecordPipeline | None = None
+) -> None:
+    """Sends the entries to the first model and escalates the ones whose output fails validation to the next models.
+
+    An output is valid if it parsed, conforms to the schema and is grounded in
+    the CV. Every stored record notes the tier and model that produced it, and
+    carries the usage of all the tiers it went through. Outputs that fail on the
+    last model are stored with the reason they failed, like in a single-model run.
+    The tiers validate the raw outputs, so `record_pipeline` only normalizes the
+    accepted ones.
+    """
+    id_to_position = {index.ids[position]: position for position in positions}
+    carried_usage: Dict[Any, dict] = {}
+    total_entries = len(positions)
+    tiers = []
+    for tier, model_name in enumerate(model_names):
+        if not positions or settings.ledger.exhausted:
+            break
+        last_tier = tier == len(model_names) - 1
+        start = time.monotonic()
+        cost_before = settings.ledger.summary().get(model_name, {}).get("cost", 0.0)
+        escalated, valid = [], 0
+        logger.info(f"Cascade tier {tier}: {len(positions)} entries to {model_name}")
+        batches = fill_function(
+            dataset_entries_list=index.records(positions),
+            model_name=model_name,
+            rpm_limit=args.rpm_limit,
+            return_every=50,
+            settings=settings
+        )
+        for batch in batches:
+            accepted = []
+            for result in batch:
+                usage = result.setdefault("usage", new_record_usage())
+                for key, amount in carried_usage.pop(result["ID"], {}).items():
+                    usage[key] += amount
+                reason = validate_extraction(
+                    result["json"], result.get("Text", ""), json_schema, args.min_grounding, result.get("repairs", ())
+                )
+                if reason is None or last_tier:
+                    if reason is None:
+                        valid += 1
+                    else:
+                        result["validation"] = reason
+                    result["tier"] = tier
+                    result["model"] = model_name
+                    if record_pipeline:
+                        result = record_pipeline(result)
+                    if result["json"] is not None:
+                        accepted.append(result)
+                else:
+                    carried_usage[result["ID"]] = usage
+                    escalated.append(id_to_position[result["ID"]])
+            store.append(records_to_store(accepted, args))
+
+        tiers.append({
+            "model": model_name,
+            "entries": len(positions),
+            "valid": valid,
+            "cost": settings.ledger.summary().get(model_name, {}).get("cost", 0.0) - cost_before,
+            "seconds": time.monotonic() - start,
+        })
+        logger.info(
+            f"Cascade tier {tier}: {valid}/{len(positions)} valid from {model_name}, "
+            f"{len(escalated)} escalated, ${tiers[-1]['cost']:.4f} in {tiers[-1]['seconds']:.1f}s"
+        )
+        positions = escalated
+
+    cascade_cost = sum(tier["cost"] for tier in tiers)
+    cascade_valid = sum(tier["valid"] for tier in tiers)
+    logger.info(
+        f"Cascade: {cascade_valid}/{total_entries} valid, ${cascade_cost:.4f} "
+        f"(${cascade_cost / max(cascade_valid, 1):.5f} per valid record) in {sum(tier['seconds'] for tier in tiers):.1f}s"
+    )
+    # At the cost per entry each model had in its tier; the later tiers only see the hard CVs, so this is a rough guide.
+    # load_test.py measures single-model runs against the cascade, latency included.
+    for tier in tiers:
+        single_cost = tier["cost"] / tier["entries"] * total_entries
+        logger.info(
+            f"Sending all {total_entries} entries to {tier['model']} would cost about ${single_cost:.4f} "
+            f"(cascade saves ${single_cost - cascade_cost:.4f})"
+        )
 
 
 def main():
     parser = argparse.ArgumentParser(description="Extract metadata from headers using LLM.")
     parser.add_argument("--model_index", type=int, default=2, help="Index of the model to use from the MODELS list.")
-    parser.add_argument("--number_limit", type=int, default=100000, help="Number of headers to process in this run.")
+    parser.add_argument("--number_limit", type=int, default=100000, help="Number of headers to process in this run (per worker with --lease_path).")
     parser.add_argument("--rpm_limit", type=int, default=1000)
+    parser.add_argument("--input_tpm_limit", type=int, default=None, help="Prompt tokens per minute limit.")
+    parser.add_argument("--output_tpm_limit", type=int, default=None, help="Completion tokens per minute limit.")
+    parser.add_argument("--burst_seconds", type=float, default=1.0, help="Seconds worth of the rate limits that may be spent in a burst.")
+    parser.add_argument("--rate_limit_backend", choices=["memory", "sqlite"], default="memory", help="memory for a run alone, sqlite to share the rate limits fairly with the other runs on this host using --rate_limit_path.")
+    parser.add_argument("--rate_limit_path", type=str, default="data/rate_limits.sqlite", help="Rate limit database shared by the runs using the same API key, relative to PROJECT_ROOT.")
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads", help="Request engine: thread pool or asyncio.")
+    parser.add_argument("--max_workers", type=int, default=16, help="Number of worker threads for the threads engine.")
+    parser.add_argument("--max_in_flight", type=int, default=256, help="Maximum concurrent requests for the async engine.")
+    parser.add_argument("--adaptive_concurrency", action="store_true", help="Tune the concurrency with AIMD from throttling, error and latency feedback.")
+    parser.add_argument("--min_concurrency", type=int, default=1, help="Lowest concurrency with --adaptive_concurrency.")
+    parser.add_argument("--max_concurrency", type=int, default=256, help="Highest concurrency with --adaptive_concurrency.")
+    parser.add_argument("--cache_path", type=str, default="data/teacher_cache.sqlite", help="Response cache database, relative to PROJECT_ROOT.")
+    parser.add_argument("--no_cache", action="store_true", help="Do not read or write the response cache.")
+    parser.add_argument("--cache_max_size_mb", type=int, default=2048, help="Size of the cached responses above which the least recently used are evicted.")
+    parser.add_argument("--cache_max_age_days", type=float, default=30, help="Age after which cached responses are evicted.")
+    parser.add_argument("--prompt_cache", action="store_true", help="Mark the shared prompt prefix with cache_control for provider prompt caching.")
+    parser.add_argument("--route_providers", action="store_true", help="Send each request to the healthiest provider of the model by latency and error rate.")
+    parser.add_argument("--hedge", action="store_true", help="Duplicate requests that run past the provider's latency percentile on another provider (implies --route_providers).")
+    parser.add_argument("--hedge_percentile", type=float, default=95.0, help="Latency percentile after which a request is hedged.")
+    parser.add_argument("--max_hedge_ratio", type=float, default=0.1, help="Maximum share of hedged requests.")
+    parser.add_argument("--stream", action="store_true", help="Stream the responses and abort the ones that go off-schema or over budget.")
+    parser.add_argument("--stream_budget_ratio", type=float, default=3.0, help="Response size budget with --stream, in characters per character of the CV (plus a fixed allowance).")
+    parser.add_argument("--max_cost", type=float, default=None, help="Stop sending new requests once the run has spent this many USD.")
+    parser.add_argument("--max_tokens", type=int, default=None, help="Stop sending new requests once the run has used this many prompt + completion tokens.")
+    parser.add_argument("--max_retries", type=int, default=4, help="Attempts per entry; failed attempts are retried with jittered exponential backoff or after the server's Retry-After.")
+    parser.add_argument("--base_retry_delay", type=float, default=5.0, help="Seconds of the first retry backoff.")
+    parser.add_argument("--max_connections", type=int, default=None, help="HTTP connections per client; defaults to the highest concurrency of the engine.")
+    parser.add_argument("--max_keepalive_connections", type=int, default=None, help="Idle HTTP connections kept open; defaults to --max_connections.")
+    parser.add_argument("--keepalive_expiry", type=float, default=30.0, help="Seconds an idle HTTP connection is kept open.")
+    parser.add_argument("--http2", action="store_true", help="Multiplex the requests over HTTP/2 (needs the h2 package).")
+    parser.add_argument("--connect_timeout", type=float, default=10.0, help="Seconds to open a connection.")
+    parser.add_argument("--read_timeout", type=float, default=120.0, help="Seconds without a byte of the response before a request times out.")
+    parser.add_argument("--request_timeout", type=float, default=300.0, help="Total seconds per request attempt, streamed or not; 0 for no deadline.")
+    parser.add_argument("--order", choices=["longest", "id"], default="longest", help="Send the longest CVs first, so the slowest requests do not finish alone at the end of the run, or send them by ID.")
+    parser.add_argument("--submission_window", type=int, default=None, help="Entries read ahead and submitted at once by the async engine; defaults to twice its highest concurrency.")
+    parser.add_argument("--pack_size", type=int, default=1, help="CVs sent together in one request, sharing the prompt prefix; 0 packs as many as the model's context and output limits allow, up to --max_pack_size.")
+    parser.add_argument("--max_pack_size", type=int, default=16, help="Most CVs per request with --pack_size 0.")
+    parser.add_argument("--few_shot_pool", type=str, default=None, help="Pool of examples from build_few_shot_pool.py, relative to PROJECT_ROOT; each request then gets the pool examples most similar to its CV instead of the two hand-written ones.")
+    parser.add_argument("--few_shot_examples", type=int, default=2, help="Most examples per request with --few_shot_pool; 0 sends none.")
+    parser.add_argument("--few_shot_token_budget", type=int, default=None, help="Most estimated tokens of the examples of a request with --few_shot_pool.")
+    parser.add_argument("--few_shot_min_similarity", type=float, default=0.2, help="Similarity below which a pool example is not sent.")
+    parser.add_argument("--cascade", action="store_true", help="Send every CV to the first model of --cascade_models and escalate the outputs that fail validation to the next ones.")
+    parser.add_argument("--cascade_models", type=int, nargs="+", default=[3, 4, 2], help="Indices in MODELS of the cascade tiers, cheapest first.")
+    parser.add_argument("--min_grounding", type=float, default=0.8, help="Share of the JSON values that must appear in the CV for a cascade or --training_ready output to be valid.")
+    parser.add_argument("--training_ready", action="store_true", help="Validate, fill the schema, clean the URLs and serialize each record in the workers, and store only the training fields of the valid records, so a later run retries the failed, invalid and empty ones. The store and export default to data/structured_dataset.jsonl and data/structured_dataset.json, read by split_dataset.py without postprocess_created_dataset.py.")
+    parser.add_argument("--dry_run", action="store_true", help="Project the tokens, cost and duration of the run and flag the CVs over the model's limits, without sending requests.")
+    parser.add_argument("--tokenizer", type=str, default="chars", help="Token counter of --dry_run: chars[:chars per token], tiktoken:<encoding> or hf:<name or path>.")
+    parser.add_argument("--planner_workers", type=int, default=os.cpu_count(), help="Processes tokenizing the CVs with --dry_run and a real tokenizer.")
+    parser.add_argument("--plan_latency", type=float, default=2.0, help="Seconds to the first token of a request assumed by --dry_run.")
+    parser.add_argument("--plan_tokens_per_sec", type=float, default=100.0, help="Output tokens per second of a request assumed by --dry_run.")
+    parser.add_argument("--plan_path", type=str, default="data/dry_run_plan.json", help="Plan written by --dry_run, relative to PROJECT_ROOT.")
+    parser.add_argument("--failed_responses_path", type=str, default=None, help="Append the responses that needed a local repair or could not be parsed to this JSONL file, relative to PROJECT_ROOT.")
+    parser.add_argument("--ledger_path", type=str, default="data/cost_ledger.jsonl", help="File, relative to PROJECT_ROOT, to which the token and cost summary of each run is appended.")
+    parser.add_argument("--base_url", type=str, default=None, help="OpenAI-compatible endpoint overriding the model config, e.g. a local mock server.")
+    parser.add_argument("--input_path", type=str, default="data/preprocessed_dataset.json", help="Input dataset, relative to PROJECT_ROOT.")
+    parser.add_argument("--output_path", type=str, default=None, help="Exported JSON array, relative to PROJECT_ROOT. Defaults to data/orig_structured_dataset.json, or data/structured_dataset.json with --training_ready.")
+    parser.add_argument("--store_path", type=str, default=None, help="Append-only result store, relative to PROJECT_ROOT. Use a .zst suffix for zstd compression. Defaults to data/orig_structured_dataset.jsonl, or data/structured_dataset.jsonl with --training_ready.")
+    parser.add_argument("--fsync_every", type=int, default=50, help="Number of results written per fsync of the result store.")
+    parser.add_argument("--skip_export", action="store_true", help="Do not export the result store to --output_path at the end of the run.")
+    parser.add_argument("--lease_path", type=str, default=None, help="Lease store, relative to PROJECT_ROOT, shared by the workers of a sharded run; enables sharding.")
+    parser.add_argument("--lease_backend", choices=["sqlite", "file"], default="sqlite", help="sqlite for workers on one machine, file (fcntl-locked JSON) for workers on several machines sharing a mount.")
+    parser.add_argument("--shard_size", type=int, default=500, help="IDs per shard of a sharded run.")
+    parser.add_argument("--lease_ttl", type=float, default=600, help="Seconds after which the lease of a worker that stopped renewing it expires.")
+    parser.add_argument("--shard_dir", type=str, default="data/shards", help="Directory of the per-shard result files, relative to PROJECT_ROOT; merge them with merge_shards.py.")
+    parser.add_argument("--worker_id", type=str, default=f"{socket.gethostname()}-{os.getpid()}", help="Name of this worker in the lease store and the shard file names.")
     args = parser.parse_args()
-
-    MODELS = [
-        "google/gemma-3-27b-it:free",
-        "meta-llama/llama-3.3-70b-instruct:free",
-        "meta-llama/llama-3.3-70b-instruct",
-        "google/gemini-2.5-flash-lite",
-        "qwen/qwen3-235b-a22b-2507",
-    ]
+    if args.cascade and args.lease_path:
+        parser.error("--cascade does not support sharded runs (--lease_path)")
+    if args.pack_size != 1 and args.stream:
+        parser.error("--stream validates one CV per response and cannot be combined with --pack_size")
+    if args.pack_size != 1 and args.few_shot_pool:
+        parser.error("--few_shot_pool retrieves examples per CV and cannot be combined with --pack_size")
+    default_store_path, default_output_path = default_dataset_paths(args.training_ready)
+    args.output_path = args.output_path or default_output_path
+    args.store_path = args.store_path or default_store_path
+    args.worker_id = re.sub(r"[^A-Za-z0-9.-]", "-", args.worker_id)
+    if args.rate_limit_backend != "memory":
+        logger.info(f"Sharing the rate limits with the other runs using {args.rate_limit_path}")
+        rate_limiter.set_backend(create_rate_limit_backend(
+            args.rate_limit_backend, os.path.join(PROJECT_ROOT, args.rate_limit_path), args.worker_id
+        ))
 
     model_name = MODELS[args.model_index]
     logger.info(f"Using model: {model_name}")
+    if args.base_url:
+        logger.info(f"Using endpoint: {args.base_url}")
+        for config in CONFIG.values():
+            config["base_url"] = args.base_url
 
-    with open(
-        os.path.join(PROJECT_ROOT, "data/preprocessed_dataset.json"), 
-        "rb"
-    ) as f:
-        input: list[dict] = json.load(f)
+    run_start = time.monotonic()
+    # Records are read from disk as they are sent, instead of holding the whole input in memory
+    index = DatasetIndex(os.path.join(PROJECT_ROOT, args.input_path))
+    logger.info(f"Indexed {len(index)} entries of {args.input_path} in {time.monotonic() - run_start:.1f}s")
 
-    output_filepath = os.path.join(PROJECT_ROOT, "data/orig_structured_dataset.json")
+    output_filepath = os.path.join(PROJECT_ROOT, args.output_path)
+    store = JsonlResultStore(
+        os.path.join(PROJECT_ROOT, args.store_path),
+        fsync_every=args.fsync_every
+    )
 
-    try:
+    # Import results saved by runs that predate the JSONL store
+    if not os.path.exists(store.filepath) and os.path.exists(output_filepath):
         with open(output_filepath) as f:
             content = f.read()
-            if content.strip():
-                existing_dataset: list[dict] = json.loads(content)
-            else:
-                existing_dataset = []
-    except FileNotFoundError:
-        existing_dataset = []
+        if content.strip():
+            store.append(json.loads(content))
+            store.flush()
+            logger.info(f"Imported {output_filepath} into {store.filepath}")
 
     # Only process unprocessed IDS 
-    processed = {x["ID"] for x in existing_dataset}
-    entries_to_process = [
-        x
-        for x in input
-        if x["ID"] not in processed
+    processed = store.processed_ids()
+    positions_to_process = [
+        position
+        for position, _id in enumerate(index.ids)
+        if _id not in processed
     ]
 
-    if not entries_to_process:
+    if not positions_to_process:
         logger.info("No more entries to process")
     
     # Sort by ID
-    entries_to_process = sorted(entries_to_process, key=lambda x: x["ID"])
+    positions_to_process = index.by_id(positions_to_process)
 
     # Limit the number of entries to process in this run
-    entries_to_process = entries_to_process[:args.number_limit]
-    logger.info(f"Processing {len(entries_to_process)} new entries.")
+    positions_to_process = positions_to_process[:args.number_limit]
+    if args.order == "longest":
+        positions_to_process = index.longest_first(positions_to_process)
+    logger.info(f"Processing {len(positions_to_process)} new entries.")
 
     logger.info(f"Using rpm: {args.rpm_limit}")
-        
-    for new_filled_entries in fill_dataset(
-        dataset_entries_list=entries_to_process,
-        model_name=model_name,
-        rpm_limit=args.rpm_limit,
-        return_every=50
-    ):
-        if not new_filled_entries:
-            logger.info("No new filled entries")
-            continue
 
-        # Append new results to existing data
-        existing_dataset.extend(new_filled_entries)
-        # Save after each batch
-        with open(output_filepath, "w") as f:
-            json.dump(existing_dataset, f, indent=2, ensure_ascii=False)
+    if args.dry_run:
+        plan_dry_run(index, positions_to_process, model_name, args)
+        index.close()
+        return
 
-        logger.info(
-            f"Total processed: {len(existing_dataset)}/"
-            f"{len(entries_to_process) + len(existing_dataset)}"
+    few_shot = None
+    if args.few_shot_pool:
+        start = time.monotonic()
+        examples = list(JsonlResultStore(os.path.join(PROJECT_ROOT, args.few_shot_pool)).iter_records())
+        few_shot = FewShotRetriever(examples, min_similarity=args.few_shot_min_similarity)
+        logger.info(f"Indexed {len(few_shot)} few-shot examples in {time.monotonic() - start:.1f}s")
+
+    record_pipeline = RecordPipeline(json_schema, args.min_grounding) if args.training_ready else None
+    settings = GenerationSettings(
+        max_workers=args.max_workers,
+        max_in_flight=args.max_in_flight,
+        input_tpm_limit=args.input_tpm_limit,
+        output_tpm_limit=args.output_tpm_limit,
+        burst_seconds=args.burst_seconds,
+        adaptive_concurrency=args.adaptive_concurrency,
+        min_concurrency=args.min_concurrency,
+        max_concurrency=args.max_concurrency,
+        response_cache=None if args.no_cache else ResponseCache(
+            os.path.join(PROJECT_ROOT, args.cache_path),
+            max_size_bytes=args.cache_max_size_mb * 1024 ** 2,
+            max_age_seconds=args.cache_max_age_days * 24 * 3600
+        ),
+        prompt_cache=args.prompt_cache,
+        route_providers=args.route_providers,
+        hedge=args.hedge,
+        hedge_percentile=args.hedge_percentile,
+        max_hedge_ratio=args.max_hedge_ratio,
+        stream=args.stream,
+        stream_budget_ratio=args.stream_budget_ratio,
+        ledger=CostLedger(max_cost=args.max_cost, max_tokens=args.max_tokens),
+        max_retries=args.max_retries,
+        base_retry_delay=args.base_retry_delay,
+        failed_responses=JsonlResultStore(
+            os.path.join(PROJECT_ROOT, args.failed_responses_path), fsync_every=1000
+        ) if args.failed_responses_path else None,
+        submission_window=args.submission_window,
+        pack_size=args.pack_size,
+        max_pack_size=args.max_pack_size,
+        few_shot=few_shot,
+        few_shot_examples=args.few_shot_examples,
+        few_shot_token_budget=args.few_shot_token_budget,
+        # The cascade validates the raw outputs of each tier before normalizing them
+        record_pipeline=None if args.cascade else record_pipeline,
+        transport=TransportSettings(
+            max_connections=args.max_connections,
+            max_keepalive_connections=args.max_keepalive_connections,
+            keepalive_expiry=args.keepalive_expiry,
+            http2=args.http2,
+            connect_timeout=args.connect_timeout,
+            read_timeout=args.read_timeout,
+            total_timeout=args.request_timeout or None
         )
+    )
+    if args.engine == "async":
+        logger.info(f"Using async engine with up to {args.max_in_flight} requests in flight")
+        fill_function = fill_dataset_async
+    else:
+        fill_function = fill_dataset
+    if args.adaptive_concurrency:
+        logger.info(f"Using adaptive concurrency between {args.min_concurrency} and {args.max_concurrency}")
 
+    if args.cascade:
+        cascade_models = [MODELS[model_index] for model_index in args.cascade_models]
+        logger.info(f"Cascade over {' -> '.join(cascade_models)}")
+        run_cascade(index, positions_to_process, cascade_models, fill_function, settings, store, args, record_pipeline)
+    elif args.lease_path:
+        logger.info(f"Sharded run as worker {args.worker_id} with leases in {args.lease_path}")
+        backend = create_lease_backend(args.lease_backend, os.path.join(PROJECT_ROOT, args.lease_path))
+        # Shards cover the full input, so that every worker plans the same shards
+        process_leases(backend, index, processed, model_name, fill_function, settings, args)
+        backend.close()
+    else:
+        batches = fill_function(
+            dataset_entries_list=index.records(positions_to_process),
+            model_name=model_name,
+            rpm_limit=args.rpm_limit,
+            return_every=50,
+            settings=settings
+        )
+
+        total_processed = len(processed)
+        for new_filled_entries in batches:
+            if not new_filled_entries:
+                logger.info("No new filled entries")
+                continue
+
+            # Append new results to the store
+            store.append(records_to_store(new_filled_entries, args))
+            total_processed += len(new_filled_entries)
+
+            logger.info(
+                f"Total processed: {total_processed}/"
+                f"{len(positions_to_process) + len(processed)}"
+            )
+
+    store.close()
+    if record_pipeline:
+        logger.info(f"Training-ready records: {record_pipeline.summary()}")
+    if settings.failed_responses:
+        settings.failed_responses.close()
+    settings.ledger.log(logger)
+    settings.ledger.append_to(
+        os.path.join(PROJECT_ROOT, args.ledger_path),
+        model=" -> ".join(MODELS[model_index] for model_index in args.cascade_models) if args.cascade else model_name,
+        engine=args.engine,
+        entries=len(positions_to_process),
+        budget_exhausted=settings.ledger.exhausted
+    )
+    if settings.response_cache:
+        logger.info(f"Response cache: {settings.response_cache.stats()}")
+        settings.response_cache.close()
+    index.close()
+    rate_limiter.backend.close()
     logger.info("Finished processing all batches")
+    # ru_maxrss is in kilobytes on Linux
+    logger.info(
+        f"Makespan {time.monotonic() - run_start:.1f}s, "
+        f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB"
+    )
+
+    # The results of a sharded run are exported by merge_shards.py
+    if not args.skip_export and not args.lease_path:
+        count = export_json_array(store, output_filepath)
+        logger.info(f"Exported {count} records to {output_filepath}")
 
 
 if __name__ == "__main__":
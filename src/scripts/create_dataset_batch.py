@@ -0,0 +1,177 @@
+"""Script to fill the "json" column of the dataset through an OpenAI-compatible Batch API.
+
+Usage: prepare -> submit -> poll -> collect, or `run` for all of them. The
+bookkeeping lives in `<batch_dir>/state.json`, so every step can be resumed.
+Collected records are appended to the same result store as create_dataset.py.
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+PROJECT_ROOT = os.getenv("PROJECT_ROOT")
+
+import sys
+sys.path.append(os.path.join(PROJECT_ROOT, "src"))
+sys.path.append(os.path.join(PROJECT_ROOT, "src", "scripts"))
+
+import argparse
+import json
+import logging
+import pendulum
+from openai import OpenAI
+
+from utils.batch_api import (
+    MAX_SHARD_REQUESTS,
+    create_batch_request,
+    write_batch_shards,
+    load_state,
+    save_state,
+    submit_batch_shards,
+    poll_batches,
+    collect_batch_results,
+)
+from utils.result_store import JsonlResultStore, export_json_array
+from create_dataset import (
+    MODELS,
+    get_model_config,
+    build_request_kwargs,
+    create_conversation,
+    extract_json_from_response,
+)
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+
+def get_client(args: argparse.Namespace, config: dict) -> OpenAI:
+    api_key = os.getenv(args.api_key_env) if args.api_key_env else config["api_key"]
+    return OpenAI(api_key=api_key, base_url=args.base_url or config["base_url"])
+
+def load_input() -> list[dict]:
+    with open(os.path.join(PROJECT_ROOT, "data/preprocessed_dataset.json"), "rb") as f:
+        return json.load(f)
+
+def prepare(args: argparse.Namespace, state_filepath: str, store: JsonlResultStore) -> None:
+    state = load_state(state_filepath)
+    if any(not shard.get("collected") for shard in state["shards"]):
+        logger.error(f"{state_filepath} has batches that are not collected yet; collect them first")
+        return
+
+    processed = store.processed_ids()
+    entries_to_process = sorted(
+        [x for x in load_input() if x["ID"] not in processed],
+        key=lambda x: x["ID"]
+    )[:args.number_limit]
+    if not entries_to_process:
+        logger.info("No more entries to process")
+        return
+
+    model_name = args.model or MODELS[args.model_index]
+    config = get_model_config(model_name)
+
+    def iter_requests():
+        for row_dict in entries_to_process:
+            request_kwargs = build_request_kwargs(model_name, config, create_conversation(row_dict["Text"]))
+            if not args.openrouter_extras:
+                # `usage` and `provider` are OpenRouter fields that batch endpoints reject
+                request_kwargs.pop("extra_body")
+            yield create_batch_request(row_dict["ID"], request_kwargs)
+
+    run_dir = os.path.join(os.path.dirname(state_filepath), pendulum.now("Europe/Athens").strftime("%Y%m%d_%H%M%S"))
+    shard_paths = write_batch_shards(iter_requests(), run_dir, shard_size=args.shard_size)
+    state = {
+        "model": model_name,
+        "shards": [{"path": path} for path in shard_paths]
+    }
+    save_state(state, state_filepath)
+    logger.info(f"Wrote {len(entries_to_process)} requests for {model_name} to {len(shard_paths)} shards in {run_dir}")
+
+def collect(client: OpenAI, state: dict, state_filepath: str, store: JsonlResultStore) -> int:
+    processed = store.processed_ids()
+    rows_by_id = {str(x["ID"]): x for x in load_input() if x["ID"] not in processed}
+
+    total_collected = 0
+    batches = collect_batch_results(
+        client,
+        state,
+        rows_by_id,
+        parse_response=extract_json_from_response,
+        timestamp=lambda: pendulum.now("Europe/Athens").strftime("%Y-%m-%d %H:%M:%S")
+    )
+    for new_filled_entries in batches:
+        # The records of a retried collection are already in the store
+        new_filled_entries = [x for x in new_filled_entries if x["ID"] not in processed]
+        if new_filled_entries:
+            store.append(new_filled_entries)
+            store.flush()
+            processed.update(x["ID"] for x in new_filled_entries)
+            total_collected += len(new_filled_entries)
+        # Persists the shards marked as collected so far; the current one is marked on the next iteration
+        save_state(state, state_filepath)
+    save_state(state, state_filepath)
+
+    logger.info(f"Collected {total_collected} records, {len(processed)} processed in total")
+    return total_collected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill the dataset through the Batch API.")
+    parser.add_argument("command", choices=["prepare", "submit", "poll", "collect", "run"])
+    parser.add_argument("--model_index", type=int, default=2, help="Index of the model to use from the MODELS list.")
+    parser.add_argument("--model", type=str, default=None, help="Model name, overrides --model_index.")
+    parser.add_argument("--base_url", type=str, default=None, help="Base URL of the Batch API, overrides the model config.")
+    parser.add_argument("--api_key_env", type=str, default=None, help="Environment variable holding the API key, overrides the model config.")
+    parser.add_argument("--openrouter_extras", action="store_true", help="Keep the OpenRouter `usage` and `provider` fields in the request bodies.")
+    parser.add_argument("--number_limit", type=int, default=100000, help="Number of entries to prepare.")
+    parser.add_argument("--shard_size", type=int, default=MAX_SHARD_REQUESTS, help="Maximum requests per batch input file.")
+    parser.add_argument("--batch_dir", type=str, default="data/batches", help="Directory of the shards and state.json, relative to PROJECT_ROOT.")
+    parser.add_argument("--completion_window", type=str, default="24h")
+    parser.add_argument("--interval", type=float, default=60, help="Seconds between two polls.")
+    parser.add_argument("--timeout", type=float, default=None, help="Stop polling after this many seconds.")
+    parser.add_argument("--store_path", type=str, default="data/orig_structured_dataset.jsonl", help="Append-only result store, relative to PROJECT_ROOT.")
+    parser.add_argument("--skip_export", action="store_true", help="Do not export the result store to data/orig_structured_dataset.json after collecting.")
+    args = parser.parse_args()
+
+    state_filepath = os.path.join(PROJECT_ROOT, args.batch_dir, "state.json")
+    os.makedirs(os.path.dirname(state_filepath), exist_ok=True)
+    store = JsonlResultStore(os.path.join(PROJECT_ROOT, args.store_path))
+
+    if args.command in ("prepare", "run"):
+        prepare(args, state_filepath, store)
+
+    state = load_state(state_filepath)
+    if not state["shards"]:
+        logger.info(f"No batches in {state_filepath}")
+        store.close()
+        return
+    client = get_client(args, get_model_config(state["model"]))
+
+    if args.command in ("submit", "run"):
+        try:
+            submit_batch_shards(client, state, args.completion_window, metadata={"model": state["model"]})
+        finally:
+            save_state(state, state_filepath)
+
+    if args.command in ("poll", "run"):
+        finished = poll_batches(
+            client, state, args.interval, args.timeout,
+            on_update=lambda s: save_state(s, state_filepath)
+        )
+        if not finished:
+            logger.info("Batches are still running; poll again later")
+
+    if args.command in ("collect", "run"):
+        if args.command == "collect":
+            poll_batches(client, state, timeout=0)
+            save_state(state, state_filepath)
+        if collect(client, state, state_filepath, store) and not args.skip_export:
+            output_filepath = os.path.join(PROJECT_ROOT, "data/orig_structured_dataset.json")
+            count = export_json_array(store, output_filepath)
+            logger.info(f"Exported {count} records to {output_filepath}")
+
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Script to find near-duplicate CVs in the preprocessed dataset before they are sent to the teacher.
+
+Clusters CVs whose word-shingle Jaccard similarity reaches --threshold (MinHash
++ LSH), writes a cluster report, and writes the dataset with one representative
+per cluster (--mode representative) or at most --max_per_cluster diverse CVs
+per cluster (--mode cap). Run create_dataset.py with --input_path on the output.
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+PROJECT_ROOT = os.getenv("PROJECT_ROOT")
+
+import sys
+sys.path.append(os.path.join(PROJECT_ROOT, "src"))
+
+import argparse
+import collections
+import json
+import logging
+import time
+
+import numpy as np
+
+from utils.near_duplicates import minhash_signatures, cluster_near_duplicates, choose_bands, group_clusters, select_diverse
+from utils.rate_limiting import CHARS_PER_TOKEN
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+
+def build_report(
+    dataset: list[dict], clusters: dict, kept: set, signatures: np.ndarray, args: argparse.Namespace, top: int = 50
+) -> dict:
+    duplicate_clusters = sorted(
+        (members for members in clusters.values() if len(members) > 1), key=len, reverse=True
+    )
+    size_histogram = collections.Counter(len(members) for members in clusters.values())
+    dropped_chars = sum(len(row["Text"]) for i, row in enumerate(dataset) if i not in kept)
+    return {
+        "threshold": args.threshold,
+        "num_perm": args.num_perm,
+        "shingle_size": args.shingle_size,
+        "mode": args.mode,
+        "rows": len(dataset),
+        "clusters": len(clusters),
+        "duplicate_clusters": len(duplicate_clusters),
+        "rows_in_duplicate_clusters": sum(len(members) for members in duplicate_clusters),
+        "rows_kept": len(kept),
+        "rows_dropped": len(dataset) - len(kept),
+        "estimated_prompt_tokens_saved": int(dropped_chars / CHARS_PER_TOKEN),
+        "cluster_sizes": {str(size): count for size, count in sorted(size_histogram.items())},
+        "largest_clusters": [
+            {
+                "size": len(members),
+                "ids": [dataset[i]["ID"] for i in members],
+                "kept_ids": [dataset[i]["ID"] for i in members if i in kept],
+                "categories": dict(collections.Counter(dataset[i].get("Category") for i in members)),
+                "mean_similarity_to_first": round(float(
+                    (signatures[members[1:]] == signatures[members[0]]).mean()
+                ), 3),
+            }
+            for members in duplicate_clusters[:top]
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Near-duplicate detection over the preprocessed dataset.")
+    parser.add_argument("--input_path", type=str, default="data/preprocessed_dataset.json", help="Relative to PROJECT_ROOT.")
+    parser.add_argument("--output_path", type=str, default="data/deduplicated_dataset.json", help="Filtered dataset, relative to PROJECT_ROOT.")
+    parser.add_argument("--report_path", type=str, default="data/near_duplicate_report.json", help="Cluster report, relative to PROJECT_ROOT.")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Jaccard similarity of word shingles above which two CVs are near-duplicates.")
+    parser.add_argument("--mode", choices=["representative", "cap", "report"], default="representative",
+                        help="Keep one CV per cluster, keep up to --max_per_cluster diverse CVs per cluster, or only write the report.")
+    parser.add_argument("--max_per_cluster", type=int, default=3, help="CVs kept per cluster with --mode cap.")
+    parser.add_argument("--num_perm", type=int, default=128, help="MinHash permutations.")
+    parser.add_argument("--shingle_size", type=int, default=5, help="Words per shingle.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes computing the signatures.")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with open(os.path.join(PROJECT_ROOT, args.input_path), "rb") as f:
+        dataset: list[dict] = json.load(f)
+    logger.info(f"Loaded {len(dataset)} CVs from {args.input_path}")
+
+    start = time.perf_counter()
+    signatures = minhash_signatures(
+        [row["Text"] for row in dataset], args.num_perm, args.shingle_size, args.seed, workers=args.workers
+    )
+    logger.info(f"Computed {args.num_perm} MinHash values per CV in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    bands, rows = choose_bands(args.num_perm, args.threshold)
+    labels = cluster_near_duplicates(signatures, args.threshold, args.seed)
+    clusters = group_clusters(labels)
+    logger.info(
+        f"Found {len(clusters)} clusters with LSH of {bands} bands x {rows} rows in {time.perf_counter() - start:.1f}s"
+    )
+
+    limit = 1 if args.mode == "representative" else args.max_per_cluster
+    if args.mode == "report":
+        kept = set(range(len(dataset)))
+    else:
+        kept = {i for members in clusters.values() for i in select_diverse(signatures, members, limit)}
+
+    report = build_report(dataset, clusters, kept, signatures, args)
+    with open(os.path.join(PROJECT_ROOT, args.report_path), "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(
+        f"{report['rows_in_duplicate_clusters']} CVs in {report['duplicate_clusters']} near-duplicate clusters; "
+        f"keeping {report['rows_kept']}/{report['rows']} CVs, about {report['estimated_prompt_tokens_saved']} "
+        f"prompt tokens saved. Report written to {args.report_path}"
+    )
+
+    if args.mode != "report":
+        with open(os.path.join(PROJECT_ROOT, args.output_path), "w") as f:
+            json.dump([row for i, row in enumerate(dataset) if i in kept], f, indent=2)
+        logger.info(f"Wrote the filtered dataset to {args.output_path}")
+
+
+if __name__ == "__main__":
+    main()
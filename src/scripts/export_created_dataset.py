@@ -0,0 +1,24 @@
+"""Export the JSONL result store of create_dataset.py to the JSON array read by postprocess_created_dataset.py."""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+PROJECT_ROOT = os.getenv("PROJECT_ROOT")
+
+import sys
+sys.path.append(os.path.join(PROJECT_ROOT, "src"))
+
+import argparse
+from utils.result_store import JsonlResultStore, export_json_array
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the generated records to a JSON array.")
+    parser.add_argument("--store_path", type=str, default="data/orig_structured_dataset.jsonl")
+    parser.add_argument("--output_path", type=str, default="data/orig_structured_dataset.json")
+    args = parser.parse_args()
+
+    store = JsonlResultStore(os.path.join(PROJECT_ROOT, args.store_path))
+    count = export_json_array(store, os.path.join(PROJECT_ROOT, args.output_path))
+    print(f"Exported {count} records to {args.output_path}")
@@ -0,0 +1,65 @@
+"""Script to merge the per-shard result files of a sharded create_dataset.py run into the result store.
+
+Keeps one record per ID, so shards processed twice (e.g. after a lease
+expired) are not duplicated, and exports the store as a JSON array.
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+PROJECT_ROOT = os.getenv("PROJECT_ROOT")
+
+import sys
+sys.path.append(os.path.join(PROJECT_ROOT, "src"))
+
+import argparse
+import glob
+import logging
+
+from utils.result_store import JsonlResultStore, default_dataset_paths, export_json_array, merge_result_files
+from utils.work_leases import create_lease_backend
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the shard files of a sharded run.")
+    parser.add_argument("--shard_dir", type=str, default="data/shards", help="Directory of the shard files, relative to PROJECT_ROOT.")
+    parser.add_argument("--store_path", type=str, default=None, help="Result store to merge into, relative to PROJECT_ROOT. Defaults to the store of create_dataset.py, with or without --training_ready.")
+    parser.add_argument("--output_path", type=str, default=None, help="Exported JSON array, relative to PROJECT_ROOT. Defaults to the export of create_dataset.py, with or without --training_ready.")
+    parser.add_argument("--training_ready", action="store_true", help="The shards come from a create_dataset.py --training_ready run: merge into its store and export.")
+    parser.add_argument("--lease_path", type=str, default=None, help="Lease store of the run, to report the shards that are not done.")
+    parser.add_argument("--lease_backend", choices=["sqlite", "file"], default="sqlite")
+    parser.add_argument("--skip_export", action="store_true", help="Do not export the result store to --output_path.")
+    args = parser.parse_args()
+    default_store_path, default_output_path = default_dataset_paths(args.training_ready)
+    args.store_path = args.store_path or default_store_path
+    args.output_path = args.output_path or default_output_path
+
+    if args.lease_path:
+        backend = create_lease_backend(args.lease_backend, os.path.join(PROJECT_ROOT, args.lease_path))
+        status = backend.status()
+        backend.close()
+        logger.info(f"Shards: {status}")
+        if status["done"] < sum(status.values()):
+            logger.warning("Some shards are not done; merging the partial results")
+
+    filepaths = sorted(glob.glob(os.path.join(PROJECT_ROOT, args.shard_dir, "shard_*.jsonl")))
+    store = JsonlResultStore(os.path.join(PROJECT_ROOT, args.store_path))
+    counts = merge_result_files(filepaths, store)
+    store.close()
+    logger.info(
+        f"Merged {len(filepaths)} shard files: {counts['added']} records added, "
+        f"{counts['duplicates']} duplicates dropped, {counts['failed']} failed IDs left for a later run"
+    )
+
+    if not args.skip_export:
+        output_filepath = os.path.join(PROJECT_ROOT, args.output_path)
+        count = export_json_array(store, output_filepath)
+        logger.info(f"Exported {count} records to {output_filepath}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Classification of the errors raised by OpenAI-compatible clients."""
+
+import email.utils
+import time
+
+import httpx
+import openai
+
+
+THROTTLED = "throttled"
+SERVER_ERROR = "server_error"
+UNAVAILABLE = "unavailable"
+TIMEOUT = "timeout"
+CONNECTION = "connection"
+FATAL = "fatal"
+
+
+def classify_error(error: Exception) -> str:
+    """Maps an exception to one of the error classes above.
+
+    Uses the exception type and HTTP status code, and falls back to the message
+    for providers that report errors inside the body of a successful response.
+    """
+    status_code = getattr(error, "status_code", None)
+
+    if isinstance(error, openai.RateLimitError) or status_code == 429:
+        return THROTTLED
+    # Errors raised while reading a streamed body reach the caller as httpx errors
+    if isinstance(error, (openai.APITimeoutError, httpx.TimeoutException)):
+        return TIMEOUT
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+        return CONNECTION
+    if status_code == 404:
+        return UNAVAILABLE
+    if status_code is not None and status_code >= 500:
+        return SERVER_ERROR
+    if status_code is not None:
+        return FATAL
+
+    error_str = str(error).lower()
+    if "429" in error_str or "rate limit" in error_str or "rate-limit" in error_str:
+        return THROTTLED
+    if "404" in error_str:
+        return UNAVAILABLE
+    if any(code in error_str for code in ("500", "502", "503", "504", "529")):
+        return SERVER_ERROR
+    return FATAL
+
+
+def get_retry_after(error: Exception) -> float | None:
+    """Returns the seconds the server asked to wait before a retry, or None.
+
+    Reads the `retry-after-ms` and `retry-after` headers of the error response;
+    the latter holds either seconds or an HTTP date.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_date = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_date.timestamp() - time.time())
@@ -0,0 +1,186 @@
+"""Offline teacher labelling through an OpenAI-compatible Batch API (`/v1/files` + `/v1/batches`)."""
+
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from openai import OpenAI
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Limits of the OpenAI Batch API for a single input file
+MAX_SHARD_REQUESTS = 50000
+MAX_SHARD_BYTES = 190 * 1024 ** 2
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def create_batch_request(custom_id: Any, request_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Turns the kwargs of `client.chat.completions.create` into one line of a batch input file."""
+    body = {key: value for key, value in request_kwargs.items() if key != "extra_body"}
+    body.update(request_kwargs.get("extra_body", {}))
+    body["stream"] = False
+    return {
+        "custom_id": str(custom_id),
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": body,
+    }
+
+
+def write_batch_shards(
+    batch_requests: Iterable[Dict[str, Any]],
+    output_dir: str,
+    shard_size: int = MAX_SHARD_REQUESTS,
+    max_shard_bytes: int = MAX_SHARD_BYTES
+) -> List[str]:
+    """Writes batch requests to JSONL shards that respect the per-file limits and returns their paths."""
+    os.makedirs(output_dir, exist_ok=True)
+    shard_paths: List[str] = []
+    shard_file = None
+    shard_requests = shard_bytes = 0
+
+    for batch_request in batch_requests:
+        line = (json.dumps(batch_request, ensure_ascii=False) + "\n").encode("utf-8")
+        if shard_file is None or shard_requests >= shard_size or shard_bytes + len(line) > max_shard_bytes:
+            if shard_file is not None:
+                shard_file.close()
+            shard_paths.append(os.path.join(output_dir, f"requests_{len(shard_paths):05d}.jsonl"))
+            shard_file = open(shard_paths[-1], "wb")
+            shard_requests = shard_bytes = 0
+        shard_file.write(line)
+        shard_requests += 1
+        shard_bytes += len(line)
+
+    if shard_file is not None:
+        shard_file.close()
+    return shard_paths
+
+
+def load_state(state_filepath: str) -> Dict[str, Any]:
+    """Loads the batch bookkeeping file: one entry per shard with its file, batch and collection status."""
+    if not os.path.exists(state_filepath):
+        return {"shards": []}
+    with open(state_filepath) as f:
+        return json.load(f)
+
+
+def save_state(state: Dict[str, Any], state_filepath: str) -> None:
+    tmp_filepath = state_filepath + ".tmp"
+    with open(tmp_filepath, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_filepath, state_filepath)
+
+
+def submit_batch_shards(
+    client: OpenAI,
+    state: Dict[str, Any],
+    completion_window: str = "24h",
+    metadata: Dict[str, str] | None = None
+) -> None:
+    """Uploads every shard that has no batch yet and creates its batch."""
+    for shard in state["shards"]:
+        if shard.get("batch_id"):
+            continue
+        if not shard.get("file_id"):
+            with open(shard["path"], "rb") as f:
+                shard["file_id"] = client.files.create(file=f, purpose="batch").id
+        batch = client.batches.create(
+            input_file_id=shard["file_id"],
+            endpoint=BATCH_ENDPOINT,
+            completion_window=completion_window,
+            metadata=metadata,
+        )
+        shard["batch_id"] = batch.id
+        shard["status"] = batch.status
+        logger.info(f"Submitted {shard['path']} as batch {batch.id}")
+
+
+def poll_batches(
+    client: OpenAI,
+    state: Dict[str, Any],
+    interval: float = 60.0,
+    timeout: float | None = None,
+    on_update: Callable[[Dict[str, Any]], None] | None = None
+) -> bool:
+    """Polls the submitted batches until all of them are finished; returns False on timeout."""
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    while True:
+        pending = 0
+        for shard in state["shards"]:
+            if not shard.get("batch_id") or shard.get("status") in TERMINAL_STATUSES:
+                continue
+            batch = client.batches.retrieve(shard["batch_id"])
+            shard["status"] = batch.status
+            shard["output_file_id"] = batch.output_file_id
+            shard["error_file_id"] = batch.error_file_id
+            counts = batch.request_counts
+            if counts is not None:
+                shard["request_counts"] = {
+                    "total": counts.total, "completed": counts.completed, "failed": counts.failed
+                }
+            logger.info(f"Batch {batch.id}: {batch.status} {shard.get('request_counts', '')}")
+            if batch.status not in TERMINAL_STATUSES:
+                pending += 1
+        if on_update:
+            on_update(state)
+        if not pending:
+            return True
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        time.sleep(interval)
+
+
+def iter_batch_output(client: OpenAI, file_id: str) -> Iterator[Dict[str, Any]]:
+    """Streams the lines of a batch output or error file."""
+    with client.files.with_streaming_response.content(file_id) as response:
+        for line in response.iter_lines():
+            if line.strip():
+                yield json.loads(line)
+
+
+def parse_batch_result(result: Dict[str, Any]) -> Tuple[str, str | None, Dict[str, Any] | None, Any]:
+    """Returns (custom_id, message content, usage, error) of one batch output line."""
+    response = result.get("response") or {}
+    body = response.get("body") or {}
+    if result.get("error") or response.get("status_code", 200) != 200 or not body.get("choices"):
+        return result["custom_id"], None, body.get("usage"), result.get("error") or body.get("error")
+    return result["custom_id"], body["choices"][0]["message"]["content"], body.get("usage"), None
+
+
+def collect_batch_results(
+    client: OpenAI,
+    state: Dict[str, Any],
+    rows_by_id: Dict[str, dict],
+    parse_response: Callable[[str], dict | None],
+    timestamp: Callable[[], str]
+) -> Iterator[List[Dict[str, Any]]]:
+    """Downloads the finished batches and yields, per batch, the records merged by `custom_id`.
+
+    Records use the same format as the online path. Failed or unparsable requests
+    are logged and left out, so the next run picks them up again.
+    """
+    for shard in state["shards"]:
+        if shard.get("collected") or shard.get("status") not in TERMINAL_STATUSES:
+            continue
+        records = []
+        failed = 0
+        if shard.get("output_file_id"):
+            for result in iter_batch_output(client, shard["output_file_id"]):
+                custom_id, content, _, error = parse_batch_result(result)
+                response_json = parse_response(content) if content else None
+                if custom_id not in rows_by_id or not response_json:
+                    failed += 1
+                    logger.warning(f"Batch request {custom_id} failed: {error or 'invalid JSON response'}")
+                    continue
+                records.append({**rows_by_id[custom_id], "timestamp": timestamp(), "json": response_json})
+        if shard.get("error_file_id"):
+            for result in iter_batch_output(client, shard["error_file_id"]):
+                failed += 1
+                logger.warning(f"Batch request {result.get('custom_id')} failed: {result.get('error')}")
+
+        logger.info(f"Batch {shard['batch_id']} ({shard['status']}): {len(records)} records, {failed} failed")
+        yield records
+        shard["collected"] = True
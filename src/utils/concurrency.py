@@ -0,0 +1,195 @@
+"""Adaptive concurrency control for the teacher requests."""
+
+import asyncio
+import collections
+import logging
+import threading
+import time
+
+from utils.api_errors import THROTTLED, SERVER_ERROR, TIMEOUT, CONNECTION
+
+logger = logging.getLogger(__name__)
+
+
+class AIMDController:
+    """Concurrency limit tuned by additive increase / multiplicative decrease.
+
+    Every healthy response adds `increase / limit` to the limit, i.e. about
+    `increase` per round of `limit` requests. Throttling (429), a rising
+    server-error rate or a latency well above the best observed latency cut the
+    limit by `decrease`. After a cut, further cuts wait for `cooldown` seconds,
+    so one burst of 429s from requests that were already in flight only counts once.
+
+    The controller is also the gate of the in-flight requests: threads call
+    `acquire`/`release` and coroutines `acquire_async`/`release`.
+
+    Args:
+        name: Label used in the logs, e.g. "model@provider"
+        initial: Starting concurrency limit
+        minimum: Lowest limit
+        maximum: Highest limit
+        increase: Additive increase per round of requests
+        decrease: Multiplicative factor applied on throttling
+        latency_tolerance: Latency EWMA over baseline ratio treated as congestion
+        error_rate_threshold: Server-error rate EWMA treated as overload
+        cooldown: Minimum seconds between two decreases
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial: int = 16,
+        minimum: int = 1,
+        maximum: int = 256,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        latency_tolerance: float = 2.0,
+        error_rate_threshold: float = 0.1,
+        cooldown: float = 5.0
+    ):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.error_rate_threshold = error_rate_threshold
+        self.cooldown = cooldown
+
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._async_waiters: collections.deque = collections.deque()
+        self._limit = float(min(max(initial, minimum), maximum))
+        self._in_flight = 0
+        self._latency_ewma: float | None = None
+        self._baseline_latency: float | None = None
+        self._error_rate = 0.0
+        self._samples = 0
+        self._last_decrease = 0.0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def acquire(self) -> None:
+        """Blocks the calling thread until a request slot is free."""
+        with self._cond:
+            while self._in_flight >= self.limit:
+                self._cond.wait()
+            self._in_flight += 1
+
+    def try_acquire(self) -> bool:
+        """Takes a request slot if one is free, without waiting."""
+        with self._lock:
+            if self._in_flight >= self.limit:
+                return False
+            self._in_flight += 1
+            return True
+
+    async def acquire_async(self) -> None:
+        """Waits on the running event loop until a request slot is free."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self._in_flight < self.limit:
+                    self._in_flight += 1
+                    return
+                waiter = loop.create_future()
+                self._async_waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self._lock:
+                    try:
+                        self._async_waiters.remove(waiter)
+                    except ValueError:
+                        # Already woken for a free slot: pass the wake on to the next waiter
+                        self._wake_waiters()
+                raise
+
+    def release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self._wake_waiters()
+
+    def on_success(self, latency: float) -> None:
+        """Feeds back the latency of a successful response."""
+        with self._lock:
+            self._samples += 1
+            self._error_rate *= 0.95
+            self._latency_ewma = latency if self._latency_ewma is None else 0.8 * self._latency_ewma + 0.2 * latency
+            # The baseline follows the best latency seen, and drifts up slowly so that it
+            # can track providers whose latency legitimately changes during the run
+            if self._baseline_latency is None or self._latency_ewma < self._baseline_latency:
+                self._baseline_latency = self._latency_ewma
+            else:
+                self._baseline_latency *= 1.001
+
+            if self._samples >= 10 and self._latency_ewma > self._baseline_latency * self.latency_tolerance:
+                self._decrease(
+                    f"latency {self._latency_ewma:.1f}s is over {self.latency_tolerance:g}x "
+                    f"the baseline of {self._baseline_latency:.1f}s"
+                )
+            else:
+                self._increase()
+
+    def on_throttle(self, reason: str) -> None:
+        """Feeds back a throttled (429) request."""
+        with self._lock:
+            self._decrease(reason)
+
+    def on_error(self, reason: str) -> None:
+        """Feeds back a server error or a timeout; cuts the limit once they become frequent."""
+        with self._lock:
+            self._error_rate = 0.95 * self._error_rate + 0.05
+            if self._error_rate > self.error_rate_threshold:
+                self._decrease(f"{reason} (error rate {self._error_rate:.0%})")
+
+    def on_failure(self, error_class: str, detail: str = "") -> None:
+        """Feeds back a failed request according to its `utils.api_errors` class."""
+        if error_class == THROTTLED:
+            self.on_throttle(f"throttled {detail}".strip())
+        elif error_class in (SERVER_ERROR, TIMEOUT, CONNECTION):
+            self.on_error(error_class)
+
+    def _increase(self) -> None:
+        old_limit = self.limit
+        self._limit = min(float(self.maximum), self._limit + self.increase / self._limit)
+        if self.limit != old_limit:
+            logger.info(f"[{self.name}] concurrency {old_limit} -> {self.limit}: healthy responses")
+            self._wake_waiters()
+
+    def _decrease(self, reason: str) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        old_limit = self.limit
+        self._limit = max(float(self.minimum), self._limit * self.decrease)
+        # The latency measured at the old limit is no longer representative
+        self._latency_ewma = None
+        if self.limit != old_limit:
+            logger.warning(f"[{self.name}] concurrency {old_limit} -> {self.limit}: {reason}")
+
+    def _wake_waiters(self) -> None:
+        """Wakes as many waiters as there are free slots. Must be called with the lock held."""
+        free_slots = self.limit - self._in_flight
+        if free_slots <= 0:
+            return
+        self._cond.notify(free_slots)
+        while free_slots > 0 and self._async_waiters:
+            waiter = self._async_waiters.popleft()
+            if waiter.done():
+                continue
+            waiter.get_loop().call_soon_threadsafe(_resolve, waiter)
+            free_slots -= 1
+
+
+def _resolve(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
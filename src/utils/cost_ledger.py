@@ -0,0 +1,210 @@
+"""Token and cost accounting of the teacher requests, with run budgets."""
+
+import asyncio
+import collections
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict
+
+from utils.generation_metrics import get_cached_prompt_tokens
+from utils.model_catalog import compute_cost
+
+logger = logging.getLogger(__name__)
+
+
+def new_record_usage() -> Dict[str, Any]:
+    """Returns the empty usage of one dataset record, summed over all the requests made for it."""
+    return {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "cost": 0.0}
+
+
+class CostLedger:
+    """Thread-safe running totals of tokens and cost per model.
+
+    Every request reserves its estimated cost and tokens before it is sent. A
+    request that does not fit next to the reservations of the requests in flight
+    waits for them to settle; once it does not fit next to the spent amount
+    alone, `exhausted` turns True and the engines stop sending new requests. A
+    run therefore only overshoots its budget by the error of the estimates (and
+    by hedged duplicates).
+
+    Args:
+        max_cost: Budget of the run in USD
+        max_tokens: Budget of the run in prompt + completion tokens
+    """
+
+    def __init__(self, max_cost: float | None = None, max_tokens: int | None = None):
+        self.max_cost = max_cost
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._async_waiters: collections.deque = collections.deque()
+        self._models: Dict[str, Dict[str, Any]] = {}
+        self._cost = 0.0
+        self._tokens = 0
+        self._reserved_cost = 0.0
+        self._reserved_tokens = 0
+        self._reservations = 0
+        self._exhausted = False
+
+    @property
+    def exhausted(self) -> bool:
+        return self._exhausted
+
+    @property
+    def cost(self) -> float:
+        return self._cost
+
+    def _model_totals(self, model_name: str) -> Dict[str, Any]:
+        if model_name not in self._models:
+            self._models[model_name] = {
+                **new_record_usage(),
+                "results": 0,
+                "failed_results": 0,
+                "first_request": time.time(),
+                "last_request": time.time(),
+            }
+        return self._models[model_name]
+
+    def _estimate(self, model_name: str, prompt_tokens: int, completion_tokens: int) -> Dict[str, float]:
+        return {
+            "cost": compute_cost(model_name, {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}),
+            "tokens": prompt_tokens + completion_tokens,
+        }
+
+    def _try_reserve(self, estimate: Dict[str, float]) -> bool | None:
+        """Returns True if reserved, False to wait for the requests in flight and None once exhausted.
+
+        Must be called with the lock held.
+        """
+        if self._exhausted:
+            return None
+        for spent, reserved, amount, budget, unit in (
+            (self._cost, self._reserved_cost, estimate["cost"], self.max_cost, "USD"),
+            (self._tokens, self._reserved_tokens, estimate["tokens"], self.max_tokens, "tokens"),
+        ):
+            if budget is None or spent + reserved + amount <= budget:
+                continue
+            if spent + amount > budget or not self._reservations:
+                self._exhausted = True
+                logger.warning(f"Budget of {budget:g} {unit} reached ({spent:g} spent); no new requests will be sent")
+                return None
+            return False
+        self._reserved_cost += estimate["cost"]
+        self._reserved_tokens += estimate["tokens"]
+        self._reservations += 1
+        return True
+
+    def reserve(self, model_name: str, prompt_tokens: int, completion_tokens: int) -> Dict[str, float] | None:
+        """Reserves the estimated cost and tokens of a request; returns None once the budget is exhausted."""
+        estimate = self._estimate(model_name, prompt_tokens, completion_tokens)
+        with self._cond:
+            while (reserved := self._try_reserve(estimate)) is False:
+                self._cond.wait()
+        return estimate if reserved else None
+
+    async def reserve_async(self, model_name: str, prompt_tokens: int, completion_tokens: int) -> Dict[str, float] | None:
+        """Waits on the running event loop for a reservation; returns None once the budget is exhausted."""
+        estimate = self._estimate(model_name, prompt_tokens, completion_tokens)
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                reserved = self._try_reserve(estimate)
+                if reserved is not False:
+                    return estimate if reserved else None
+                waiter = loop.create_future()
+                self._async_waiters.append(waiter)
+            await waiter
+
+    def release(self, estimate: Dict[str, float]) -> None:
+        """Gives back a reservation once its request is over; the actual usage goes through `record`."""
+        with self._lock:
+            self._reserved_cost -= estimate["cost"]
+            self._reserved_tokens -= estimate["tokens"]
+            self._reservations -= 1
+            self._cond.notify_all()
+            while self._async_waiters:
+                waiter = self._async_waiters.popleft()
+                if not waiter.done():
+                    waiter.get_loop().call_soon_threadsafe(_resolve, waiter)
+
+    def record(self, model_name: str, usage: Any, record_usage: Dict[str, Any] | None = None) -> float:
+        """Adds the usage of one response to the model totals and to `record_usage`; returns its cost."""
+        if usage is None:
+            return 0.0
+        if isinstance(usage, dict):
+            prompt_tokens = usage.get("prompt_tokens") or 0
+            completion_tokens = usage.get("completion_tokens") or 0
+        else:
+            prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+            completion_tokens = getattr(usage, "completion_tokens", None) or 0
+        amounts = {
+            "requests": 1,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": get_cached_prompt_tokens(usage),
+            "completion_tokens": completion_tokens,
+            "cost": compute_cost(model_name, usage),
+        }
+        with self._lock:
+            totals = self._model_totals(model_name)
+            for key, amount in amounts.items():
+                totals[key] += amount
+                if record_usage is not None:
+                    record_usage[key] += amount
+            totals["last_request"] = time.time()
+            self._cost += amounts["cost"]
+            self._tokens += prompt_tokens + completion_tokens
+        return amounts["cost"]
+
+    def record_result(self, model_name: str, success: bool) -> None:
+        """Records one finished dataset record of a model."""
+        with self._lock:
+            totals = self._model_totals(model_name)
+            totals["results" if success else "failed_results"] += 1
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Returns the totals per model with the cost per parsed CV and the tokens per second."""
+        with self._lock:
+            summary = {}
+            for model_name, totals in self._models.items():
+                elapsed = max(totals["last_request"] - totals["first_request"], 1e-9)
+                tokens = totals["prompt_tokens"] + totals["completion_tokens"]
+                summary[model_name] = {
+                    **{k: v for k, v in totals.items() if k not in ("first_request", "last_request")},
+                    "cost_per_result": totals["cost"] / totals["results"] if totals["results"] else None,
+                    "tokens_per_sec": tokens / elapsed if totals["requests"] > 1 else None,
+                    "completion_tokens_per_sec": totals["completion_tokens"] / elapsed if totals["requests"] > 1 else None,
+                }
+            return summary
+
+    def log(self, logger: logging.Logger) -> None:
+        for model_name, stats in self.summary().items():
+            cost_per_result = f"${stats['cost_per_result']:.5f}" if stats["cost_per_result"] is not None else "n/a"
+            tokens_per_sec = f"{stats['tokens_per_sec']:.0f}" if stats["tokens_per_sec"] is not None else "n/a"
+            logger.info(
+                f"[{model_name}] ${stats['cost']:.4f} for {stats['results']} parsed CVs "
+                f"({stats['failed_results']} failed), {cost_per_result} per parsed CV | "
+                f"{stats['requests']} requests, {stats['prompt_tokens']} prompt tokens "
+                f"({stats['cached_tokens']} cached), {stats['completion_tokens']} completion tokens, "
+                f"{tokens_per_sec} tok/s"
+            )
+
+    def append_to(self, filepath: str, **extra: Any) -> None:
+        """Appends the summary of this run as one JSON line to the ledger file."""
+        if os.path.dirname(filepath):
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        line = {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            **extra,
+            "cost": self._cost,
+            "models": self.summary(),
+        }
+        with open(filepath, "a", encoding="utf-8") as f:
+            f.write(json.dumps(line) + "\n")
+
+
+def _resolve(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
@@ -0,0 +1,146 @@
+"""Packing of several CVs into one teacher request, so they share the system prompt and few-shot examples."""
+
+import collections
+import json
+import re
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Tuple
+
+from utils.json_repair import SCHEMA, TRUNCATED, has_values, reconcile_with_schema, repair_json
+
+PACK_INSTRUCTIONS = (
+    "This message contains {count} CVs, each one between <cv id=\"ID\"> and </cv>. "
+    "Extract every CV exactly as in the examples above and respond with one JSON object "
+    "that maps each CV id to the JSON extracted from that CV: {{\"<id>\": {{...}}, ...}}. "
+    "Include every id once and nothing else."
+)
+
+# Matches the CVs of a packed message, e.g. in the mock server
+PACKED_CV = re.compile(r'<cv id="([^"]*)">\n(.*?)\n</cv>', re.DOTALL)
+
+
+def pack_message(entries: List[Dict[str, Any]], text_column: str = "Text") -> str:
+    """Returns the user message of a request carrying several CVs."""
+    cvs = "\n\n".join(f'<cv id="{entry["ID"]}">\n{entry[text_column]}\n</cv>' for entry in entries)
+    return f"{PACK_INSTRUCTIONS.format(count=len(entries))}\n\n{cvs}"
+
+
+def parse_packed_response(content: str, ids: List[Any], schema: Any) -> Tuple[Dict[Any, dict], List[str]]:
+    """Returns the extracted JSON of each CV found in a packed response, by ID, and the local repairs it needed.
+
+    A truncated response is repaired, but the last CV in it is dropped because
+    its JSON is cut short. CVs that are missing, whose value is not an object,
+    or whose repaired value is empty, are left out for the caller to send again.
+    """
+    repairs: List[str] = []
+    try:
+        stripped = content
+        if "```json" in stripped:
+            stripped = stripped.replace("```json", "").replace("```", "").strip()
+        data = json.loads(stripped.strip())
+    except json.JSONDecodeError:
+        data, repairs = repair_json(content)
+        if data is not None and TRUNCATED in repairs and data:
+            data.pop(list(data)[-1])
+    if not isinstance(data, dict):
+        return {}, repairs
+
+    by_key = {str(_id): _id for _id in ids}
+    results = {}
+    for key, value in data.items():
+        if key not in by_key or not isinstance(value, dict):
+            continue
+        if repairs:
+            value, changed = reconcile_with_schema(schema, value)
+            if changed and SCHEMA not in repairs:
+                repairs.append(SCHEMA)
+            if not has_values(value):
+                continue
+        results[by_key[key]] = value
+    return results, repairs
+
+
+def split_usage(pack_usage: Dict[str, Any], entries: List[Dict[str, Any]]) -> None:
+    """Adds an equal share of the usage of a packed request to the usage of each of its entries."""
+    for entry in entries:
+        for key, amount in pack_usage.items():
+            entry["usage"][key] += amount / len(entries)
+
+
+class CvPacker:
+    """Groups entries into packs that fit a model's context and output limits; an iterator of lists of entries.
+
+    Packs are filled greedily in input order up to `max_pack_size` CVs. Entries
+    handed back with `requeue`, e.g. the CVs missing from a packed response, go
+    out alone before any new pack. The iterator may be exhausted and then yield
+    requeued entries again, which is what `RetryScheduler` and the async window
+    expect from their source of fresh items.
+
+    Args:
+        entries: Dataset entries, read lazily
+        max_pack_size: Maximum CVs per request; 1 disables packing
+        estimate_tokens: Returns the estimated (prompt, completion) tokens of one CV in a pack
+        max_input_tokens: Prompt tokens available to the CVs of a pack, after the shared prefix
+        max_output_tokens: Completion tokens available to a pack
+    """
+
+    def __init__(
+        self,
+        entries: Iterable[Dict[str, Any]],
+        max_pack_size: int,
+        estimate_tokens: Callable[[Dict[str, Any]], Tuple[int, int]],
+        max_input_tokens: int,
+        max_output_tokens: int
+    ):
+        self.entries = iter(entries)
+        self.max_pack_size = max_pack_size
+        self.estimate_tokens = estimate_tokens
+        self.max_input_tokens = max_input_tokens
+        self.max_output_tokens = max_output_tokens
+        self.requeued: Deque[Dict[str, Any]] = collections.deque()
+        self._next_entry: Dict[str, Any] | None = None
+        self.packs = 0
+        self.packed_entries = 0
+        self.resent = 0
+
+    def __iter__(self) -> Iterator[List[Dict[str, Any]]]:
+        return self
+
+    def __next__(self) -> List[Dict[str, Any]]:
+        if self.requeued:
+            self.packs += 1
+            self.packed_entries += 1
+            return [self.requeued.popleft()]
+        pack: List[Dict[str, Any]] = []
+        input_tokens = output_tokens = 0
+        while len(pack) < self.max_pack_size:
+            entry = self._next_entry if self._next_entry is not None else next(self.entries, None)
+            self._next_entry = None
+            if entry is None:
+                break
+            entry_input, entry_output = self.estimate_tokens(entry)
+            if pack and (
+                input_tokens + entry_input > self.max_input_tokens
+                or output_tokens + entry_output > self.max_output_tokens
+            ):
+                # Starts the next pack
+                self._next_entry = entry
+                break
+            pack.append(entry)
+            input_tokens += entry_input
+            output_tokens += entry_output
+        if not pack:
+            raise StopIteration
+        self.packs += 1
+        self.packed_entries += len(pack)
+        return pack
+
+    def requeue(self, entries: List[Dict[str, Any]]) -> None:
+        self.requeued.extend(entries)
+        self.resent += len(entries)
+
+    def summary(self) -> str:
+        mean = self.packed_entries / self.packs if self.packs else 0.0
+        return (
+            f"{self.packs} requests carried {self.packed_entries} CVs ({mean:.2f} per request), "
+            f"{self.resent} CVs sent again alone"
+        )
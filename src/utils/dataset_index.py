@@ -0,0 +1,108 @@
+"""Byte-offset index of a dataset file, so its records are read one at a time in any order."""
+
+import json
+import threading
+from typing import Any, Dict, Iterable, Iterator, List
+
+_WHITESPACE = " \t\r\n"
+
+
+def _scan_json_array(filepath: str, chunk_chars: int) -> Iterator[tuple]:
+    """Yields (record, byte offset, byte length) for the objects of a JSON array file, holding one chunk at a time."""
+    decoder = json.JSONDecoder()
+    # No newline translation: a "\r\n" read as "\n" would shift every later offset by a byte
+    with open(filepath, encoding="utf-8", newline="") as f:
+        buffer = f.read(chunk_chars)
+        eof = not buffer
+        pos = offset = 0
+        opened = False
+        while True:
+            # Whitespace, the opening bracket and the commas between records are ASCII: one byte each
+            while pos < len(buffer) and (buffer[pos] in _WHITESPACE or buffer[pos] == "," or (buffer[pos] == "[" and not opened)):
+                opened = opened or buffer[pos] == "["
+                pos += 1
+                offset += 1
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                if pos == len(buffer):
+                    raise json.JSONDecodeError("Chunk ended between records", buffer, pos)
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    if pos == len(buffer):
+                        return
+                    raise
+                # The record continues in the next chunk; chunks grow so that a huge record is read in O(n)
+                more = f.read(max(chunk_chars, len(buffer)))
+                eof = not more
+                buffer = buffer[pos:] + more
+                pos = 0
+                continue
+            length = len(buffer[pos:end].encode("utf-8"))
+            yield record, offset, length
+            offset += length
+            pos = end
+
+
+def _scan_jsonl(filepath: str) -> Iterator[tuple]:
+    offset = 0
+    with open(filepath, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line), offset, len(line)
+            offset += len(line)
+
+
+class DatasetIndex:
+    """ID, position and text length of every record of a JSON array (or `.jsonl`) dataset file.
+
+    Building the index parses the file once, keeping a few integers per record
+    instead of the records, so runs over 100k+ CVs stream the texts from disk
+    and can still order them by length.
+
+    Args:
+        filepath: Dataset file, e.g. preprocessed_dataset.json
+        text_column: Field whose length is indexed
+        chunk_chars: Characters read at a time while indexing
+    """
+
+    def __init__(self, filepath: str, text_column: str = "Text", chunk_chars: int = 1 << 20):
+        self.filepath = filepath
+        self.ids: List[Any] = []
+        self.offsets: List[int] = []
+        self.lengths: List[int] = []
+        self.text_lengths: List[int] = []
+        scan = _scan_jsonl(filepath) if filepath.endswith(".jsonl") else _scan_json_array(filepath, chunk_chars)
+        for record, offset, length in scan:
+            self.ids.append(record["ID"])
+            self.offsets.append(offset)
+            self.lengths.append(length)
+            self.text_lengths.append(len(record.get(text_column) or ""))
+        self._file = open(filepath, "rb")
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def read(self, position: int) -> Dict[str, Any]:
+        """Returns the record at `position`, in file order."""
+        with self._lock:
+            self._file.seek(self.offsets[position])
+            data = self._file.read(self.lengths[position])
+        return json.loads(data)
+
+    def records(self, positions: Iterable[int]) -> Iterator[Dict[str, Any]]:
+        """Reads the records at `positions` lazily, in the given order."""
+        for position in positions:
+            yield self.read(position)
+
+    def by_id(self, positions: Iterable[int]) -> List[int]:
+        return sorted(positions, key=lambda position: self.ids[position])
+
+    def longest_first(self, positions: Iterable[int]) -> List[int]:
+        """Orders positions by decreasing text length, so the slowest requests do not finish alone at the end of a run."""
+        return sorted(positions, key=lambda position: -self.text_lengths[position])
+
+    def close(self) -> None:
+        self._file.close()
@@ -2,6 +2,8 @@ import pandas as pd
 import re
 import random
 import json
+import concurrent.futures
+import functools
 from pathlib import Path
 import os
 import numpy as np
@@ -47,50 +49,132 @@ def find_discrete_anonymized_brackets(df: pd.DataFrame) -> dict:
     return match_counts
 
 
-def replace_job_title(df: pd.DataFrame) -> None:
+LANGUAGES = [
+    "English", "Spanish", "Mandarin Chinese", "Hindi", "Arabic", "Bengali", "Portuguese", "Russian", "Japanese",
+    "Punjabi", "German", "Javanese", "French", "Turkish", "Korean", "Greek"
+]
+
+JOB_TITLE = "job title"
+LANGUAGE = "language"
+SKILL = "skill"
+PLACEHOLDERS = (JOB_TITLE, LANGUAGE, SKILL)
+
+# Every casing of every placeholder in one matcher; the leading "[" keeps the scan fast
+PLACEHOLDER_PATTERN = re.compile(
+    r"\[(" + "|".join(re.escape(placeholder) for placeholder in PLACEHOLDERS) + r")\]", re.IGNORECASE
+)
+
+
+@functools.lru_cache(maxsize=None)
+def load_job_titles() -> dict:
     with open(os.path.join(Path(__file__).parent, 'category_to_job_titles_dict.json')) as f:
-        category_to_job_titles_dict = json.load(f)
+        return json.load(f)
+
+
+def substitute_text(text: str, category: str, placeholders: tuple, rng: random.Random) -> tuple:
+    """Substitutes the placeholders of a CV in a single scan; returns the text and whether it has a [skill].
 
-    job_title_comb = ['[job title]', '[Job Title]', '[Job title]', '[job Title]', '[JOB TITLE]']
-    for _, row in df.iterrows():
-        if not any([jb_title_cb in row['Text'] for jb_title_cb in job_title_comb]):
+    Each casing of [job title] gets its own random title of the category, shared
+    by its occurrences, as the per-row replacement drew one per casing; the
+    [language] placeholders get distinct languages the CV does not mention.
+    """
+    matches = list(PLACEHOLDER_PATTERN.finditer(text))
+    if not matches:
+        return text, False
+
+    has_skill = False
+    job_titles = {}
+    languages = []
+    num_languages = sum(match.group(1).lower() == LANGUAGE for match in matches)
+    if LANGUAGE in placeholders and num_languages:
+        # Finding the languages a CV mentions costs more than the scan itself, so only these CVs do it
+        lowered = text.lower()
+        languages = [language for language in LANGUAGES if language.lower() not in lowered]
+        # Without replacement, like before, unless there are more placeholders than unused languages
+        if num_languages <= len(languages):
+            languages = rng.sample(languages, num_languages)
+        else:
+            languages = rng.choices(LANGUAGES, k=num_languages)
+
+    parts = []
+    end = 0
+    for match in matches:
+        placeholder = match.group(1).lower()
+        if placeholder == SKILL:
+            has_skill = True
+            continue
+        if placeholder not in placeholders:
             continue
-        for jb_title_cb in job_title_comb:
-            if jb_title_cb in row['Text']:
-                random_job_title = random.choice(category_to_job_titles_dict[row['Category']])
-                row['Text'] = row['Text'].replace(jb_title_cb, random_job_title)
+        if placeholder == JOB_TITLE:
+            casing = match.group(1)
+            if casing not in job_titles:
+                job_titles[casing] = rng.choice(load_job_titles()[category])
+            replacement = job_titles[casing]
+        else:
+            replacement = languages.pop()
+        parts.append(text[end:match.start()])
+        parts.append(replacement)
+        end = match.end()
+    if not parts:
+        return text, has_skill
+    parts.append(text[end:])
+    return "".join(parts), has_skill
+
+
+def _substitute_chunk(texts: list, categories: list, placeholders: tuple, seed: str) -> tuple:
+    rng = random.Random(seed)
+    substituted, has_skill = [], []
+    for text, category in zip(texts, categories):
+        text, skill = substitute_text(text, category, placeholders, rng)
+        substituted.append(text)
+        has_skill.append(skill)
+    return substituted, has_skill
+
+
+def substitute_placeholders(
+    df: pd.DataFrame,
+    placeholders: tuple = PLACEHOLDERS,
+    workers: int = 1,
+    chunk_size: int = 20000,
+    seed: int | None = None
+) -> np.ndarray:
+    """Substitutes the placeholders of df['Text'] in place; returns the mask of the rows with a [skill] placeholder.
+
+    The CVs are processed in chunks of `chunk_size`, in `workers` processes. Each
+    chunk draws from its own generator, so a seed gives the same texts whatever
+    the number of workers.
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    texts = df['Text'].tolist()
+    categories = df['Category'].tolist()
+    starts = range(0, len(texts), chunk_size)
+    arguments = (
+        [texts[start:start + chunk_size] for start in starts],
+        [categories[start:start + chunk_size] for start in starts],
+        [placeholders] * len(starts),
+        [f"{seed}:{start}" for start in starts],
+    )
+    if workers <= 1 or len(starts) <= 1:
+        parts = list(map(_substitute_chunk, *arguments))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(_substitute_chunk, *arguments))
+    # Assigned as a column: the rows yielded by iterrows are copies
+    df['Text'] = [text for substituted, _ in parts for text in substituted]
+    return np.fromiter((skill for _, has_skill in parts for skill in has_skill), dtype=bool, count=len(texts))
+
+
+def replace_job_title(df: pd.DataFrame, workers: int = 1) -> None:
+    substitute_placeholders(df, (JOB_TITLE,), workers=workers)
     return None
 
-def remove_skill(df: pd.DataFrame) -> None:
-    skills_comb = ['[Skill]', '[skill]', '[SKILL]']
-    not_found_skill = [not any([sk_cb in row['Text'] for sk_cb in skills_comb]) for _, row in df.iterrows()]
+def remove_skill(df: pd.DataFrame) -> pd.DataFrame:
+    not_found_skill = ~df['Text'].str.contains(r"\[skill\]", flags=re.IGNORECASE, regex=True)
     return df[not_found_skill]
 
-def replace_language(df: pd.DataFrame) -> None:
-    languages = [
-        "English", "Spanish", "Mandarin Chinese", "Hindi", "Arabic", "Bengali", "Portuguese", "Russian", "Japanese",
-        "Punjabi", "German", "Javanese", "French", "Turkish", "Korean", "Greek"
-    ]
-
-    language_comb = ['[language]', '[Language]', '[LANGUAGE]']
-
-    rows_found = 0
-    for _, row in df.iterrows():
-        if not any([lang_cb in row['Text'] for lang_cb in language_comb]):
-            continue
-        rows_found += 1
-        for lang_cb in language_comb:
-            if lang_cb in row['Text']:
-                occurrences = row['Text'].count(lang_cb)
-                idx_languages_found = []
-                for idx, language in enumerate(languages):
-                    if language.lower() in row['Text'].lower():
-                        idx_languages_found.append(idx)
-                curr_languages = [v for i, v in enumerate(languages) if i not in idx_languages_found]
-
-                random_languages = np.random.choice(curr_languages, replace=False, size=occurrences)
-                for occurrence in range(occurrences):
-                    row['Text'] = row['Text'].replace(lang_cb, random_languages[occurrence])
+def replace_language(df: pd.DataFrame, workers: int = 1) -> None:
+    substitute_placeholders(df, (LANGUAGE,), workers=workers)
     return None
 
 if __name__ == "__main__":
@@ -0,0 +1,95 @@
+"""Pool of validated (CV, JSON) examples and a character n-gram retriever that picks the few-shot examples of a request."""
+
+import json
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from utils.rate_limiting import estimate_tokens
+from utils.record_validation import validate_extraction
+
+
+def make_example(_id: Any, text: str, data: dict, category: str | None = None) -> Dict[str, Any]:
+    """Returns a pool example with the tokens its user and assistant messages add to a request."""
+    response = json.dumps(data, ensure_ascii=False)
+    return {
+        "ID": _id,
+        "Category": category,
+        "Text": text,
+        "json": data,
+        "tokens": estimate_tokens([{"role": "user", "content": text}, {"role": "assistant", "content": response}]),
+    }
+
+
+def select_pool_examples(
+    records: Iterable[Dict[str, Any]], schema: Any, min_grounding: float = 0.8, max_tokens: int | None = None
+) -> List[Dict[str, Any]]:
+    """Keeps the labelled records usable as few-shot examples.
+
+    A record qualifies if its JSON needed no local repair, conforms to the schema
+    as is and is grounded in the CV, and if it fits in `max_tokens`.
+    """
+    examples = []
+    for record in records:
+        if record.get("repairs") or validate_extraction(record.get("json"), record["Text"], schema, min_grounding):
+            continue
+        example = make_example(record["ID"], record["Text"], record["json"], record.get("Category"))
+        if max_tokens is None or example["tokens"] <= max_tokens:
+            examples.append(example)
+    return examples
+
+
+class FewShotRetriever:
+    """Picks the pool examples most similar to a CV by TF-IDF over character n-grams.
+
+    The pool is vectorized once into a sparse matrix with L2-normalized rows, so
+    the similarities to a CV are one sparse matrix-vector product. Character
+    n-grams within words are robust to the OCR noise and formatting of the CVs.
+
+    Args:
+        examples: Pool examples from `make_example`
+        ngram_range: Lengths of the character n-grams
+        max_features: Largest vocabulary of n-grams kept
+        min_similarity: Cosine similarity below which an example does not help and is not sent
+    """
+
+    def __init__(
+        self,
+        examples: List[Dict[str, Any]],
+        ngram_range: tuple = (3, 5),
+        max_features: int = 1 << 18,
+        min_similarity: float = 0.2
+    ):
+        self.examples = examples
+        self.min_similarity = min_similarity
+        self.vectorizer = TfidfVectorizer(
+            analyzer="char_wb", ngram_range=ngram_range, max_features=max_features, sublinear_tf=True, dtype=np.float32
+        )
+        self.matrix = self.vectorizer.fit_transform([example["Text"] for example in examples])
+
+    def __len__(self) -> int:
+        return len(self.examples)
+
+    def select(
+        self, text: str, max_examples: int = 2, token_budget: int | None = None, exclude_id: Any = None
+    ) -> List[Dict[str, Any]]:
+        """Returns up to `max_examples` examples by decreasing similarity whose tokens fit in `token_budget` together.
+
+        An example too long for the remaining budget is skipped in favour of the
+        next most similar one. `exclude_id` keeps a CV from being its own example.
+        """
+        if max_examples <= 0 or not self.examples:
+            return []
+        similarities = (self.matrix @ self.vectorizer.transform([text]).T).toarray().ravel()
+        budget = token_budget if token_budget is not None else float("inf")
+        selected = []
+        for position in np.argsort(-similarities):
+            if similarities[position] < self.min_similarity or len(selected) == max_examples:
+                break
+            example = self.examples[position]
+            if example["ID"] == exclude_id or example["tokens"] > budget:
+                continue
+            selected.append(example)
+            budget -= example["tokens"]
+        return selected
@@ -0,0 +1,115 @@
+"""Throughput metrics for the dataset generation engines."""
+
+import logging
+import threading
+import time
+from typing import Any, Dict
+
+
+def get_cached_prompt_tokens(usage: Any) -> int:
+    """Returns the prompt tokens served from the provider's prompt cache, from `usage.prompt_tokens_details`."""
+    if isinstance(usage, dict):
+        details = usage.get("prompt_tokens_details")
+    else:
+        details = getattr(usage, "prompt_tokens_details", None)
+    if details is None:
+        return 0
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0
+    return getattr(details, "cached_tokens", None) or 0
+
+
+class ThroughputMeter:
+    """Thread-safe counter of teacher requests, parsed results and tokens."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self.requests = 0
+        self.cache_hits = 0
+        self.results = 0
+        self.failed_results = 0
+        self.aborted_streams = 0
+        self.repaired_responses = 0
+        self.timeouts = 0
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_latency = 0.0
+
+    def record_request(self, usage: Any = None, latency: float = 0.0) -> None:
+        """Records one API response, its latency and the tokens reported in its `usage` block."""
+        prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+        completion_tokens = getattr(usage, "completion_tokens", None) or 0
+        cached_prompt_tokens = get_cached_prompt_tokens(usage)
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_prompt_tokens += cached_prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.total_latency += latency
+
+    def record_cache_hit(self) -> None:
+        """Records a dataset entry answered from the response cache without an API request."""
+        with self._lock:
+            self.cache_hits += 1
+
+    def record_aborted_stream(self) -> None:
+        """Records a streamed response that was cut off because it went off-schema or over budget."""
+        with self._lock:
+            self.aborted_streams += 1
+
+    def record_repair(self) -> None:
+        """Records a response whose JSON was repaired locally instead of being requested again."""
+        with self._lock:
+            self.repaired_responses += 1
+
+    def record_timeout(self) -> None:
+        """Records a request that timed out or ran past its deadline."""
+        with self._lock:
+            self.timeouts += 1
+
+    def record_result(self, success: bool) -> None:
+        """Records one finished dataset entry."""
+        with self._lock:
+            self.results += 1
+            if not success:
+                self.failed_results += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        """Returns the counters and the rates since the meter was created."""
+        with self._lock:
+            elapsed = max(time.perf_counter() - self._start, 1e-9)
+            total_tokens = self.prompt_tokens + self.completion_tokens
+            return {
+                "elapsed_sec": elapsed,
+                "requests": self.requests,
+                "cache_hits": self.cache_hits,
+                "results": self.results,
+                "failed_results": self.failed_results,
+                "aborted_streams": self.aborted_streams,
+                "repaired_responses": self.repaired_responses,
+                "timeouts": self.timeouts,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_prompt_tokens": self.cached_prompt_tokens,
+                "uncached_prompt_tokens": self.prompt_tokens - self.cached_prompt_tokens,
+                "cached_prompt_share": self.cached_prompt_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+                "mean_latency_sec": self.total_latency / self.requests if self.requests else 0.0,
+                "completion_tokens": self.completion_tokens,
+                "requests_per_sec": self.requests / elapsed,
+                "results_per_sec": self.results / elapsed,
+                "tokens_per_sec": total_tokens / elapsed,
+                "completion_tokens_per_sec": self.completion_tokens / elapsed,
+            }
+
+    def log(self, logger: logging.Logger, label: str) -> None:
+        stats = self.snapshot()
+        logger.info(
+            f"[{label}] {stats['results']} results ({stats['failed_results']} failed) "
+            f"from {stats['requests']} requests and {stats['cache_hits']} cache hits in {stats['elapsed_sec']:.1f}s | "
+            f"{stats['requests_per_sec']:.2f} req/s, {stats['results_per_sec']:.2f} results/s, "
+            f"{stats['tokens_per_sec']:.0f} tok/s ({stats['completion_tokens_per_sec']:.0f} completion tok/s) | "
+            f"{stats['cached_prompt_share']:.0%} of {stats['prompt_tokens']} prompt tokens cached, "
+            f"mean latency {stats['mean_latency_sec']:.2f}s, {stats['aborted_streams']} streams aborted, "
+            f"{stats['repaired_responses']} responses repaired, {stats['timeouts']} requests timed out"
+        )
@@ -0,0 +1,202 @@
+"""HTTP transport of the teacher clients: connection pooling, keep-alive, HTTP/2 and request deadlines.
+
+httpx only bounds each phase of a request: the read timeout restarts with every
+chunk, so a provider that trickles a response keeps a worker busy for as long
+as it likes. The transports below add a total deadline per HTTP request. The
+OpenAI clients are created with `max_retries=0`, so an HTTP request is one
+attempt of a teacher call.
+"""
+
+import asyncio
+import importlib.util
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterator
+
+import httpx
+
+
+class DeadlineExceeded(httpx.TimeoutException):
+    """An HTTP request ran past its total deadline."""
+
+
+@dataclass(frozen=True)
+class TransportSettings:
+    """Connection pool and timeouts of the teacher clients.
+
+    Args:
+        max_connections: Open connections per client; None sizes the pool to the concurrency of the run
+        max_keepalive_connections: Idle connections kept open; None keeps all of them
+        keepalive_expiry: Seconds an idle connection is kept open
+        http2: Multiplex the requests over HTTP/2 connections (needs the `h2` package)
+        connect_timeout: Seconds to open a connection
+        read_timeout: Seconds without receiving a byte of the response
+        write_timeout: Seconds to send a chunk of the request
+        pool_timeout: Seconds to wait for a free connection of the pool
+        total_timeout: Seconds for the whole request, from taking a connection to the last byte; None for no deadline
+    """
+    max_connections: int | None = None
+    max_keepalive_connections: int | None = None
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+    connect_timeout: float = 10.0
+    read_timeout: float = 120.0
+    write_timeout: float = 30.0
+    pool_timeout: float = 30.0
+    total_timeout: float | None = 300.0
+
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=self.connect_timeout, read=self.read_timeout, write=self.write_timeout, pool=self.pool_timeout
+        )
+
+    def limits(self, connections: int) -> httpx.Limits:
+        max_connections = self.max_connections or connections
+        return httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=self.max_keepalive_connections or max_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def check(self) -> None:
+        if self.http2 and importlib.util.find_spec("h2") is None:
+            raise ImportError("HTTP/2 needs the `h2` package: pip install 'httpx[http2]'")
+
+
+def _cap_timeouts(request: httpx.Request, remaining: float) -> None:
+    """Caps every phase timeout of a request to the time left before its deadline."""
+    timeouts = request.extensions.get("timeout", {})
+    request.extensions["timeout"] = {
+        phase: remaining if timeout is None else min(timeout, remaining)
+        for phase, timeout in {**dict.fromkeys(("connect", "read", "write", "pool")), **timeouts}.items()
+    }
+
+
+def _deadline_error(request: httpx.Request, total_timeout: float) -> DeadlineExceeded:
+    return DeadlineExceeded(f"Request exceeded its deadline of {total_timeout:g}s", request=request)
+
+
+class _DeadlineByteStream(httpx.SyncByteStream):
+    def __init__(self, stream: httpx.SyncByteStream, request: httpx.Request, deadline: float, total_timeout: float):
+        self.stream = stream
+        self.request = request
+        self.deadline = deadline
+        self.total_timeout = total_timeout
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self.stream:
+            if time.monotonic() > self.deadline:
+                raise _deadline_error(self.request, self.total_timeout)
+            yield chunk
+
+    def close(self) -> None:
+        self.stream.close()
+
+
+class DeadlineTransport(httpx.BaseTransport):
+    """Wraps a transport so that each request fails with `DeadlineExceeded` after `total_timeout` seconds.
+
+    A blocked thread cannot be interrupted, so the phase timeouts are capped to
+    the deadline when the request starts and the deadline is checked between the
+    chunks of the body: a trickling body overruns it by at most one read timeout.
+
+    Args:
+        transport: Transport that sends the requests
+        total_timeout: Seconds per request, or None for no deadline
+    """
+
+    def __init__(self, transport: httpx.BaseTransport, total_timeout: float | None):
+        self.transport = transport
+        self.total_timeout = total_timeout
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if self.total_timeout is None:
+            return self.transport.handle_request(request)
+        deadline = time.monotonic() + self.total_timeout
+        _cap_timeouts(request, self.total_timeout)
+        try:
+            response = self.transport.handle_request(request)
+        except httpx.TimeoutException as e:
+            if time.monotonic() >= deadline:
+                raise _deadline_error(request, self.total_timeout) from e
+            raise
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_DeadlineByteStream(response.stream, request, deadline, self.total_timeout),
+            extensions=response.extensions,
+        )
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class _AsyncDeadlineByteStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, request: httpx.Request, deadline: float, total_timeout: float):
+        self.stream = stream
+        self.request = request
+        self.deadline = deadline
+        self.total_timeout = total_timeout
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        chunks = self.stream.__aiter__()
+        while True:
+            try:
+                async with asyncio.timeout_at(self.deadline):
+                    chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                return
+            except TimeoutError as e:
+                raise _deadline_error(self.request, self.total_timeout) from e
+            yield chunk
+
+    async def aclose(self) -> None:
+        await self.stream.aclose()
+
+
+class AsyncDeadlineTransport(httpx.AsyncBaseTransport):
+    """Asyncio counterpart of `DeadlineTransport` that cancels a request at its deadline exactly.
+
+    Args:
+        transport: Transport that sends the requests
+        total_timeout: Seconds per request, or None for no deadline
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, total_timeout: float | None):
+        self.transport = transport
+        self.total_timeout = total_timeout
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.total_timeout is None:
+            return await self.transport.handle_async_request(request)
+        deadline = asyncio.get_running_loop().time() + self.total_timeout
+        try:
+            async with asyncio.timeout_at(deadline):
+                response = await self.transport.handle_async_request(request)
+        except TimeoutError as e:
+            raise _deadline_error(request, self.total_timeout) from e
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_AsyncDeadlineByteStream(response.stream, request, deadline, self.total_timeout),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def create_http_client(settings: TransportSettings, connections: int) -> httpx.Client:
+    """Returns the client of the threaded engine, with a pool of `connections` unless the settings fix its size."""
+    settings.check()
+    transport = httpx.HTTPTransport(limits=settings.limits(connections), http2=settings.http2)
+    return httpx.Client(transport=DeadlineTransport(transport, settings.total_timeout), timeout=settings.timeout())
+
+
+def create_async_http_client(settings: TransportSettings, connections: int) -> httpx.AsyncClient:
+    """Asyncio counterpart of `create_http_client`."""
+    settings.check()
+    transport = httpx.AsyncHTTPTransport(limits=settings.limits(connections), http2=settings.http2)
+    return httpx.AsyncClient(
+        transport=AsyncDeadlineTransport(transport, settings.total_timeout), timeout=settings.timeout()
+    )
@@ -0,0 +1,317 @@
+"""Local repair of near-valid JSON responses, so they do not cost another teacher request."""
+
+import json
+import re
+from typing import Any, List, Tuple
+
+# Names of the repairs, as recorded on the repaired records
+FENCE = "fence"
+PROSE = "prose"
+TRAILING_COMMA = "trailing_comma"
+MISSING_COMMA = "missing_comma"
+EXTRA_COMMA = "extra_comma"
+UNESCAPED_QUOTE = "unescaped_quote"
+CONTROL_CHAR = "control_char"
+BAD_ESCAPE = "bad_escape"
+UNQUOTED = "unquoted"
+PYTHON_LITERAL = "python_literal"
+BRACKETS = "brackets"
+TRUNCATED = "truncated"
+SCHEMA = "schema"
+
+_FENCE = re.compile(r"```(?:json)?", re.IGNORECASE)
+# A run of string characters that need no attention
+_STRING_RUN = re.compile(r'[^"\\\x00-\x1f]+')
+_BARE_WORD = re.compile(r"[A-Za-z0-9_.+\-]+")
+_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?$")
+_LITERALS = {"true": "true", "false": "false", "null": "null", "True": "true", "False": "false", "None": "null"}
+_ESCAPES = set('"\\/bfnrtu')
+_CLOSERS = {"{": "}", "[": "]"}
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+
+class _Repairer:
+    """Single pass over a response that rewrites it into valid JSON, noting each kind of fix."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.out: List[str] = []
+        self.repairs: List[str] = []
+        self.stack: List[str] = []
+        # Last token written: open, key, colon, value or comma
+        self.last = None
+
+    def note(self, repair: str) -> None:
+        if repair not in self.repairs:
+            self.repairs.append(repair)
+
+    def expects_key(self) -> bool:
+        """True where an object key comes next, including after a value with its comma missing."""
+        return bool(self.stack) and self.stack[-1] == "{" and self.last in ("open", "comma", "value")
+
+    def separate(self) -> None:
+        """Adds the comma missing between two values."""
+        if self.last == "value":
+            self.out.append(",")
+            self.note(MISSING_COMMA)
+
+    def next_significant(self, i: int) -> str:
+        """Returns the next non-whitespace character from `i` on, or "" at the end."""
+        n = len(self.text)
+        while i < n and self.text[i] in " \t\r\n":
+            i += 1
+        return self.text[i] if i < n else ""
+
+    def run(self) -> Tuple[str, int]:
+        """Rewrites the text from its first "{"; returns the JSON and the index after the root object."""
+        text = self.text
+        n = len(text)
+        i = text.find("{")
+        while i < n:
+            char = text[i]
+            if char in " \t\r\n":
+                self.out.append(char)
+                i += 1
+            elif char == '"':
+                i = self.read_string(i + 1)
+            elif char in "{[":
+                self.separate()
+                self.stack.append(char)
+                self.out.append(char)
+                self.last = "open"
+                i += 1
+            elif char in "}]":
+                i += 1
+                if self.close(char):
+                    return "".join(self.out), i
+            elif char == ",":
+                if self.last in ("open", "comma"):
+                    self.note(EXTRA_COMMA)
+                else:
+                    self.out.append(",")
+                    self.last = "comma"
+                i += 1
+            elif char == ":":
+                if self.last == "key":
+                    self.out.append(":")
+                    self.last = "colon"
+                i += 1
+            else:
+                match = _BARE_WORD.match(text, i)
+                if match is None:
+                    # Stray character, e.g. a comment or a single quote
+                    self.note(UNQUOTED)
+                    i += 1
+                    continue
+                self.write_word(match.group())
+                i = match.end()
+
+        self.finish_truncated()
+        return "".join(self.out), n
+
+    def read_string(self, i: int) -> int:
+        text = self.text
+        n = len(text)
+        is_key = self.expects_key()
+        self.separate()
+        self.out.append('"')
+        while i < n:
+            match = _STRING_RUN.match(text, i)
+            if match:
+                self.out.append(match.group())
+                i = match.end()
+                continue
+            char = text[i]
+            if char == "\\":
+                if i + 1 >= n:
+                    i += 1
+                    break
+                if text[i + 1] in _ESCAPES:
+                    self.out.append(text[i:i + 2])
+                else:
+                    self.out.append("\\\\")
+                    self.note(BAD_ESCAPE)
+                    i -= 1
+                i += 2
+            elif char == '"':
+                # A quote followed by a delimiter or by the next string ends the string; others are content
+                if self.next_significant(i + 1) in ("", ",", "}", "]", ":", '"'):
+                    self.out.append('"')
+                    self.last = "key" if is_key else "value"
+                    return i + 1
+                self.out.append('\\"')
+                self.note(UNESCAPED_QUOTE)
+                i += 1
+            else:
+                self.out.append(_CONTROL_ESCAPES.get(char, f"\\u{ord(char):04x}"))
+                self.note(CONTROL_CHAR)
+                i += 1
+
+        # The response ended inside the string
+        self.out.append('"')
+        self.last = "key" if is_key else "value"
+        self.note(TRUNCATED)
+        return n
+
+    def write_word(self, word: str) -> None:
+        if self.expects_key():
+            self.separate()
+            self.out.append(json.dumps(word))
+            self.last = "key"
+            self.note(UNQUOTED)
+            return
+        self.separate()
+        if word in _LITERALS:
+            if _LITERALS[word] != word:
+                self.note(PYTHON_LITERAL)
+            self.out.append(_LITERALS[word])
+        elif _NUMBER.match(word):
+            self.out.append(word)
+        else:
+            self.out.append(json.dumps(word))
+            self.note(UNQUOTED)
+        self.last = "value"
+
+    def complete_pair(self) -> None:
+        """Gives a value to a key whose value is missing."""
+        if self.last == "key":
+            self.out.append(":")
+            self.last = "colon"
+        if self.last == "colon":
+            self.out.append("null")
+            self.last = "value"
+
+    def drop_trailing_comma(self) -> None:
+        if self.last == "comma":
+            index = len(self.out) - 1 - self.out[::-1].index(",")
+            del self.out[index]
+            self.last = "value"
+            self.note(TRAILING_COMMA)
+
+    def close(self, closer: str) -> bool:
+        """Closes the innermost container; returns True once the root object is closed."""
+        if not self.stack:
+            return True
+        opener = "{" if closer == "}" else "["
+        if opener not in self.stack:
+            # A closer without an opener
+            self.note(BRACKETS)
+            return False
+        self.drop_trailing_comma()
+        if self.stack[-1] == "{":
+            self.complete_pair()
+        while self.stack[-1] != opener:
+            # Closers the model skipped, e.g. `[{"a": "b"]`
+            self.out.append(_CLOSERS[self.stack.pop()])
+            self.note(BRACKETS)
+        self.stack.pop()
+        self.out.append(closer)
+        self.last = "value"
+        return not self.stack
+
+    def finish_truncated(self) -> None:
+        if not self.stack:
+            return
+        self.note(TRUNCATED)
+        while self.stack:
+            self.drop_trailing_comma()
+            if self.stack[-1] == "{":
+                self.complete_pair()
+            self.out.append(_CLOSERS[self.stack.pop()])
+            self.last = "value"
+
+
+def reconcile_with_schema(schema: Any, data: Any) -> Tuple[Any, bool]:
+    """Conforms `data` to the schema format of resume_json_schema.json; returns it and whether it changed.
+
+    Unknown keys are dropped, missing ones added empty, nulls and scalars of the
+    wrong type converted, and a lone item where a list is expected wrapped in a list.
+    """
+    if isinstance(schema, dict):
+        if not isinstance(data, dict):
+            data, changed = {}, True
+        else:
+            changed = any(key not in schema for key in data)
+        result = {}
+        for key, value_schema in schema.items():
+            value, value_changed = reconcile_with_schema(value_schema, data.get(key))
+            result[key] = value
+            changed = changed or value_changed or key not in data
+        return result, changed
+
+    if isinstance(schema, list):
+        changed = False
+        if data is None:
+            data, changed = [], True
+        elif not isinstance(data, list):
+            data, changed = [data], True
+        item_schema = schema[0] if schema else "string"
+        items = []
+        for item in data:
+            if item is None or (isinstance(item_schema, dict) and not isinstance(item, dict)):
+                changed = True
+                continue
+            item, item_changed = reconcile_with_schema(item_schema, item)
+            items.append(item)
+            changed = changed or item_changed
+        return items, changed
+
+    if isinstance(data, str):
+        return data, False
+    if data is None or isinstance(data, (dict, list)):
+        return "", True
+    return str(data).lower() if isinstance(data, bool) else str(data), True
+
+
+def has_values(data: Any) -> bool:
+    """True if a JSON value holds at least one non-empty scalar, at any depth."""
+    if isinstance(data, dict):
+        return any(has_values(value) for value in data.values())
+    if isinstance(data, list):
+        return any(has_values(item) for item in data)
+    if isinstance(data, str):
+        return bool(data.strip())
+    return data is not None
+
+
+def repair_json(text: str, schema: Any = None) -> Tuple[dict | None, List[str]]:
+    """Turns a near-valid JSON response into a JSON object without another request.
+
+    Strips markdown fences and prose around the object, then fixes trailing,
+    missing and doubled commas, unescaped quotes, raw control characters, bad
+    escapes, unquoted keys and values, Python literals, mismatched brackets and
+    truncation. With `schema`, the result is also reconciled with it.
+
+    Returns the object (None if it cannot be repaired, or holds no value, as a
+    refusal or prose with a stray "{" would) and the names of the repairs
+    applied, empty when the response was valid as is.
+    """
+    repairs: List[str] = []
+    stripped = text.strip()
+    if "```" in stripped:
+        stripped = _FENCE.sub("", stripped).strip()
+        repairs.append(FENCE)
+
+    start = stripped.find("{")
+    if start == -1:
+        return None, repairs
+    repairer = _Repairer(stripped)
+    fixed, end = repairer.run()
+    if start > 0 or stripped[end:].strip():
+        repairs.append(PROSE)
+    repairs.extend(repairer.repairs)
+
+    try:
+        data = json.loads(fixed)
+    except json.JSONDecodeError:
+        return None, repairs
+    if not isinstance(data, dict):
+        return None, repairs
+
+    if schema is not None and repairs:
+        data, changed = reconcile_with_schema(schema, data)
+        if changed:
+            repairs.append(SCHEMA)
+    if not has_values(data):
+        return None, repairs
+    return data, repairs
@@ -0,0 +1,65 @@
+"""Prices of the teacher models used to create the dataset."""
+
+from typing import Any, Dict
+
+from utils.generation_metrics import get_cached_prompt_tokens
+
+# USD per million tokens, as listed on OpenRouter; update them when the providers change their prices.
+# "cached_input" is the price of prompt tokens served from the provider's prompt cache.
+MODEL_PRICES: Dict[str, Dict[str, float]] = {
+    "google/gemma-3-27b-it:free": {"input": 0.0, "output": 0.0},
+    "meta-llama/llama-3.3-70b-instruct:free": {"input": 0.0, "output": 0.0},
+    "meta-llama/llama-3.3-70b-instruct": {"input": 0.13, "output": 0.39},
+    "google/gemini-2.5-flash-lite": {"input": 0.10, "output": 0.40, "cached_input": 0.025},
+    "qwen/qwen3-235b-a22b-2507": {"input": 0.13, "output": 0.60},
+}
+
+
+def _get_usage_field(usage: Any, name: str) -> Any:
+    if isinstance(usage, dict):
+        return usage.get(name)
+    return getattr(usage, name, None)
+
+
+def compute_cost(model_name: str, usage: Any) -> float:
+    """Returns the USD cost of a response.
+
+    Uses the `cost` that OpenRouter reports with `usage: {"include": true}`, and
+    falls back to `MODEL_PRICES` otherwise. Unknown models cost 0.
+    """
+    if usage is None:
+        return 0.0
+    reported_cost = _get_usage_field(usage, "cost")
+    if reported_cost is not None:
+        return float(reported_cost)
+
+    prices = MODEL_PRICES.get(model_name)
+    if prices is None:
+        return 0.0
+    prompt_tokens = _get_usage_field(usage, "prompt_tokens") or 0
+    completion_tokens = _get_usage_field(usage, "completion_tokens") or 0
+    cached_tokens = min(get_cached_prompt_tokens(usage), prompt_tokens)
+    cost = (
+        (prompt_tokens - cached_tokens) * prices["input"]
+        + cached_tokens * prices.get("cached_input", prices["input"])
+        + completion_tokens * prices["output"]
+    )
+    return cost / 1e6
+
+
+# Context window and maximum completion tokens, as listed on OpenRouter for the providers used
+MODEL_LIMITS: Dict[str, Dict[str, int]] = {
+    "google/gemma-3-27b-it:free": {"context": 96000, "max_output": 8192},
+    "meta-llama/llama-3.3-70b-instruct:free": {"context": 65536, "max_output": 8192},
+    "meta-llama/llama-3.3-70b-instruct": {"context": 131072, "max_output": 16384},
+    "google/gemini-2.5-flash-lite": {"context": 1048576, "max_output": 65535},
+    "qwen/qwen3-235b-a22b-2507": {"context": 262144, "max_output": 32768},
+}
+
+# Conservative limits of models missing from MODEL_LIMITS
+DEFAULT_MODEL_LIMITS = {"context": 32768, "max_output": 4096}
+
+
+def get_model_limits(model_name: str) -> Dict[str, int]:
+    """Returns the context window and maximum completion tokens of a model."""
+    return MODEL_LIMITS.get(model_name, DEFAULT_MODEL_LIMITS)
@@ -0,0 +1,166 @@
+"""MinHash / LSH near-duplicate detection for the CV texts."""
+
+import concurrent.futures
+import re
+import zlib
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+_WORD = re.compile(r"\w+")
+# Base of the polynomial that combines the word hashes of a shingle
+_SHINGLE_BASE = np.uint64(1000003)
+_MASK_32 = np.uint64(0xFFFFFFFF)
+
+
+def shingle_hashes(text: str, shingle_size: int = 5) -> np.ndarray:
+    """Returns the distinct 32-bit hashes of the word `shingle_size`-grams of a lowercased text.
+
+    Words are hashed once with crc32 and combined into shingles with a rolling
+    polynomial, so hashes are stable across processes and runs.
+    """
+    words = np.fromiter(
+        (zlib.crc32(word.encode("utf-8")) for word in _WORD.findall(text.lower())), dtype=np.uint64
+    )
+    if len(words) == 0:
+        return np.zeros(1, dtype=np.uint64)
+    if len(words) < shingle_size:
+        shingle_size = len(words)
+    hashes = np.zeros(len(words) - shingle_size + 1, dtype=np.uint64)
+    for offset in range(shingle_size):
+        hashes = hashes * _SHINGLE_BASE + words[offset:offset + len(hashes)]
+    return np.unique(hashes & _MASK_32)
+
+
+def _permutations(num_perm: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def _signatures_chunk(texts: Sequence[str], num_perm: int, shingle_size: int, seed: int) -> np.ndarray:
+    a, b = _permutations(num_perm, seed)
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    for i, text in enumerate(texts):
+        shingles = shingle_hashes(text, shingle_size)
+        # Multiply-add-shift hashing: the high 32 bits of a * x + b mod 2^64
+        hashed = (a[:, None] * shingles[None, :] + b[:, None]) >> np.uint64(32)
+        signatures[i] = hashed.min(axis=1)
+    return signatures
+
+
+def minhash_signatures(
+    texts: Sequence[str],
+    num_perm: int = 128,
+    shingle_size: int = 5,
+    seed: int = 1,
+    workers: int = 1,
+    chunk_size: int = 2000
+) -> np.ndarray:
+    """Returns the (len(texts), num_perm) uint32 MinHash signatures, computed by `workers` processes."""
+    chunks = [texts[start:start + chunk_size] for start in range(0, len(texts), chunk_size)]
+    if workers <= 1 or len(chunks) <= 1:
+        parts = [_signatures_chunk(chunk, num_perm, shingle_size, seed) for chunk in chunks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(
+                _signatures_chunk, chunks, [num_perm] * len(chunks), [shingle_size] * len(chunks), [seed] * len(chunks)
+            ))
+    if not parts:
+        return np.empty((0, num_perm), dtype=np.uint32)
+    return np.concatenate(parts)
+
+
+def choose_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """Picks the (bands, rows) of LSH that minimize false positives plus false negatives around `threshold`.
+
+    A pair with Jaccard similarity s becomes a candidate with probability 1 - (1 - s^rows)^bands.
+    """
+    similarities = np.linspace(0, 1, 201)
+    best, best_error = (1, num_perm), float("inf")
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        probability = 1 - (1 - similarities ** rows) ** bands
+        false_positive = np.trapezoid(probability[similarities < threshold], similarities[similarities < threshold])
+        false_negative = np.trapezoid(1 - probability[similarities >= threshold], similarities[similarities >= threshold])
+        if false_positive + false_negative < best_error:
+            best, best_error = (bands, rows), false_positive + false_negative
+    return best
+
+
+class _UnionFind:
+    def __init__(self, size: int):
+        self.parent = np.arange(size)
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def union(self, x: int, y: int) -> None:
+        root_x, root_y = self.find(x), self.find(y)
+        if root_x != root_y:
+            # The lower index becomes the root, so clusters are labelled by their first row
+            self.parent[max(root_x, root_y)] = min(root_x, root_y)
+
+
+def cluster_near_duplicates(signatures: np.ndarray, threshold: float = 0.8, seed: int = 1) -> np.ndarray:
+    """Returns a cluster label per row: the index of the first row of its cluster of near-duplicates.
+
+    Rows sharing an LSH bucket are candidates. Each candidate is checked against
+    the first row of its bucket and joined to its cluster if their estimated
+    similarity (the share of equal MinHash values) reaches `threshold`; checking
+    against one row keeps large template buckets linear in their size.
+    """
+    num_rows, num_perm = signatures.shape
+    bands, rows = choose_bands(num_perm, threshold)
+    multipliers = np.random.default_rng(seed).integers(1, 2 ** 63, size=rows, dtype=np.uint64)
+    union_find = _UnionFind(num_rows)
+
+    for band in range(bands):
+        keys = signatures[:, band * rows:(band + 1) * rows].astype(np.uint64) @ multipliers
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        # Runs of equal keys are the buckets; only those with two rows or more matter
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_keys)) + 1))
+        ends = np.append(starts[1:], num_rows)
+        shared = ends - starts > 1
+        for start, end in zip(starts[shared], ends[shared]):
+            bucket = order[start:end]
+            first = bucket[0]
+            similarities = (signatures[bucket[1:]] == signatures[first]).mean(axis=1)
+            for other in bucket[1:][similarities >= threshold]:
+                union_find.union(first, other)
+
+    return np.array([union_find.find(i) for i in range(num_rows)])
+
+
+def group_clusters(labels: np.ndarray) -> Dict[int, List[int]]:
+    """Maps each cluster label to the indices of its rows, in row order."""
+    clusters: Dict[int, List[int]] = {}
+    for index, label in enumerate(labels.tolist()):
+        clusters.setdefault(label, []).append(index)
+    return clusters
+
+
+def select_diverse(signatures: np.ndarray, members: List[int], limit: int) -> List[int]:
+    """Picks up to `limit` members of a cluster: the first one, then each time the least similar to those picked."""
+    selected = [members[0]]
+    if limit <= 1 or len(members) == 1:
+        return selected
+    candidates = np.array(members[1:])
+    # Highest similarity of every candidate to the selected members
+    closest = (signatures[candidates] == signatures[members[0]]).mean(axis=1)
+    while len(selected) < limit and len(candidates):
+        pick = int(np.argmin(closest))
+        selected.append(int(candidates[pick]))
+        candidates = np.delete(candidates, pick)
+        closest = np.delete(closest, pick)
+        if len(candidates):
+            closest = np.maximum(closest, (signatures[candidates] == signatures[selected[-1]]).mean(axis=1))
+    return sorted(selected)
@@ -0,0 +1,182 @@
+"""Health-based routing of the teacher requests over the providers of a model."""
+
+import collections
+import math
+import random
+import threading
+import time
+from typing import Iterable, List
+
+from utils.api_errors import THROTTLED, SERVER_ERROR, UNAVAILABLE, TIMEOUT, CONNECTION
+
+def percentile(values: Iterable[float], q: float) -> float:
+    """Returns the `q`-th percentile (0-100) of `values` by the nearest-rank method."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = min(len(ordered), max(1, math.ceil(q / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+class ProviderStats:
+    """Rolling latency window and error rate of one provider."""
+
+    def __init__(self, window: int):
+        self.latencies: collections.deque = collections.deque(maxlen=window)
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.hedges_won = 0
+        self.unavailable_until = 0.0
+
+
+class ProviderRouter:
+    """Sends each request to the healthiest of the allowed providers and decides when to hedge.
+
+    A provider's score is its median latency over the last `window` responses,
+    inflated by its error rate. Requests are spread with probability proportional
+    to 1 / score², so the fast providers take most of the load while the others
+    keep being sampled. Providers with fewer than `min_samples` responses are
+    tried first, and a provider that returns 404 or 429 is skipped for
+    `cooldown` seconds unless no other provider is left.
+
+    A request that is still running after the `hedge_percentile` latency of its
+    provider may be duplicated on another provider; `max_hedge_ratio` caps the
+    hedges as a share of the last `window` requests, checked as each hedge
+    starts, so that hedging cannot turn a slowdown into an overload.
+
+    Args:
+        providers: Allowed providers; `None` stands for the default routing of the API
+        window: Number of recent latencies kept per provider, and of recent requests the hedge cap applies to
+        min_samples: Responses needed before a provider's latency is trusted
+        error_penalty: Weight of the error rate in the score
+        cooldown: Seconds a throttled or unavailable provider is skipped
+        hedge_percentile: Latency percentile after which a request is hedged
+        max_hedge_ratio: Maximum share of hedged requests
+    """
+
+    def __init__(
+        self,
+        providers: List[str | None],
+        window: int = 200,
+        min_samples: int = 5,
+        error_penalty: float = 4.0,
+        cooldown: float = 30.0,
+        hedge_percentile: float = 95.0,
+        max_hedge_ratio: float = 0.1
+    ):
+        self.providers = list(providers) or [None]
+        self.min_samples = min_samples
+        self.error_penalty = error_penalty
+        self.cooldown = cooldown
+        self.hedge_percentile = hedge_percentile
+        self.max_hedge_ratio = max_hedge_ratio
+        self._lock = threading.Lock()
+        self._stats = {provider: ProviderStats(window) for provider in self.providers}
+        self._requests = 0
+        self._hedges = 0
+        # Whether each of the last `window` requests was a hedge
+        self._recent: collections.deque = collections.deque(maxlen=window)
+        self._recent_hedges = 0
+
+    def _score(self, stats: ProviderStats) -> float:
+        median = percentile(stats.latencies, 50)
+        return max(median, 1e-3) * (1 + self.error_penalty * stats.error_rate)
+
+    def choose(self, exclude: Iterable[str | None] = ()) -> str | None:
+        """Picks the provider for the next request, avoiding `exclude` when another one is available."""
+        exclude = set(exclude)
+        with self._lock:
+            now = time.monotonic()
+            candidates = [
+                p for p in self.providers
+                if p not in exclude and self._stats[p].unavailable_until <= now
+            ] or [p for p in self.providers if p not in exclude] or self.providers
+
+            unexplored = [p for p in candidates if len(self._stats[p].latencies) < self.min_samples]
+            if unexplored:
+                return min(unexplored, key=lambda p: self._stats[p].in_flight)
+            weights = [1 / self._score(self._stats[p]) ** 2 for p in candidates]
+            return random.choices(candidates, weights=weights)[0]
+
+    def on_start(self, provider: str | None, hedge: bool = False) -> None:
+        with self._lock:
+            stats = self._stats[provider]
+            stats.in_flight += 1
+            stats.requests += 1
+            self._requests += 1
+            if hedge:
+                self._hedges += 1
+            else:
+                # Hedges enter the window in `try_hedge`
+                self._add_recent(False)
+
+    def _add_recent(self, hedge: bool) -> None:
+        if len(self._recent) == self._recent.maxlen:
+            self._recent_hedges -= self._recent[0]
+        self._recent.append(hedge)
+        self._recent_hedges += hedge
+
+    def _under_hedge_cap(self) -> bool:
+        return self._recent_hedges < self.max_hedge_ratio * len(self._recent)
+
+    def try_hedge(self) -> bool:
+        """Counts a hedge about to start against the cap; False if the recent requests already hold their share."""
+        with self._lock:
+            if not self._under_hedge_cap():
+                return False
+            self._add_recent(True)
+            return True
+
+    def on_success(self, provider: str | None, latency: float) -> None:
+        with self._lock:
+            stats = self._stats[provider]
+            stats.in_flight -= 1
+            stats.latencies.append(latency)
+            stats.error_rate *= 0.95
+
+    def on_hedge_won(self, provider: str | None) -> None:
+        """Records that the hedged duplicate sent to `provider` answered first."""
+        with self._lock:
+            self._stats[provider].hedges_won += 1
+
+    def on_failure(self, provider: str | None, error_class: str) -> None:
+        """Feeds back a failed request according to its `utils.api_errors` class."""
+        with self._lock:
+            stats = self._stats[provider]
+            stats.in_flight -= 1
+            stats.failures += 1
+            if error_class in (THROTTLED, UNAVAILABLE):
+                stats.unavailable_until = time.monotonic() + self.cooldown
+            if error_class in (THROTTLED, UNAVAILABLE, SERVER_ERROR, TIMEOUT, CONNECTION):
+                stats.error_rate = 0.95 * stats.error_rate + 0.05
+
+    def on_cancel(self, provider: str | None) -> None:
+        """Feeds back a request that was stopped early, e.g. the loser of a hedge.
+
+        Its latency is not recorded: cut short, it would pull the hedge percentile down.
+        """
+        with self._lock:
+            self._stats[provider].in_flight -= 1
+
+    def hedge_delay(self, provider: str | None) -> float | None:
+        """Returns after how many seconds a request to `provider` should be hedged, or None."""
+        with self._lock:
+            stats = self._stats[provider]
+            if len(stats.latencies) < self.min_samples:
+                return None
+            if not self._under_hedge_cap():
+                return None
+            return percentile(stats.latencies, self.hedge_percentile)
+
+    def summary(self) -> str:
+        with self._lock:
+            parts = []
+            for provider, stats in self._stats.items():
+                parts.append(
+                    f"{provider or 'auto'}: {stats.requests} requests, "
+                    f"p50 {percentile(stats.latencies, 50):.1f}s, p95 {percentile(stats.latencies, 95):.1f}s, "
+                    f"error rate {stats.error_rate:.0%}, {stats.hedges_won} hedges won"
+                )
+            return f"{self._hedges} hedged of {self._requests} requests | " + "; ".join(parts)
@@ -0,0 +1,413 @@
+"""Token-bucket rate limiting for requests and tokens per minute."""
+
+import asyncio
+import contextlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List
+
+
+# Rough ratio used to estimate prompt tokens before a request is sent
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(messages: List[Dict[str, Any]], chars_per_token: float = CHARS_PER_TOKEN) -> int:
+    """Estimates the number of prompt tokens of a conversation from its length in characters."""
+    chars = 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            chars += len(content)
+        else:
+            chars += sum(len(part.get("text", "")) for part in content)
+    # A few tokens of chat-template overhead per message
+    return int(chars / chars_per_token) + 4 * len(messages)
+
+
+class _Bucket:
+    """Token bucket that may go into debt; the debt is the wait of the next reservation."""
+
+    def __init__(self, per_minute: float, burst: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(burst, 1.0)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount: float, now: float) -> float:
+        """Takes `amount` from the bucket and returns the seconds until it is covered."""
+        self._refill(now)
+        self.level -= amount
+        return max(0.0, -self.level / self.rate)
+
+    def give_back(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimitBackend:
+    """Storage of the buckets of a `TokenBucketRateLimiter`. Every method is atomic for all users of the backend.
+
+    Limits are given per minute for each of `TokenBucketRateLimiter.DIMENSIONS`;
+    a key without limits is not limited.
+    """
+
+    def configure(self, key: str, per_minute: Dict[str, float], burst_seconds: float) -> None:
+        """Sets the limits of a key, keeping the current state if they did not change."""
+        raise NotImplementedError
+
+    def take(self, key: str, amounts: Dict[str, float]) -> float:
+        """Takes the amounts from the buckets of a key and returns the seconds until all of them are covered."""
+        raise NotImplementedError
+
+    def adjust(self, key: str, amounts: Dict[str, float]) -> None:
+        """Takes positive amounts and gives back negative ones, without waiting."""
+        raise NotImplementedError
+
+    def reset(self, key: str | None = None) -> None:
+        """Refills the buckets of a key or all keys."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """Buckets in this process, shared by its threads and coroutines."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, Dict[str, _Bucket]] = {}
+        self._limits: Dict[str, tuple] = {}
+
+    def configure(self, key: str, per_minute: Dict[str, float], burst_seconds: float) -> None:
+        limits = (tuple(sorted(per_minute.items())), burst_seconds)
+        with self._lock:
+            if self._limits.get(key) == limits:
+                return
+            self._limits[key] = limits
+            self._buckets[key] = {
+                dimension: _Bucket(limit, limit / 60.0 * burst_seconds)
+                for dimension, limit in per_minute.items()
+            }
+
+    def take(self, key: str, amounts: Dict[str, float]) -> float:
+        with self._lock:
+            now = time.monotonic()
+            delay = 0.0
+            for dimension, bucket in self._buckets.get(key, {}).items():
+                delay = max(delay, bucket.take(amounts.get(dimension, 0), now))
+        return delay
+
+    def adjust(self, key: str, amounts: Dict[str, float]) -> None:
+        with self._lock:
+            now = time.monotonic()
+            buckets = self._buckets.get(key, {})
+            for dimension, amount in amounts.items():
+                if dimension not in buckets:
+                    continue
+                if amount > 0:
+                    buckets[dimension].take(amount, now)
+                else:
+                    buckets[dimension].give_back(-amount, now)
+
+    def reset(self, key: str | None = None) -> None:
+        with self._lock:
+            now = time.monotonic()
+            for k in ([key] if key else list(self._buckets)):
+                for bucket in self._buckets.get(k, {}).values():
+                    bucket.level = bucket.capacity
+                    bucket.updated = now
+
+
+class SqliteRateLimitBackend(RateLimitBackend):
+    """Buckets in a SQLite database, shared by the runs on one host that use the same API key.
+
+    Every run has its own buckets next to the shared ones, refilled at the shared
+    rate divided by the number of active runs (those that reserved within the last
+    `active_window` seconds). A request waits for both, so runs that compete get
+    an equal share whatever their concurrency, and a run alone gets the whole
+    limit once the others finish or go idle.
+
+    Args:
+        filepath: Database file; every run limited together must use the same one
+        run_id: Name of this run among the users of the database
+        active_window: Seconds after its last reservation during which a run counts as active
+    """
+
+    def __init__(self, filepath: str, run_id: str, active_window: float = 10.0):
+        self.filepath = filepath
+        self.run_id = run_id
+        self.active_window = active_window
+        # Number of active runs and when it was counted; this run checks in at most once a second
+        self._active = (1, float("-inf"))
+        if os.path.dirname(filepath):
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        # Autocommit mode, so that `BEGIN IMMEDIATE` starts the write transaction of a reservation
+        self._conn = sqlite3.connect(filepath, check_same_thread=False, timeout=60, isolation_level=None)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # The buckets are refilled from the clock anyway; losing the last commits in a power cut is harmless
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT NOT NULL,
+                dimension TEXT NOT NULL,
+                run_id TEXT NOT NULL,
+                per_minute REAL NOT NULL,
+                burst_seconds REAL NOT NULL,
+                level REAL NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (key, dimension, run_id)
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS runs (
+                key TEXT NOT NULL,
+                run_id TEXT NOT NULL,
+                last_seen REAL NOT NULL,
+                PRIMARY KEY (key, run_id)
+            )"""
+        )
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def configure(self, key: str, per_minute: Dict[str, float], burst_seconds: float) -> None:
+        now = time.time()
+        with self._transaction() as conn:
+            stored = {
+                dimension: (limit, burst) for dimension, limit, burst in conn.execute(
+                    "SELECT dimension, per_minute, burst_seconds FROM buckets WHERE key = ? AND run_id = ''", (key,)
+                )
+            }
+            if stored == {dimension: (limit, burst_seconds) for dimension, limit in per_minute.items()}:
+                return
+            # A run with other limits replaces them for all runs; the state of unchanged dimensions is kept
+            for dimension in stored.keys() - per_minute.keys():
+                conn.execute("DELETE FROM buckets WHERE key = ? AND dimension = ?", (key, dimension))
+            for dimension, limit in per_minute.items():
+                conn.execute(
+                    """INSERT INTO buckets (key, dimension, run_id, per_minute, burst_seconds, level, updated)
+                    VALUES (?, ?, '', ?, ?, ?, ?)
+                    ON CONFLICT (key, dimension, run_id) DO UPDATE SET
+                        per_minute = excluded.per_minute, burst_seconds = excluded.burst_seconds""",
+                    (key, dimension, limit, burst_seconds, max(limit / 60.0 * burst_seconds, 1.0), now)
+                )
+
+    def _active_runs(self, conn: sqlite3.Connection, key: str, now: float) -> int:
+        count, checked_at = self._active
+        if now - checked_at < 1.0:
+            return count
+        conn.execute(
+            "INSERT INTO runs (key, run_id, last_seen) VALUES (?, ?, ?) "
+            "ON CONFLICT (key, run_id) DO UPDATE SET last_seen = excluded.last_seen",
+            (key, self.run_id, now)
+        )
+        count = conn.execute(
+            "SELECT COUNT(*) FROM runs WHERE key = ? AND last_seen > ?", (key, now - self.active_window)
+        ).fetchone()[0]
+        self._active = (count, now)
+        return count
+
+    def _update(self, conn: sqlite3.Connection, key: str, amounts: Dict[str, float], now: float) -> float:
+        """Refills and charges the shared buckets of a key and the buckets of this run; returns the wait."""
+        shared = conn.execute(
+            "SELECT dimension, per_minute, burst_seconds, level, updated FROM buckets WHERE key = ? AND run_id = ''",
+            (key,)
+        ).fetchall()
+        if not shared:
+            return 0.0
+        share = 1.0 / self._active_runs(conn, key, now)
+        own = {
+            row[0]: row[1:] for row in conn.execute(
+                "SELECT dimension, level, updated FROM buckets WHERE key = ? AND run_id = ?", (key, self.run_id)
+            )
+        }
+        delay = 0.0
+        updates = []
+        for dimension, per_minute, burst_seconds, level, updated in shared:
+            amount = amounts.get(dimension, 0)
+            for run_id, rate, (level, updated) in (
+                ("", per_minute / 60.0, (level, updated)),
+                (self.run_id, per_minute / 60.0 * share, own.get(dimension, (None, now))),
+            ):
+                capacity = max(rate * burst_seconds, 1.0)
+                level = capacity if level is None else min(capacity, level + max(0.0, now - updated) * rate)
+                # Gives back at most up to the capacity, like `_Bucket.give_back`
+                level = level - amount if amount > 0 else min(capacity, level - amount)
+                delay = max(delay, -level / rate if level < 0 else 0.0)
+                updates.append((key, dimension, run_id, per_minute, burst_seconds, level, now))
+        conn.executemany(
+            "INSERT OR REPLACE INTO buckets (key, dimension, run_id, per_minute, burst_seconds, level, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            updates
+        )
+        return delay
+
+    def take(self, key: str, amounts: Dict[str, float]) -> float:
+        with self._transaction() as conn:
+            return self._update(conn, key, amounts, time.time())
+
+    def adjust(self, key: str, amounts: Dict[str, float]) -> None:
+        with self._transaction() as conn:
+            self._update(conn, key, amounts, time.time())
+
+    def reset(self, key: str | None = None) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM buckets WHERE run_id != '' AND (? IS NULL OR key = ?)", (key, key)
+            )
+            conn.execute(
+                "UPDATE buckets SET level = MAX(per_minute / 60.0 * burst_seconds, 1.0), updated = ? "
+                "WHERE ? IS NULL OR key = ?",
+                (time.time(), key, key)
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_rate_limit_backend(backend: str, filepath: str | None = None, run_id: str | None = None) -> RateLimitBackend:
+    if backend == "memory":
+        return InMemoryRateLimitBackend()
+    if backend == "sqlite":
+        return SqliteRateLimitBackend(filepath, run_id or f"{socket.gethostname()}-{os.getpid()}")
+    raise ValueError(f"Unknown rate limit backend: {backend}")
+
+
+@dataclass
+class Reservation:
+    """A slot handed out by `TokenBucketRateLimiter.reserve`.
+
+    The holder may send its request once `delay` seconds have passed since the reservation.
+    """
+    key: str
+    delay: float
+    amounts: Dict[str, float] = field(default_factory=dict)
+    settled: bool = False
+
+
+class TokenBucketRateLimiter:
+    """Rate limiter enforcing requests, input tokens and output tokens per minute together.
+
+    Reservations are computed under a short lock and the caller sleeps outside of
+    it, so waiting workers never block each other. Each limit is a token bucket
+    whose burst size is the amount that may be spent back-to-back; a bucket in
+    debt pushes the following reservations further into the future, which keeps
+    them in FIFO order. The same limiter can be shared by threads (`acquire`) and
+    coroutines (`acquire_async`), and by several processes through a shared
+    `RateLimitBackend`.
+
+    Args:
+        backend: Storage of the buckets; in memory by default
+    """
+
+    DIMENSIONS = ("requests", "input_tokens", "output_tokens")
+
+    def __init__(self, backend: RateLimitBackend | None = None):
+        self.backend = backend or InMemoryRateLimitBackend()
+
+    def set_backend(self, backend: RateLimitBackend) -> None:
+        """Moves the limiter to another backend, e.g. one shared with other runs; the configured limits must be set again."""
+        self.backend.close()
+        self.backend = backend
+
+    def configure(
+        self,
+        key: str,
+        rpm: int | None = None,
+        input_tpm: int | None = None,
+        output_tpm: int | None = None,
+        burst_seconds: float = 1.0
+    ) -> None:
+        """
+        Sets the limits of a key. Reconfiguring with the same limits keeps the current state.
+
+        Args:
+            key: The limited resource, e.g. the model name
+            rpm: Requests per minute limit
+            input_tpm: Prompt tokens per minute limit
+            output_tpm: Completion tokens per minute limit
+            burst_seconds: Seconds worth of each limit that may be spent at once
+        """
+        per_minute = {
+            dimension: limit
+            for dimension, limit in zip(self.DIMENSIONS, (rpm, input_tpm, output_tpm))
+            if limit
+        }
+        self.backend.configure(key, per_minute, burst_seconds)
+
+    def reserve(self, key: str, input_tokens: float = 0, output_tokens: float = 0) -> Reservation:
+        """Reserves one request with the estimated tokens and returns how long to wait for it."""
+        amounts = {"requests": 1, "input_tokens": input_tokens, "output_tokens": output_tokens}
+        delay = self.backend.take(key, amounts)
+        return Reservation(key=key, delay=delay, amounts=amounts)
+
+    def acquire(self, key: str, input_tokens: float = 0, output_tokens: float = 0) -> Reservation:
+        """Reserves a request and sleeps until it may be sent."""
+        reservation = self.reserve(key, input_tokens, output_tokens)
+        if reservation.delay > 0:
+            time.sleep(reservation.delay)
+        return reservation
+
+    async def acquire_async(self, key: str, input_tokens: float = 0, output_tokens: float = 0) -> Reservation:
+        """Reserves a request and awaits until it may be sent; a cancelled wait returns its reservation."""
+        reservation = self.reserve(key, input_tokens, output_tokens)
+        if reservation.delay > 0:
+            try:
+                await asyncio.sleep(reservation.delay)
+            except asyncio.CancelledError:
+                self.cancel(reservation)
+                raise
+        return reservation
+
+    def settle(self, reservation: Reservation, usage: Any = None) -> None:
+        """Replaces the estimated tokens of a reservation with the `usage` reported by the API.
+
+        Without usage (e.g. a failed request) the estimated output tokens are given back.
+        """
+        if reservation.settled:
+            return
+        reservation.settled = True
+        actual = {
+            "input_tokens": (
+                getattr(usage, "prompt_tokens", None) or 0
+                if usage is not None else reservation.amounts["input_tokens"]
+            ),
+            "output_tokens": getattr(usage, "completion_tokens", None) or 0,
+        }
+        differences = {
+            dimension: amount - reservation.amounts[dimension]
+            for dimension, amount in actual.items()
+            if amount != reservation.amounts[dimension]
+        }
+        if differences:
+            self.backend.adjust(reservation.key, differences)
+
+    def cancel(self, reservation: Reservation) -> None:
+        """Gives back everything a reservation took, for requests that were never sent."""
+        if reservation.settled:
+            return
+        reservation.settled = True
+        self.backend.adjust(reservation.key, {dimension: -amount for dimension, amount in reservation.amounts.items()})
+
+    def reset(self, key: str | None = None) -> None:
+        """Refills the buckets of a key or all keys."""
+        self.backend.reset(key)
@@ -0,0 +1,133 @@
+"""Normalization of the teacher outputs into the training format, applied per record as they are generated."""
+
+import collections
+import json
+import logging
+import threading
+from typing import Any, Dict, Iterable, List
+
+from utils.record_validation import EMPTY, validate_extraction
+
+logger = logging.getLogger(__name__)
+
+# Fields of a training record, as postprocess_created_dataset.py wrote them; the rest is bookkeeping of the run
+TRAINING_FIELDS = ("ID", "Category", "Text", "json", "timestamp")
+
+
+def fill_json_schema(schema, data):
+    if not isinstance(data, dict):
+        logger.warning(f"Expected dictionary for recursive call, but received '{type(data).__name__}'.")
+        return {}
+
+    filled_data = data.copy()
+
+    for key in list(filled_data.keys()):
+        if key not in schema:
+            logger.debug(f"Key '{key}' in the input data is not present in the schema. Removing it from the output.")
+            del filled_data[key]
+
+    for key, schema_value in schema.items():
+        if key not in filled_data:
+            logger.debug(f"Key '{key}' in the schema is not present in the input data. Adding it to the output.")
+            if isinstance(schema_value, str) and schema_value == "string":
+                filled_data[key] = ""
+            elif isinstance(schema_value, dict):
+                filled_data[key] = {}
+            elif isinstance(schema_value, list):
+                filled_data[key] = []
+        else:
+            # If the key exists, but the value is a dictionary or list,
+            # recursively call the function to check for nested missing keys.
+            if isinstance(schema_value, dict) and isinstance(filled_data[key], dict):
+                filled_data[key] = fill_json_schema(schema_value, filled_data[key])
+            elif isinstance(schema_value, list) and isinstance(filled_data[key], list):
+                # The schema for lists is a template. We don't want to create
+                # a new item, just ensure the existing ones are complete.
+                if len(schema_value) > 0 and isinstance(schema_value[0], dict):
+                    item_schema = schema_value[0]
+                    for i in range(len(filled_data[key])):
+                        # Only recursively call if the item is a dictionary
+                        if isinstance(filled_data[key][i], dict):
+                            filled_data[key][i] = fill_json_schema(item_schema, filled_data[key][i])
+                        else:
+                            logger.debug(f"Item at index {i} in list '{key}' is not a dictionary as expected by the schema.")
+                            filled_data[key][i] = {}
+    return filled_data
+
+def clean_non_url_string(json: dict) -> dict:
+    """Remove non-URL strings from the personal_urls field in personal_information."""
+    def is_url_valid(url: str) -> bool:
+        if len(url.split()) > 1:
+            return False
+        for st in [".com", "http", "www"]:
+            if st in url:
+                return True
+        return False
+
+    valid_urls = []
+    for url in json.get("personal_information", {}).get("personal_urls", []):
+        if is_url_valid(url):
+            valid_urls.append(url)
+
+    json["personal_information"]["personal_urls"] = valid_urls
+    return json
+
+
+def to_training_records(records: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Keeps the normalized records that are fit for training, with their TRAINING_FIELDS only.
+
+    Failed records ("json" None, which includes the outputs without any value)
+    and the ones that failed validation are left out.
+    """
+    return [
+        {field: record[field] for field in TRAINING_FIELDS if field in record}
+        for record in records
+        if record.get("json") is not None and record.get("validation") is None
+    ]
+
+
+class RecordPipeline:
+    """Turns a generated record into its training form: validate, fill the schema, clean the URLs, serialize.
+
+    Called by the generation workers on each record as it completes, so the
+    records reach the result store in the format of postprocess_created_dataset.py
+    ("json" as a JSON string), with the non-URL personal_urls removed as well.
+    Invalid outputs are tagged with the reason in "validation", and outputs
+    without any value become failures ("json" None); `to_training_records`
+    leaves both out, as create_dataset.py --training_ready does before storing.
+
+    Args:
+        schema: JSON schema template (resume_json_schema.json)
+        min_grounding: Share of the JSON values that must appear in the CV
+    """
+
+    def __init__(self, schema: Dict[str, Any], min_grounding: float = 0.8):
+        self.schema = schema
+        self.min_grounding = min_grounding
+        self._counts: collections.Counter = collections.Counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        data = record.get("json")
+        if isinstance(data, str) or data is None:
+            # Already normalized, or failed
+            return record
+        reason = validate_extraction(data, record.get("Text", ""), self.schema, self.min_grounding, record.get("repairs", ()))
+        if reason == EMPTY:
+            record["json"] = None
+            self._count(EMPTY)
+            return record
+        if reason:
+            record["validation"] = reason
+        data = clean_non_url_string(fill_json_schema(self.schema, data))
+        record["json"] = json.dumps(data)
+        self._count(reason or "valid")
+        return record
+
+    def _count(self, outcome: str) -> None:
+        with self._lock:
+            self._counts[outcome] += 1
+
+    def summary(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
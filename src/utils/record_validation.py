@@ -0,0 +1,87 @@
+"""Checks of the JSON a teacher extracted from a CV: schema conformance and grounding in the CV text."""
+
+from typing import Any, Iterable, Iterator
+
+from utils.json_repair import SCHEMA as SCHEMA_REPAIR, reconcile_with_schema
+
+# Reasons an extraction is invalid
+PARSE = "parse"
+EMPTY = "empty"
+SCHEMA = "schema"
+GROUNDING = "grounding"
+
+
+def normalize_text(text: str) -> str:
+    """Lowercases a text and collapses its whitespace, so values match the CV across line breaks."""
+    return " ".join(text.split()).lower()
+
+
+def leaf_strings(data: Any) -> Iterator[str]:
+    """Yields the non-empty string values of a JSON object, at any depth."""
+    if isinstance(data, dict):
+        for value in data.values():
+            yield from leaf_strings(value)
+    elif isinstance(data, list):
+        for item in data:
+            yield from leaf_strings(item)
+    elif isinstance(data, str) and data.strip():
+        yield data
+
+
+def grounding_ratio(data: Any, text: str) -> float:
+    """Share of the string values of an extraction that appear verbatim in the CV; 0.0 if there are none."""
+    normalized = normalize_text(text)
+    values = [normalize_text(value) for value in leaf_strings(data)]
+    if not values:
+        return 0.0
+    return sum(value in normalized for value in values) / len(values)
+
+
+def _field_count(schema: Any) -> int:
+    if isinstance(schema, dict):
+        return sum(_field_count(value_schema) for value_schema in schema.values())
+    return 1
+
+
+def _matched_fields(schema: Any, data: Any) -> float:
+    if isinstance(schema, dict):
+        if not isinstance(data, dict):
+            return 0.0
+        return sum(_matched_fields(value_schema, data[key]) for key, value_schema in schema.items() if key in data)
+    if isinstance(schema, list):
+        if not isinstance(data, list):
+            return 0.0
+        if not data:
+            return 1.0
+        item_schema = schema[0] if schema else "string"
+        return sum(_matched_fields(item_schema, item) / _field_count(item_schema) for item in data) / len(data)
+    return 1.0 if isinstance(data, str) else 0.0
+
+
+def schema_completeness(schema: Any, data: Any) -> float:
+    """Share of the schema fields present in an extraction with the right type, before any reconciliation.
+
+    A list field counts as one field, scored by the mean completeness of its items.
+    """
+    return _matched_fields(schema, data) / _field_count(schema)
+
+
+def validate_extraction(
+    data: Any, text: str, schema: Any, min_grounding: float = 0.8, repairs: Iterable[str] = ()
+) -> str | None:
+    """Returns why an extraction is invalid (PARSE, EMPTY, SCHEMA or GROUNDING), or None if it is valid.
+
+    An extraction without any non-empty value is EMPTY. The schema check requires
+    the extraction to conform to resume_json_schema.json as is: `repairs` are the
+    local repairs of the response, and a repaired response that had to be
+    reconciled with the schema fails it even though `data` now conforms.
+    """
+    if not isinstance(data, dict):
+        return PARSE
+    if next(leaf_strings(data), None) is None:
+        return EMPTY
+    if SCHEMA_REPAIR in repairs or reconcile_with_schema(schema, data)[1]:
+        return SCHEMA
+    if grounding_ratio(data, text) < min_grounding:
+        return GROUNDING
+    return None
@@ -0,0 +1,140 @@
+"""Persistent content-addressed cache of teacher model responses."""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """SQLite-backed cache of chat completions keyed by a hash of the full request.
+
+    Entries older than `max_age_seconds` are dropped, and once the cached content
+    exceeds `max_size_bytes` the least recently used entries are evicted. The
+    database runs in WAL mode, so several processes can share one cache file.
+
+    Args:
+        filepath: Path of the SQLite database
+        max_size_bytes: Total size of the cached responses to keep
+        max_age_seconds: Age after which an entry is dropped
+        evict_every: Number of insertions between two eviction passes
+    """
+
+    def __init__(
+        self,
+        filepath: str,
+        max_size_bytes: int = 2 * 1024 ** 3,
+        max_age_seconds: float = 30 * 24 * 3600,
+        evict_every: int = 1000
+    ):
+        self.filepath = filepath
+        self.max_size_bytes = max_size_bytes
+        self.max_age_seconds = max_age_seconds
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(filepath):
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        self._conn = sqlite3.connect(filepath, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                content TEXT NOT NULL,
+                usage TEXT,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(request_kwargs: Dict[str, Any]) -> str:
+        """Hashes everything that is sent to the API: model, messages, provider routing and sampling params."""
+        canonical = json.dumps(request_kwargs, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Dict[str, Any] | None:
+        """Returns the cached {"content", "usage"} of a request, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, usage, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None or now - row[2] > self.max_age_seconds:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return {"content": row[0], "usage": json.loads(row[1]) if row[1] else None}
+
+    def put(self, key: str, model: str, content: str, usage: Dict[str, Any] | None = None) -> None:
+        usage_str = json.dumps(usage) if usage else None
+        size = len(content) + len(usage_str or "")
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, content, usage_str, size, now, now)
+            )
+            self._conn.commit()
+            self._puts += 1
+            evict = self._puts % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """Drops expired entries, then the least recently used ones above the size limit."""
+        with self._lock:
+            removed = self._conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age_seconds,)
+            ).rowcount
+            total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total_size > self.max_size_bytes:
+                excess = total_size - self.max_size_bytes
+                freed = 0
+                keys = []
+                for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+                    keys.append((key,))
+                    freed += size
+                    if freed >= excess:
+                        break
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+                removed += len(keys)
+            self._conn.commit()
+        if removed:
+            logger.info(f"Evicted {removed} entries from the response cache {self.filepath}")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "size_bytes": size,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,230 @@
+"""Append-only JSONL store for the records generated by the teacher models."""
+
+import io
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _import_zstd():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError(
+            "zstd-compressed result stores need the `zstandard` package: pip install zstandard"
+        ) from e
+    return zstandard
+
+
+class JsonlResultStore:
+    """Append-only store with one JSON record per line.
+
+    Records are buffered and written with a single `fsync` every `fsync_every`
+    records (or `fsync_interval` seconds), so the cost of a checkpoint only
+    depends on the size of the new batch. Paths ending in `.zst` are written as
+    a sequence of zstd frames, one per flush.
+
+    Args:
+        filepath: Path of the store file
+        fsync_every: Number of buffered records that triggers a flush
+        fsync_interval: Seconds after which buffered records are flushed anyway
+        compression_level: zstd level used for `.zst` stores
+    """
+
+    def __init__(
+        self,
+        filepath: str,
+        fsync_every: int = 50,
+        fsync_interval: float = 30.0,
+        compression_level: int = 3
+    ):
+        self.filepath = filepath
+        self.compressed = filepath.endswith(".zst")
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.compression_level = compression_level
+        self._buffer: List[str] = []
+        self._last_flush = time.monotonic()
+        self._file = None
+
+    def __enter__(self) -> "JsonlResultStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def append(self, records: Iterable[Dict[str, Any]]) -> None:
+        """Buffers records and flushes them once the batch limits are reached."""
+        for record in records:
+            self._buffer.append(json.dumps(record, ensure_ascii=False) + "\n")
+        if (
+            len(self._buffer) >= self.fsync_every
+            or time.monotonic() - self._last_flush >= self.fsync_interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes the buffered records and fsyncs the file."""
+        if not self._buffer:
+            return
+        if self._file is None:
+            self._file = self._open_for_append()
+
+        data = "".join(self._buffer).encode("utf-8")
+        if self.compressed:
+            zstd = _import_zstd()
+            data = zstd.ZstdCompressor(level=self.compression_level).compress(data)
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def close(self) -> None:
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        """Yields the flushed records in insertion order, skipping a torn tail."""
+        if not os.path.exists(self.filepath):
+            return
+        for line in self._iter_lines():
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping corrupt record in {self.filepath}: {line[:80]!r}")
+
+    def processed_ids(self) -> Set[Any]:
+        """Returns the IDs of all the records in the store."""
+        return {record["ID"] for record in self.iter_records()}
+
+    def succeeded_ids(self) -> Set[Any]:
+        """Returns the IDs of the records that did not fail (with a "json")."""
+        return {record["ID"] for record in self.iter_records() if record.get("json") is not None}
+
+    def _iter_lines(self) -> Iterator[str]:
+        if self.compressed:
+            with open(self.filepath, "rb") as f:
+                data = f.read()
+            for frame, _ in self._iter_zstd_frames(data):
+                yield from io.StringIO(frame.decode("utf-8"))
+        else:
+            with open(self.filepath, encoding="utf-8") as f:
+                for line in f:
+                    # A line without a newline was torn by a crash mid-write
+                    if line.endswith("\n"):
+                        yield line
+
+    def _iter_zstd_frames(self, data: bytes) -> Iterator[tuple]:
+        """Yields (decompressed frame, end offset) for every complete frame."""
+        zstd = _import_zstd()
+        view = memoryview(data)
+        offset = 0
+        while offset < len(data):
+            decompressor = zstd.ZstdDecompressor().decompressobj()
+            try:
+                frame = decompressor.decompress(view[offset:])
+            except zstd.ZstdError:
+                logger.warning(f"Ignoring corrupt zstd frame at byte {offset} of {self.filepath}")
+                return
+            if not decompressor.eof:
+                logger.warning(f"Ignoring truncated zstd frame at byte {offset} of {self.filepath}")
+                return
+            offset = len(data) - len(decompressor.unused_data)
+            yield frame, offset
+
+    def _valid_length(self) -> int:
+        """Returns the byte length of the file up to the end of the last complete record."""
+        if self.compressed:
+            with open(self.filepath, "rb") as f:
+                data = f.read()
+            end = 0
+            for _, end in self._iter_zstd_frames(data):
+                pass
+            return end
+
+        with open(self.filepath, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            position = size
+            while position > 0:
+                chunk_size = min(1 << 16, position)
+                position -= chunk_size
+                f.seek(position)
+                newline = f.read(chunk_size).rfind(b"\n")
+                if newline != -1:
+                    return position + newline + 1
+            return 0
+
+    def _open_for_append(self):
+        if os.path.dirname(self.filepath):
+            os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+        if os.path.exists(self.filepath):
+            valid_length = self._valid_length()
+            if valid_length < os.path.getsize(self.filepath):
+                logger.warning(f"Truncating torn tail of {self.filepath} at byte {valid_length}")
+                with open(self.filepath, "r+b") as f:
+                    f.truncate(valid_length)
+        return open(self.filepath, "ab")
+
+
+def default_dataset_paths(training_ready: bool = False) -> Tuple[str, str]:
+    """Returns the (store, export) paths of the generated dataset, relative to PROJECT_ROOT.
+
+    Runs with --training_ready write where split_dataset.py reads, the others
+    where postprocess_created_dataset.py reads.
+    """
+    name = "structured_dataset" if training_ready else "orig_structured_dataset"
+    return f"data/{name}.jsonl", f"data/{name}.json"
+
+
+def export_json_array(store: JsonlResultStore, output_filepath: str) -> int:
+    """Writes the records of the store as a single JSON array and returns their count.
+
+    Records are streamed one at a time, so the export never holds the full dataset in memory.
+    """
+    count = 0
+    tmp_filepath = output_filepath + ".tmp"
+    with open(tmp_filepath, "w", encoding="utf-8") as f:
+        f.write("[")
+        for record in store.iter_records():
+            f.write(",\n" if count else "\n")
+            f.write(json.dumps(record, ensure_ascii=False))
+            count += 1
+        f.write("\n]\n")
+    os.replace(tmp_filepath, output_filepath)
+    return count
+
+
+def merge_result_files(filepaths: Iterable[str], store: JsonlResultStore) -> Dict[str, int]:
+    """Appends the records of other result files to `store`, keeping one record per `ID`.
+
+    Records whose ID is already in the store or in an earlier file are dropped.
+    Failed records (no "json") are left out so that a later run retries them,
+    unless another file has a successful record for the same ID.
+    """
+    seen = store.processed_ids()
+    failed: Set[Any] = set()
+    counts = {"added": 0, "duplicates": 0}
+    for filepath in filepaths:
+        for record in JsonlResultStore(filepath).iter_records():
+            if record["ID"] in seen:
+                counts["duplicates"] += 1
+            elif record.get("json") is None:
+                failed.add(record["ID"])
+            else:
+                store.append([record])
+                seen.add(record["ID"])
+                counts["added"] += 1
+    store.flush()
+    counts["failed"] = len(failed - seen)
+    return counts
@@ -0,0 +1,151 @@
+"""Retry scheduling of failed teacher requests without blocking the worker threads."""
+
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import random
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Tuple
+
+from utils.api_errors import get_retry_after, THROTTLED, SERVER_ERROR, UNAVAILABLE, TIMEOUT, CONNECTION
+
+logger = logging.getLogger(__name__)
+
+# Backoff growth factor, maximum delay and log message of each retryable error class
+RETRY_BACKOFF = {
+    UNAVAILABLE: (2.0, 300, "Provider unavailable (404)"),
+    THROTTLED: (1.5, 120, "Rate limit hit"),
+    SERVER_ERROR: (1.8, 180, "Server error"),
+    TIMEOUT: (1.8, 180, "Timeout"),
+    CONNECTION: (1.8, 180, "Connection error"),
+}
+
+
+def get_retry_delay(
+    error: Exception,
+    error_class: str,
+    attempt: int,
+    max_retries: int,
+    base_delay: float,
+    _id: Any,
+    jitter: float = 0.5
+) -> float | None:
+    """Returns the seconds to wait before retrying a failed request, or None if it should not be retried.
+
+    The exponential backoff of the error class is scaled by a random factor in
+    [1 - jitter, 1], so that requests that failed together do not retry together.
+    A Retry-After header sent by the server takes precedence, plus up to a second
+    of jitter.
+    """
+    if error_class in RETRY_BACKOFF and attempt < max_retries - 1:
+        factor, max_delay, message = RETRY_BACKOFF[error_class]
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, 1)
+        else:
+            delay = min(max_delay, base_delay * (factor ** attempt)) * random.uniform(1 - jitter, 1)
+        logger.warning(
+            f"{message} for {_id}, retrying in "
+            f"{delay:.1f}s (attempt {attempt + 1}/{max_retries})"
+        )
+        return delay
+
+    logger.error(f"Error for {_id}: {error}")
+    return None
+
+
+class RetryLater(Exception):
+    """Raised by a task to be run again from `attempt` once `delay` seconds have passed."""
+
+    def __init__(self, delay: float, attempt: int):
+        super().__init__(f"retry attempt {attempt} in {delay:.1f}s")
+        self.delay = delay
+        self.attempt = attempt
+
+
+class DelayQueue:
+    """Items ordered by the time they become due. Not thread-safe: owned by the dispatching thread."""
+
+    def __init__(self):
+        self._heap: list = []
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def put(self, item: Any, delay: float) -> None:
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), item))
+
+    def pop_due(self) -> Any | None:
+        """Removes and returns the earliest item whose delay has passed, or None."""
+        if self._heap and self._heap[0][0] <= time.monotonic():
+            return heapq.heappop(self._heap)[2]
+        return None
+
+    def time_until_next(self) -> float | None:
+        """Seconds until the earliest item is due, or None if the queue is empty."""
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - time.monotonic())
+
+
+class RetryScheduler:
+    """Runs tasks on a thread pool and re-submits the ones that raise `RetryLater` once they are due.
+
+    A backing-off task waits in a `DelayQueue` instead of sleeping in its worker,
+    so the workers keep taking fresh items. Due retries are submitted before
+    fresh items, and at most `max_pending` tasks are submitted at a time.
+
+    Args:
+        executor: Pool that runs `fn(item, attempt)`
+        max_pending: Maximum submitted tasks, normally the number of workers
+    """
+
+    def __init__(self, executor: concurrent.futures.Executor, max_pending: int):
+        self.executor = executor
+        self.max_pending = max_pending
+        self.retries = DelayQueue()
+        self.scheduled = 0
+        self.peak_delayed = 0
+
+    def _next_item(self, fresh: Iterator[Any]) -> Tuple[Any, int] | None:
+        due = self.retries.pop_due()
+        if due is not None:
+            return due
+        for item in fresh:
+            return item, 0
+        return None
+
+    def run(
+        self, fn: Callable[[Any, int], Any], items: Iterable[Any]
+    ) -> Iterator[Tuple[Any, concurrent.futures.Future]]:
+        """Yields each item with the future of its final attempt, in completion order."""
+        fresh = iter(items)
+        in_flight: Dict[concurrent.futures.Future, Any] = {}
+        while True:
+            while len(in_flight) < self.max_pending:
+                entry = self._next_item(fresh)
+                if entry is None:
+                    break
+                item, attempt = entry
+                in_flight[self.executor.submit(fn, item, attempt)] = item
+            if not in_flight and not self.retries:
+                return
+
+            # Without running tasks this only sleeps until the next retry is due
+            done, _ = concurrent.futures.wait(
+                in_flight, timeout=self.retries.time_until_next(), return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                item = in_flight.pop(future)
+                error = future.exception()
+                if isinstance(error, RetryLater):
+                    self.retries.put((item, error.attempt), error.delay)
+                    self.scheduled += 1
+                    self.peak_delayed = max(self.peak_delayed, len(self.retries))
+                    continue
+                yield item, future
+
+    def summary(self) -> str:
+        return f"{self.scheduled} retries scheduled, at most {self.peak_delayed} waiting at once"
@@ -0,0 +1,215 @@
+"""Projection of the tokens, cost and wall-clock time of a generation run, without sending a request."""
+
+import concurrent.futures
+import json
+from typing import Any, Callable, Dict, List, Sequence
+
+import numpy as np
+
+from utils.dataset_index import DatasetIndex
+from utils.model_catalog import compute_cost, get_model_limits
+from utils.rate_limiting import CHARS_PER_TOKEN
+
+# Chat-template tokens per message, as in `estimate_tokens`
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class TokenCounter:
+    """Counts the tokens of a text with the tokenizer named by `spec`, loaded on first use.
+
+    Specs: "chars" or "chars:<chars per token>" for the ratio estimator of the
+    rate limiter, "tiktoken:<encoding>" (e.g. o200k_base) and "hf:<name or path>"
+    for a Hugging Face tokenizer, e.g. the student model's. The counter is
+    pickled to the worker processes without its tokenizer.
+    """
+
+    def __init__(self, spec: str = "chars"):
+        self.spec = spec
+        kind, _, self.argument = spec.partition(":")
+        if kind not in ("chars", "tiktoken", "hf"):
+            raise ValueError(f"Unknown tokenizer {spec!r}; use chars[:ratio], tiktoken:<encoding> or hf:<name>")
+        self.kind = kind
+        self.chars_per_token = float(self.argument) if kind == "chars" and self.argument else CHARS_PER_TOKEN
+        self._encode: Callable[[str], Any] | None = None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {**self.__dict__, "_encode": None}
+
+    def _load(self) -> Callable[[str], Any]:
+        if self.kind == "tiktoken":
+            import tiktoken
+            encoding = tiktoken.get_encoding(self.argument)
+            return lambda text: encoding.encode(text, disallowed_special=())
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(self.argument)
+        return lambda text: tokenizer(text, add_special_tokens=False)["input_ids"]
+
+    @property
+    def is_ratio(self) -> bool:
+        return self.kind == "chars"
+
+    def __call__(self, text: str) -> int:
+        if self.is_ratio:
+            return int(len(text) / self.chars_per_token)
+        if self._encode is None:
+            self._encode = self._load()
+        return len(self._encode(text))
+
+    def count_messages(self, messages: Sequence[Dict[str, Any]]) -> int:
+        tokens = 0
+        for message in messages:
+            content = message["content"]
+            text = content if isinstance(content, str) else "".join(part.get("text", "") for part in content)
+            tokens += self(text) + MESSAGE_OVERHEAD_TOKENS
+        return tokens
+
+
+def _count_chunk(filepath: str, offsets: List[int], lengths: List[int], text_column: str, counter: TokenCounter) -> List[int]:
+    counts = []
+    with open(filepath, "rb") as f:
+        for offset, length in zip(offsets, lengths):
+            f.seek(offset)
+            counts.append(counter(json.loads(f.read(length)).get(text_column) or ""))
+    return counts
+
+
+def count_cv_tokens(
+    index: DatasetIndex,
+    positions: Sequence[int],
+    counter: TokenCounter,
+    text_column: str = "Text",
+    workers: int = 1,
+    chunk_size: int = 2000
+) -> np.ndarray:
+    """Returns the tokens of the CV message of each position, message overhead included.
+
+    The ratio estimator only needs the text lengths kept by the index. A real
+    tokenizer reads and tokenizes the records in `workers` processes, each
+    reading its chunk of the file by offset.
+    """
+    if counter.is_ratio:
+        lengths = np.asarray(index.text_lengths, dtype=np.int64)[np.asarray(positions, dtype=np.int64)]
+        return (lengths / counter.chars_per_token).astype(np.int64) + MESSAGE_OVERHEAD_TOKENS
+    chunks = [positions[start:start + chunk_size] for start in range(0, len(positions), chunk_size)]
+    arguments = [
+        (index.filepath, [index.offsets[p] for p in chunk], [index.lengths[p] for p in chunk], text_column, counter)
+        for chunk in chunks
+    ]
+    if workers <= 1 or len(chunks) <= 1:
+        parts = [_count_chunk(*chunk_arguments) for chunk_arguments in arguments]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(_count_chunk, *zip(*arguments)))
+    return np.fromiter((count for part in parts for count in part), dtype=np.int64, count=len(positions)) + MESSAGE_OVERHEAD_TOKENS
+
+
+def pack_requests(cv_tokens: np.ndarray, max_pack_size: int, max_input_tokens: int, max_output_tokens: int) -> np.ndarray:
+    """Returns the number of CVs of each request, packed greedily in input order like `CvPacker`."""
+    sizes = []
+    # The completion of a CV is estimated as long as the CV, so one sum tracks both limits
+    size = pack_tokens = 0
+    for tokens in cv_tokens.tolist():
+        if size and (
+            size == max_pack_size or pack_tokens + tokens > max_input_tokens or pack_tokens + tokens > max_output_tokens
+        ):
+            sizes.append(size)
+            size = pack_tokens = 0
+        size += 1
+        pack_tokens += tokens
+    if size:
+        sizes.append(size)
+    return np.asarray(sizes, dtype=np.int64)
+
+
+def plan_run(
+    ids: Sequence[Any],
+    cv_tokens: np.ndarray,
+    prefix_tokens: int,
+    model_name: str,
+    concurrency: int,
+    rpm_limit: int | None,
+    input_tpm_limit: int | None = None,
+    output_tpm_limit: int | None = None,
+    pack_sizes: np.ndarray | None = None,
+    prompt_cache: bool = False,
+    latency: float = 2.0,
+    tokens_per_sec: float = 100.0,
+    cached_prefix_tokens: int = 0,
+) -> Dict[str, Any]:
+    """Projects the tokens, cost and duration of a run, and flags the CVs over the model's limits.
+
+    Like the engines, the completion of a CV is estimated as long as the CV.
+    A request is assumed to take `latency` seconds to its first token plus
+    its completion at `tokens_per_sec`, so the run lasts as long as the
+    slower of the rate limits and the concurrency let it. With `prompt_cache`,
+    `cached_prefix_tokens` of every request but the first are billed as cached.
+    """
+    limits = get_model_limits(model_name)
+    num_requests = len(cv_tokens) if pack_sizes is None else len(pack_sizes)
+    input_tokens = int(cv_tokens.sum()) + prefix_tokens * num_requests
+    output_tokens = int(cv_tokens.sum())
+    cached_tokens = cached_prefix_tokens * max(num_requests - 1, 0) if prompt_cache else 0
+    cost = compute_cost(model_name, {
+        "prompt_tokens": input_tokens,
+        "completion_tokens": output_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached_tokens},
+    })
+
+    # The whole CV is repeated in the completion, so both limits apply to each CV on its own
+    over_context = cv_tokens * 2 + prefix_tokens > limits["context"]
+    over_output = cv_tokens > limits["max_output"]
+    flagged = np.flatnonzero(over_context | over_output)
+
+    busy_seconds = num_requests * latency + output_tokens / tokens_per_sec
+    bounds = {"concurrency": busy_seconds / max(concurrency, 1)}
+    if rpm_limit:
+        bounds["rpm"] = num_requests / rpm_limit * 60
+    if input_tpm_limit:
+        bounds["input_tpm"] = input_tokens / input_tpm_limit * 60
+    if output_tpm_limit:
+        bounds["output_tpm"] = output_tokens / output_tpm_limit * 60
+    binding = max(bounds, key=bounds.get)
+
+    return {
+        "model": model_name,
+        "entries": len(cv_tokens),
+        "requests": num_requests,
+        "prefix_tokens": prefix_tokens,
+        "cv_tokens": {
+            "mean": float(cv_tokens.mean()) if len(cv_tokens) else 0.0,
+            "p50": float(np.percentile(cv_tokens, 50)) if len(cv_tokens) else 0.0,
+            "p99": float(np.percentile(cv_tokens, 99)) if len(cv_tokens) else 0.0,
+            "max": int(cv_tokens.max()) if len(cv_tokens) else 0,
+        },
+        "input_tokens": input_tokens,
+        "cached_input_tokens": cached_tokens,
+        "output_tokens": output_tokens,
+        "cost": cost,
+        "seconds": bounds[binding],
+        "seconds_by_limit": bounds,
+        "binding_limit": binding,
+        "limits": limits,
+        "over_limit_ids": [ids[i] for i in flagged.tolist()],
+    }
+
+
+def format_plan(plan: Dict[str, Any]) -> List[str]:
+    """Returns the lines of a readable summary of `plan_run`."""
+    hours, remainder = divmod(plan["seconds"], 3600)
+    cv = plan["cv_tokens"]
+    lines = [
+        f"Dry run on {plan['model']}: {plan['entries']} entries in {plan['requests']} requests",
+        f"CV tokens: mean {cv['mean']:.0f}, p50 {cv['p50']:.0f}, p99 {cv['p99']:.0f}, max {cv['max']}; "
+        f"prefix {plan['prefix_tokens']} tokens per request",
+        f"Projected {plan['input_tokens']:,} input tokens ({plan['cached_input_tokens']:,} cached), "
+        f"{plan['output_tokens']:,} output tokens, ${plan['cost']:.2f}",
+        f"Projected duration {int(hours)}h {remainder / 60:.0f}m, bound by {plan['binding_limit']} "
+        f"({', '.join(f'{name} {seconds / 60:.0f}m' for name, seconds in plan['seconds_by_limit'].items())})",
+    ]
+    over = plan["over_limit_ids"]
+    if over:
+        lines.append(
+            f"{len(over)} CVs would exceed the context ({plan['limits']['context']}) or output "
+            f"({plan['limits']['max_output']}) limit of the model, e.g. IDs {over[:10]}"
+        )
+    return lines
@@ -0,0 +1,335 @@
+"""Incremental validation of streamed teacher responses against the resume JSON schema."""
+
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Tuple
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from openai.types.completion_usage import CompletionUsage
+
+# Characters inside a JSON string that end the run of plain characters
+_STRING_SPECIAL = re.compile(r'["\\]')
+_LITERAL_CHARS = set("-+.0123456789eEtruefalsn")
+_WHITESPACE = set(" \t\r\n")
+# Markdown fences that `extract_json_from_response` strips around the JSON
+_FENCE_PREFIX = "```json"
+_FENCE_SUFFIX = "```"
+# Reason of a stream aborted through `cancelled`, not because of its content
+CANCELLED = "cancelled"
+
+
+class StreamAborted(Exception):
+    """Raised when a streamed response goes off-schema or over its size budget."""
+
+    def __init__(self, reason: str, content: str = "", usage: CompletionUsage | None = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.content = content
+        self.usage = usage
+
+
+class _Frame:
+    """An open object or array and its position in the schema."""
+
+    __slots__ = ("is_object", "schema", "state", "keys", "key", "items", "last_item", "repeats")
+
+    def __init__(self, is_object: bool, schema: Any):
+        self.is_object = is_object
+        self.schema = schema
+        # object: key_or_end, key, colon, value, comma_or_end; array: value_or_end, value, comma_or_end
+        self.state = "key_or_end" if is_object else "value_or_end"
+        self.keys = set()
+        self.key = None
+        self.items = 0
+        self.last_item = None
+        self.repeats = 0
+
+
+class SchemaStreamValidator:
+    """Incremental JSON tokenizer that checks a partial response against a schema.
+
+    The schema uses the format of `resume_json_schema.json`: a dict lists the
+    allowed keys, a one-element list is an array of that element and "string"
+    is a scalar. `feed` raises `StreamAborted` as soon as the output has an
+    unknown or duplicate key, a container where the schema has another type,
+    prose around the JSON, more than `max_chars` characters, more than
+    `max_array_items` items in one array, or the same scalar repeated
+    `max_repeats` times in a row.
+
+    Args:
+        schema: The JSON schema, e.g. the contents of resume_json_schema.json
+        max_chars: Size budget of the response
+        max_array_items: Largest array allowed
+        max_repeats: Consecutive identical array items treated as a generation loop
+    """
+
+    def __init__(self, schema: Dict[str, Any], max_chars: int, max_array_items: int = 200, max_repeats: int = 8):
+        self.schema = schema
+        self.max_chars = max_chars
+        self.max_array_items = max_array_items
+        self.max_repeats = max_repeats
+        self.chars = 0
+        self._stack: List[_Frame] = []
+        # prefix -> body -> suffix
+        self._phase = "prefix"
+        self._outside = ""
+        self._in_string = False
+        self._escape = False
+        self._string: List[str] = []
+        self._literal: List[str] = []
+
+    @property
+    def complete(self) -> bool:
+        """True once the root object is closed."""
+        return self._phase == "suffix"
+
+    def feed(self, text: str) -> None:
+        self.chars += len(text)
+        if self.chars > self.max_chars:
+            raise StreamAborted(f"response exceeds the budget of {self.max_chars} characters")
+
+        i = 0
+        n = len(text)
+        while i < n:
+            if self._in_string:
+                i = self._scan_string(text, i)
+                continue
+
+            char = text[i]
+            if self._phase != "body":
+                self._feed_outside(char)
+                i += 1
+                continue
+
+            if self._literal:
+                if char in _LITERAL_CHARS:
+                    self._literal.append(char)
+                    i += 1
+                    continue
+                literal = "".join(self._literal)
+                self._literal = []
+                self._end_value(literal)
+
+            if char in _WHITESPACE:
+                i += 1
+                continue
+            self._feed_structural(char)
+            i += 1
+
+    def _scan_string(self, text: str, i: int) -> int:
+        """Consumes string characters from `text[i:]` and returns the index after them."""
+        if self._escape:
+            self._string.append(text[i])
+            self._escape = False
+            return i + 1
+        match = _STRING_SPECIAL.search(text, i)
+        if match is None:
+            self._string.append(text[i:])
+            return len(text)
+        end = match.start()
+        self._string.append(text[i:end])
+        if text[end] == "\\":
+            self._string.append("\\")
+            self._escape = True
+            return end + 1
+        self._in_string = False
+        value = "".join(self._string)
+        self._string = []
+        frame = self._stack[-1]
+        if frame.is_object and frame.state in ("key_or_end", "key"):
+            self._check_key(frame, value)
+        else:
+            self._end_value(value)
+        return end + 1
+
+    def _feed_outside(self, char: str) -> None:
+        if char in _WHITESPACE:
+            return
+        if self._phase == "prefix":
+            if char == "{":
+                self._phase = "body"
+                self._stack.append(_Frame(True, self.schema))
+                return
+            self._outside += char
+            if not _FENCE_PREFIX.startswith(self._outside):
+                raise StreamAborted(f"text before the JSON object: {self._outside[:40]!r}")
+        else:
+            self._outside += char
+            if not _FENCE_SUFFIX.startswith(self._outside):
+                raise StreamAborted(f"text after the JSON object: {self._outside[:40]!r}")
+
+    def _feed_structural(self, char: str) -> None:
+        frame = self._stack[-1]
+        state = frame.state
+        if frame.is_object:
+            if state in ("key_or_end", "key"):
+                if char == '"':
+                    self._in_string = True
+                elif char == "}" and state == "key_or_end":
+                    self._close()
+                else:
+                    raise StreamAborted(f"unexpected {char!r} where a key was expected")
+            elif state == "colon":
+                if char != ":":
+                    raise StreamAborted(f"unexpected {char!r} after key '{frame.key}'")
+                frame.state = "value"
+            elif state == "value":
+                self._start_value(char, self._child_schema(frame))
+            elif char == ",":
+                frame.state = "key"
+            elif char == "}":
+                self._close()
+            else:
+                raise StreamAborted(f"unexpected {char!r} after the value of '{frame.key}'")
+        else:
+            if state in ("value_or_end", "value"):
+                if char == "]" and state == "value_or_end":
+                    self._close()
+                else:
+                    self._start_value(char, frame.schema)
+            elif char == ",":
+                frame.state = "value"
+            elif char == "]":
+                self._close()
+            else:
+                raise StreamAborted(f"unexpected {char!r} in an array")
+
+    def _child_schema(self, frame: _Frame) -> Any:
+        if isinstance(frame.schema, dict):
+            return frame.schema.get(frame.key)
+        return None
+
+    def _check_key(self, frame: _Frame, key: str) -> None:
+        if isinstance(frame.schema, dict) and key not in frame.schema:
+            raise StreamAborted(f"key '{key}' is not in the schema")
+        if key in frame.keys:
+            raise StreamAborted(f"duplicate key '{key}'")
+        frame.keys.add(key)
+        frame.key = key
+        frame.state = "colon"
+
+    def _start_value(self, char: str, schema: Any) -> None:
+        if char == "{":
+            if schema is not None and not isinstance(schema, dict):
+                raise StreamAborted(f"object where the schema has {self._describe(schema)}")
+            self._stack.append(_Frame(True, schema))
+        elif char == "[":
+            if schema is not None and not isinstance(schema, list):
+                raise StreamAborted(f"array where the schema has {self._describe(schema)}")
+            self._stack.append(_Frame(False, schema[0] if schema else None))
+        elif char == '"':
+            self._in_string = True
+        elif char in _LITERAL_CHARS:
+            self._literal.append(char)
+        else:
+            raise StreamAborted(f"unexpected {char!r} where a value was expected")
+
+    def _end_value(self, value: str | None) -> None:
+        """Moves the enclosing container past a finished value; `value` is the scalar, or None for a container."""
+        frame = self._stack[-1]
+        frame.state = "comma_or_end"
+        if frame.is_object:
+            return
+        frame.items += 1
+        if frame.items > self.max_array_items:
+            raise StreamAborted(f"array exceeds {self.max_array_items} items")
+        if value is not None and value == frame.last_item:
+            frame.repeats += 1
+            if frame.repeats >= self.max_repeats:
+                raise StreamAborted(f"item {value[:40]!r} repeated {frame.repeats + 1} times")
+        else:
+            frame.repeats = 0
+        frame.last_item = value
+
+    def _close(self) -> None:
+        self._stack.pop()
+        if self._stack:
+            self._end_value(None)
+        else:
+            self._phase = "suffix"
+            self._outside = ""
+
+    @staticmethod
+    def _describe(schema: Any) -> str:
+        if isinstance(schema, dict):
+            return "an object"
+        if isinstance(schema, list):
+            return "an array"
+        return f"a {schema}"
+
+
+def build_completion(chunk: ChatCompletionChunk | None, content: str, finish_reason: str | None, usage: Any) -> ChatCompletion:
+    """Assembles the streamed chunks into the `ChatCompletion` the non-streaming path returns."""
+    return ChatCompletion.model_validate({
+        "id": chunk.id if chunk else "",
+        "object": "chat.completion",
+        "created": chunk.created if chunk else int(time.time()),
+        "model": chunk.model if chunk else "",
+        "choices": [{
+            "index": 0,
+            "finish_reason": finish_reason or "stop",
+            "message": {"role": "assistant", "content": content},
+        }],
+        "usage": usage.model_dump() if usage is not None else None,
+    })
+
+
+def _consume_chunk(chunk: ChatCompletionChunk, validator: SchemaStreamValidator, parts: List[str]) -> Tuple[str | None, Any]:
+    finish_reason = None
+    for choice in chunk.choices:
+        if choice.delta and choice.delta.content:
+            parts.append(choice.delta.content)
+            validator.feed(choice.delta.content)
+        finish_reason = choice.finish_reason or finish_reason
+    return finish_reason, chunk.usage
+
+
+def _estimate_usage(parts: List[str], chars_per_token: float = 4) -> CompletionUsage:
+    """Usage of an aborted stream, which ends before the provider reports it; the prompt is unknown."""
+    completion_tokens = int(sum(len(part) for part in parts) / chars_per_token)
+    return CompletionUsage(prompt_tokens=0, completion_tokens=completion_tokens, total_tokens=completion_tokens)
+
+
+def collect_stream(
+    stream: Iterator[ChatCompletionChunk], validator: SchemaStreamValidator, cancelled: threading.Event | None = None
+) -> ChatCompletion:
+    """Reads a streamed completion, closing the stream and raising `StreamAborted` on a bad generation.
+
+    Setting `cancelled` from another thread aborts the stream at its next chunk
+    the same way, e.g. for the loser of a hedge.
+    """
+    parts: List[str] = []
+    last_chunk = finish_reason = usage = None
+    with stream:
+        try:
+            for chunk in stream:
+                if cancelled is not None and cancelled.is_set():
+                    raise StreamAborted(CANCELLED)
+                last_chunk = chunk
+                chunk_finish_reason, chunk_usage = _consume_chunk(chunk, validator, parts)
+                finish_reason = chunk_finish_reason or finish_reason
+                usage = chunk_usage or usage
+        except StreamAborted as e:
+            e.content = "".join(parts)
+            e.usage = _estimate_usage(parts)
+            raise
+    return build_completion(last_chunk, "".join(parts), finish_reason, usage)
+
+
+async def collect_stream_async(stream: AsyncIterator[ChatCompletionChunk], validator: SchemaStreamValidator) -> ChatCompletion:
+    """Asyncio counterpart of `collect_stream`."""
+    parts: List[str] = []
+    last_chunk = finish_reason = usage = None
+    async with stream:
+        try:
+            async for chunk in stream:
+                last_chunk = chunk
+                chunk_finish_reason, chunk_usage = _consume_chunk(chunk, validator, parts)
+                finish_reason = chunk_finish_reason or finish_reason
+                usage = chunk_usage or usage
+        except StreamAborted as e:
+            e.content = "".join(parts)
+            e.usage = _estimate_usage(parts)
+            raise
+    return build_completion(last_chunk, "".join(parts), finish_reason, usage)
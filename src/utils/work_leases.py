@@ -0,0 +1,332 @@
+"""Lease-based distribution of the dataset generation over several processes or machines.
+
+The input IDs are split into fixed shards of consecutive IDs. A worker claims
+a shard by taking a lease that expires after `ttl` seconds, renews the lease
+while it works, and marks the shard done at the end. The lease of a worker
+that crashed expires and the shard is claimed again by another worker.
+"""
+
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Sequence
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+
+
+@dataclass
+class Lease:
+    """A shard of IDs `first_id`..`last_id` (inclusive) held by `owner`.
+
+    `token` grows with every claim of the shard, so a worker whose lease expired
+    and was claimed again cannot renew it or mark the shard done.
+    """
+    shard_id: int
+    first_id: Any
+    last_id: Any
+    owner: str
+    token: int
+    expires_at: float
+
+    def contains(self, _id: Any) -> bool:
+        return self.first_id <= _id <= self.last_id
+
+
+def plan_shards(ids: Sequence[Any], shard_size: int) -> List[Dict[str, Any]]:
+    """Splits the sorted IDs into shards of `shard_size` IDs.
+
+    Every worker must plan over the same full input, so that all of them agree on the shards.
+    """
+    ordered = sorted(set(ids))
+    return [
+        {"shard_id": i, "first_id": chunk[0], "last_id": chunk[-1]}
+        for i, chunk in enumerate(
+            ordered[start:start + shard_size] for start in range(0, len(ordered), shard_size)
+        )
+    ]
+
+
+class LeaseBackend:
+    """Storage of the shards and their leases. Every method is atomic across processes."""
+
+    def add_shards(self, shards: List[Dict[str, Any]]) -> int:
+        """Adds the shards that are not stored yet and returns their number."""
+        raise NotImplementedError
+
+    def claim(self, owner: str, ttl: float) -> Lease | None:
+        """Leases the first pending or expired shard to `owner`, or returns None if there is none."""
+        raise NotImplementedError
+
+    def renew(self, lease: Lease, ttl: float) -> bool:
+        """Extends a lease; returns False if it was lost to another worker."""
+        raise NotImplementedError
+
+    def complete(self, lease: Lease) -> bool:
+        """Marks the shard of a lease as done; returns False if the lease was lost."""
+        raise NotImplementedError
+
+    def release(self, lease: Lease) -> None:
+        """Gives a shard back without finishing it, e.g. when the budget of the run is exhausted."""
+        raise NotImplementedError
+
+    def status(self) -> Dict[str, int]:
+        """Returns the number of pending, leased, expired and done shards."""
+        raise NotImplementedError
+
+
+class SqliteLeaseBackend(LeaseBackend):
+    """Leases in a SQLite database, for workers on one machine or sharing a local disk.
+
+    SQLite locking is unreliable on network filesystems; use `FileLeaseBackend`
+    on a shared mount for workers on several machines.
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        if os.path.dirname(filepath):
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        # Autocommit mode, so that `BEGIN IMMEDIATE` starts the write transaction of a claim
+        self._conn = sqlite3.connect(filepath, check_same_thread=False, timeout=60, isolation_level=None)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS shards (
+                shard_id INTEGER PRIMARY KEY,
+                first_id TEXT NOT NULL,
+                last_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                owner TEXT,
+                token INTEGER NOT NULL DEFAULT 0,
+                expires_at REAL NOT NULL DEFAULT 0
+            )"""
+        )
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def add_shards(self, shards: List[Dict[str, Any]]) -> int:
+        with self._transaction() as conn:
+            return conn.executemany(
+                "INSERT OR IGNORE INTO shards (shard_id, first_id, last_id, status) VALUES (?, ?, ?, ?)",
+                [(s["shard_id"], json.dumps(s["first_id"]), json.dumps(s["last_id"]), PENDING) for s in shards]
+            ).rowcount
+
+    def claim(self, owner: str, ttl: float) -> Lease | None:
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                """SELECT shard_id, first_id, last_id, token FROM shards
+                WHERE status = ? OR (status = ? AND expires_at < ?)
+                ORDER BY shard_id LIMIT 1""",
+                (PENDING, LEASED, now)
+            ).fetchone()
+            if row is None:
+                return None
+            shard_id, first_id, last_id, token = row
+            conn.execute(
+                "UPDATE shards SET status = ?, owner = ?, token = ?, expires_at = ? WHERE shard_id = ?",
+                (LEASED, owner, token + 1, now + ttl, shard_id)
+            )
+        return Lease(shard_id, json.loads(first_id), json.loads(last_id), owner, token + 1, now + ttl)
+
+    def renew(self, lease: Lease, ttl: float) -> bool:
+        expires_at = time.time() + ttl
+        with self._transaction() as conn:
+            renewed = conn.execute(
+                "UPDATE shards SET expires_at = ? WHERE shard_id = ? AND token = ? AND status = ?",
+                (expires_at, lease.shard_id, lease.token, LEASED)
+            ).rowcount
+        if renewed:
+            lease.expires_at = expires_at
+        return bool(renewed)
+
+    def complete(self, lease: Lease) -> bool:
+        with self._transaction() as conn:
+            return bool(conn.execute(
+                "UPDATE shards SET status = ?, expires_at = 0 WHERE shard_id = ? AND token = ? AND status = ?",
+                (DONE, lease.shard_id, lease.token, LEASED)
+            ).rowcount)
+
+    def release(self, lease: Lease) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE shards SET status = ?, owner = NULL, expires_at = 0 WHERE shard_id = ? AND token = ? AND status = ?",
+                (PENDING, lease.shard_id, lease.token, LEASED)
+            )
+
+    def status(self) -> Dict[str, int]:
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT CASE WHEN status = ? AND expires_at < ? THEN 'expired' ELSE status END, COUNT(*)
+                FROM shards GROUP BY 1""",
+                (LEASED, now)
+            ).fetchall()
+        return {PENDING: 0, LEASED: 0, "expired": 0, DONE: 0, **dict(rows)}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class FileLeaseBackend(LeaseBackend):
+    """Leases in a JSON file guarded by an `fcntl` lock, for workers on several machines sharing a mount.
+
+    POSIX locks work over NFS (v4, or v3 with lockd). Every operation rewrites
+    the file, which is fine for the few thousand shards of a corpus.
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.lock_filepath = filepath + ".lock"
+        if os.path.dirname(filepath):
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked_state(self, write: bool = True) -> Iterator[Dict[str, Any]]:
+        with open(self.lock_filepath, "a") as lock_file:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX)
+            try:
+                state = {"shards": {}}
+                if os.path.exists(self.filepath):
+                    with open(self.filepath) as f:
+                        state = json.load(f)
+                yield state
+                if write:
+                    tmp_filepath = self.filepath + ".tmp"
+                    with open(tmp_filepath, "w") as f:
+                        json.dump(state, f)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp_filepath, self.filepath)
+            finally:
+                fcntl.lockf(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _owns(state: Dict[str, Any], lease: Lease) -> Dict[str, Any] | None:
+        shard = state["shards"].get(str(lease.shard_id))
+        if shard and shard["token"] == lease.token and shard["status"] == LEASED:
+            return shard
+        return None
+
+    def add_shards(self, shards: List[Dict[str, Any]]) -> int:
+        added = 0
+        with self._locked_state() as state:
+            for s in shards:
+                if str(s["shard_id"]) not in state["shards"]:
+                    state["shards"][str(s["shard_id"])] = {
+                        **s, "status": PENDING, "owner": None, "token": 0, "expires_at": 0
+                    }
+                    added += 1
+        return added
+
+    def claim(self, owner: str, ttl: float) -> Lease | None:
+        now = time.time()
+        with self._locked_state() as state:
+            for shard in sorted(state["shards"].values(), key=lambda s: s["shard_id"]):
+                if shard["status"] == PENDING or (shard["status"] == LEASED and shard["expires_at"] < now):
+                    shard.update(status=LEASED, owner=owner, token=shard["token"] + 1, expires_at=now + ttl)
+                    return Lease(shard["shard_id"], shard["first_id"], shard["last_id"], owner, shard["token"], now + ttl)
+        return None
+
+    def renew(self, lease: Lease, ttl: float) -> bool:
+        with self._locked_state() as state:
+            shard = self._owns(state, lease)
+            if shard is None:
+                return False
+            shard["expires_at"] = lease.expires_at = time.time() + ttl
+        return True
+
+    def complete(self, lease: Lease) -> bool:
+        with self._locked_state() as state:
+            shard = self._owns(state, lease)
+            if shard is None:
+                return False
+            shard.update(status=DONE, expires_at=0)
+        return True
+
+    def release(self, lease: Lease) -> None:
+        with self._locked_state() as state:
+            shard = self._owns(state, lease)
+            if shard is not None:
+                shard.update(status=PENDING, owner=None, expires_at=0)
+
+    def status(self) -> Dict[str, int]:
+        now = time.time()
+        counts = {PENDING: 0, LEASED: 0, "expired": 0, DONE: 0}
+        with self._locked_state(write=False) as state:
+            for shard in state["shards"].values():
+                expired = shard["status"] == LEASED and shard["expires_at"] < now
+                counts["expired" if expired else shard["status"]] += 1
+        return counts
+
+    def close(self) -> None:
+        pass
+
+
+def create_lease_backend(backend: str, filepath: str) -> LeaseBackend:
+    if backend == "sqlite":
+        return SqliteLeaseBackend(filepath)
+    if backend == "file":
+        return FileLeaseBackend(filepath)
+    raise ValueError(f"Unknown lease backend: {backend}")
+
+
+class LeaseKeeper:
+    """Renews a lease from a background thread every `ttl / 3` seconds while the shard is processed.
+
+    `lost` is set once a renewal fails, after which the worker should stop
+    working on the shard: another worker owns it now.
+
+    Args:
+        backend: Lease store
+        lease: The lease to keep
+        ttl: Lease duration granted by each renewal
+    """
+
+    def __init__(self, backend: LeaseBackend, lease: Lease, ttl: float):
+        self.backend = backend
+        self.lease = lease
+        self.ttl = ttl
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{lease.shard_id}", daemon=True)
+
+    def __enter__(self) -> "LeaseKeeper":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                renewed = self.backend.renew(self.lease, self.ttl)
+            except Exception as e:
+                # A transient storage error; the lease is only lost once it expires
+                logger.warning(f"Could not renew the lease of shard {self.lease.shard_id}: {e}")
+                renewed = time.time() < self.lease.expires_at
+            if not renewed:
+                logger.error(f"Lost the lease of shard {self.lease.shard_id}")
+                self.lost.set()
+                return